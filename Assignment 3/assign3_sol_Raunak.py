@@ -13,6 +13,15 @@ from PyQt5 import Qt
 
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 
+from coalesce import RENDER_INTERVAL, CoalescedCall
+from cut_planes import CutPlanes
+from isosurface_cache import IsosurfaceCache
+from isosurface_index import MinMaxBlockIndex
+
+
+# Memory budget of the cache of extracted iso-surfaces, in bytes
+ISOSURFACE_CACHE_BYTES = 256 * 1024 * 1024
+
 
 '''
     The Qt MainWindow class
@@ -77,6 +86,17 @@ class MainWindow(Qt.QMainWindow):
         self.bwLut.SetHueRange(0, 0)
         self.bwLut.SetValueRange(0, 1)
         self.bwLut.Build()  # effective built
+
+        # The XY, XZ and YZ cut planes share one colour-mapped volume
+        self.cut_planes = CutPlanes(self.ren, self.bwLut)
+
+        # Slider drags re-render at a capped rate and recompute the
+        # iso-surface once for the latest threshold (see coalesce.py)
+        self.request_render = CoalescedCall(self.render, RENDER_INTERVAL, self)
+        self.coalesced_isosurface = CoalescedCall(self.extract_one_isosurface, 0, self)
+
+        # Surfaces already extracted from the loaded volume, by threshold
+        self.isosurface_cache = IsosurfaceCache(ISOSURFACE_CACHE_BYTES)
  
 
         # Start the vtk screen
@@ -137,6 +157,8 @@ class MainWindow(Qt.QMainWindow):
         self.qt_isoSurf_checkbox.setChecked(False)
         self.qt_isoSurf_checkbox.toggled.connect(self.on_checkbox_change)
         self.qt_iso_threshold = Qt.QDoubleSpinBox()
+        self.qt_iso_threshold.setKeyboardTracking(False)
+        self.qt_iso_threshold.valueChanged.connect(self.coalesced_isosurface)
         hbox.addWidget(self.qt_iso_threshold)
 
         ''' Add the Show Iso-Surface button '''
@@ -150,7 +172,7 @@ class MainWindow(Qt.QMainWindow):
 
         hbox_iso =  Qt.QHBoxLayout()
         self.iso_slider = Qt.QSlider(QtCore.Qt.Horizontal)
-        self.iso_slider.valueChanged.connect(self.extract_one_isosurface)
+        self.iso_slider.valueChanged.connect(self.on_iso_opacity_change)
         hbox_iso.addWidget(self.iso_slider)
         self.label_isoslider = Qt.QLabel()
         hbox_iso.addWidget(self.label_isoslider)
@@ -280,14 +302,14 @@ class MainWindow(Qt.QMainWindow):
         if hasattr(self, 'outline'):
             self.ren.RemoveActor(self.outline) 
         
-        if hasattr(self, 'xy_plane'):
-            self.ren.RemoveActor(self.xy_plane)
+        # Surfaces of the previous volume are of no use any more; the
+        # min-max block index is built once per volume, for every threshold
+        self.isosurface_cache.clear()
+        self.isosurface_index = MinMaxBlockIndex(self.reader.GetOutput())
 
-        # You probably need to remove additional actors below...
-        if hasattr(self, 'xz_plane'):
-            self.ren.RemoveActor(self.xz_plane)
-        if hasattr(self, 'yz_plane'):
-            self.ren.RemoveActor(self.yz_plane)
+        # The cut planes are removed and their colours are mapped again
+        # from the new volume (and lookup table) when next shown
+        self.cut_planes.set_input(self.reader.GetOutput())
             
         
         self.scalar_range = [self.reader.GetOutput().GetScalarRange()[0], self.reader.GetOutput().GetScalarRange()[1]]
@@ -347,26 +369,34 @@ class MainWindow(Qt.QMainWindow):
         self.ren.ResetCamera()
         self.vtkWidget.GetRenderWindow().Render()   
         
-    ''' You need to complete the following iso surface extraction function '''   
+    ''' Render the screen; slider handlers call request_render instead '''
+    def render(self):
+        self.vtkWidget.GetRenderWindow().Render()
+
+    ''' Extract the iso-surface at the threshold of the spin box.
+        The marching cubes pipeline and its actor are created once and a
+        new threshold only updates the pipeline; the opacity slider does
+        not come here at all (see on_iso_opacity_change). A threshold that
+        is still in the iso-surface cache is shown without any extraction,
+        others only run marching cubes over the blocks of the min-max index
+        that the surface crosses.
+    '''
     def extract_one_isosurface(self):
-        if hasattr(self, 'isoSurf_actor'):
-            self.ren.RemoveActor(self.isoSurf_actor)
-            
-        if self.qt_isoSurf_checkbox.isChecked() == True:            
-            isoSurfExtractor = vtk.vtkMarchingCubes()
-            isoSurfExtractor.SetInputConnection(self.reader.GetOutputPort())
-            isoSurfExtractor.SetValue(0, self.qt_iso_threshold.value())
+        self.coalesced_isosurface.cancel()
+        if self.qt_isoSurf_checkbox.isChecked() == False or not hasattr(self, 'reader'):
+            if hasattr(self, 'isoSurf_actor'):
+                self.ren.RemoveActor(self.isoSurf_actor)
+            self.request_render()
+            return
 
-            isoSurfStripper = vtk.vtkStripper()
-            isoSurfStripper.SetInputConnection(isoSurfExtractor.GetOutputPort())
-            isoSurfStripper.Update()
+        if not hasattr(self, 'isoSurf_actor'):
+            self.isoSurfStripper = vtk.vtkStripper()
 
-            isoSurf_mapper = vtk.vtkPolyDataMapper()
-            isoSurf_mapper.SetInputConnection( isoSurfStripper.GetOutputPort() )
-            isoSurf_mapper.ScalarVisibilityOff()
+            self.isoSurf_mapper = vtk.vtkPolyDataMapper()
+            self.isoSurf_mapper.ScalarVisibilityOff()
 
             self.isoSurf_actor = vtk.vtkActor() 
-            self.isoSurf_actor.SetMapper( isoSurf_mapper )
+            self.isoSurf_actor.SetMapper( self.isoSurf_mapper )
 
             colors = vtk.vtkNamedColors()
 
@@ -374,85 +404,61 @@ class MainWindow(Qt.QMainWindow):
             self.isoSurf_actor.GetProperty().SetSpecular(.3)
             self.isoSurf_actor.GetProperty().SetSpecularPower(20)
 
-            self.isoSurf_actor.GetProperty().SetOpacity(self.iso_slider.value()/100)
-            self.label_isoslider.setText("Opacity:"+str(self.iso_slider.value())+"%")
-
-            self.ren.AddActor(self.isoSurf_actor)
+        threshold = self.qt_iso_threshold.value()
+        surface = self.isosurface_cache.get(threshold)
+        if surface is None:
+            self.isoSurfStripper.SetInputData(self.isosurface_index.extract(threshold))
+            self.isoSurfStripper.Update()
+            # A copy, as the stripper output changes with the next threshold
+            surface = vtk.vtkPolyData()
+            surface.ShallowCopy(self.isoSurfStripper.GetOutput())
+            self.isosurface_cache.put(threshold, surface)
+        self.isoSurf_mapper.SetInputData(surface)
 
+        self.isoSurf_actor.GetProperty().SetOpacity(self.iso_slider.value()/100)
+        self.ren.AddActor(self.isoSurf_actor)
 
-       
         # Re-render the screen
-        self.vtkWidget.GetRenderWindow().Render()
+        self.request_render()
+
+    ''' The opacity only changes the actor property, the surface stays '''
+    def on_iso_opacity_change(self, value):
+        self.label_isoslider.setText("Opacity:"+str(self.iso_slider.value())+"%")
+        if hasattr(self, 'isoSurf_actor'):
+            self.isoSurf_actor.GetProperty().SetOpacity(self.iso_slider.value()/100)
+            self.request_render()
      
 
+    ''' Moving a slider only moves the display extent of its cut plane '''
     def on_zslider_change(self, value):
         self.label_zslider.setText("Z index:"+str(self.qt_zslider.value()))
         current_zID = int(self.qt_zslider.value())
         
         if self.qt_xy_plane_checkbox.isChecked() == True:           
-            xy_plane_Colors = vtk.vtkImageMapToColors()
-            xy_plane_Colors.SetInputConnection(self.reader.GetOutputPort())
-            xy_plane_Colors.SetLookupTable(self.bwLut)
-            xy_plane_Colors.Update()
-            
-            if hasattr(self, 'xy_plane'):
-                self.ren.RemoveActor(self.xy_plane)
-          
-    
-            self.xy_plane = vtk.vtkImageActor()
-            self.xy_plane.GetMapper().SetInputConnection(xy_plane_Colors.GetOutputPort())
-            self.xy_plane.SetDisplayExtent(0, self.dim[0], 0, self.dim[1], current_zID, current_zID) # Z
-            
-            self.ren.AddActor(self.xy_plane)
+            self.cut_planes.show("xy", current_zID) # Z
             
             # Re-render the screen
-            self.vtkWidget.GetRenderWindow().Render() 
+            self.request_render()
 
     def on_yslider_change(self, value):
         self.label_yslider.setText("Y index:"+str(self.qt_yslider.value()))
         current_yID = int(self.qt_yslider.value())
         
         if self.qt_xz_plane_checkbox.isChecked() == True:           
-            xz_plane_Colors = vtk.vtkImageMapToColors()
-            xz_plane_Colors.SetInputConnection(self.reader.GetOutputPort())
-            xz_plane_Colors.SetLookupTable(self.bwLut)
-            xz_plane_Colors.Update()
-            
-            if hasattr(self, 'xz_plane'):
-                self.ren.RemoveActor(self.xz_plane)
-          
-    
-            self.xz_plane = vtk.vtkImageActor()
-            self.xz_plane.GetMapper().SetInputConnection(xz_plane_Colors.GetOutputPort())
-            self.xz_plane.SetDisplayExtent(0, self.dim[0], current_yID, current_yID, 0, self.dim[2] ) # Y
-            
-            self.ren.AddActor(self.xz_plane)
+            self.cut_planes.show("xz", current_yID) # Y
             
             # Re-render the screen
-            self.vtkWidget.GetRenderWindow().Render() 
+            self.request_render()
 
     def on_xslider_change(self, value):
         self.label_xslider.setText("X index:"+str(self.qt_xslider.value()))
         current_xID = int(self.qt_xslider.value())
         
         if self.qt_yz_plane_checkbox.isChecked() == True:           
-            yz_plane_Colors = vtk.vtkImageMapToColors()
-            yz_plane_Colors.SetInputConnection(self.reader.GetOutputPort())
-            yz_plane_Colors.SetLookupTable(self.bwLut)
-            yz_plane_Colors.Update()
-            
-            if hasattr(self, 'yz_plane'):
-                self.ren.RemoveActor(self.yz_plane)
-          
-    
-            self.yz_plane = vtk.vtkImageActor()
-            self.yz_plane.GetMapper().SetInputConnection(yz_plane_Colors.GetOutputPort())
-            self.yz_plane.SetDisplayExtent(current_xID, current_xID, 0, self.dim[1], 0, self.dim[2] ) # X
-            
-            self.ren.AddActor(self.yz_plane)
+            self.cut_planes.show("yz", current_xID) # X
             
             # Re-render the screen
-            self.vtkWidget.GetRenderWindow().Render() 
+            self.request_render()
 
            
     ''' Handle the click event for the submit button  '''
@@ -534,23 +540,16 @@ class MainWindow(Qt.QMainWindow):
     def on_checkbox_change(self):
           
            
-        if self.qt_xy_plane_checkbox.isChecked() == False:    
-            if hasattr(self, 'xy_plane'):
-                self.ren.RemoveActor(self.xy_plane)
-            # Re-render the screen
-            self.vtkWidget.GetRenderWindow().Render()
-
-        if self.qt_xz_plane_checkbox.isChecked() == False:    
-            if hasattr(self, 'xz_plane'):
-                self.ren.RemoveActor(self.xz_plane)
-            # Re-render the screen
-            self.vtkWidget.GetRenderWindow().Render()
-
-        if self.qt_yz_plane_checkbox.isChecked() == False:    
-            if hasattr(self, 'yz_plane'):
-                self.ren.RemoveActor(self.yz_plane)
-            # Re-render the screen
-            self.vtkWidget.GetRenderWindow().Render()
+        # Cut planes are shown at their slider index or hidden
+        for plane, checkbox, slider in (("xy", self.qt_xy_plane_checkbox, self.qt_zslider),
+                                        ("xz", self.qt_xz_plane_checkbox, self.qt_yslider),
+                                        ("yz", self.qt_yz_plane_checkbox, self.qt_xslider)):
+            if checkbox.isChecked() == False:
+                self.cut_planes.hide(plane)
+            elif hasattr(self, 'reader'):
+                self.cut_planes.show(plane, slider.value())
+        # Re-render the screen
+        self.vtkWidget.GetRenderWindow().Render()
            
         if self.qt_isoSurf_checkbox.isChecked() == False:
             if hasattr(self, 'isoSurf_actor'):
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Axis-aligned cut planes through a volume.
+
+The XY, XZ and YZ planes are vtkImageActors that share one colour-mapped
+copy of the volume: the volume goes through vtkImageMapToColors once, and
+moving a plane only changes the display extent of its actor, so no voxel is
+colour-mapped again while a slider is dragged.
+
+@author: Raunak Sarbajna
+"""
+
+import vtk
+
+
+# Axis normal to each cut plane
+PLANE_AXES = {"xy": 2, "xz": 1, "yz": 0}
+
+
+'''
+    The cut planes of one volume, coloured by lookup_table and drawn in
+    renderer. The actors are created the first time their plane is shown
+    and reused from then on.
+'''
+class CutPlanes:
+
+    def __init__(self, renderer, lookup_table):
+        self.renderer = renderer
+        self.lookup_table = lookup_table
+        self.image = None
+        self.colors = None
+        self.actors = {}
+
+    ''' Cut a new volume (a vtkImageData); the previous planes are removed '''
+    def set_input(self, image):
+        for actor in self.actors.values():
+            self.renderer.RemoveActor(actor)
+        self.actors = {}
+        self.image = image
+        self.colors = None
+
+    ''' The colour-mapped volume, computed on first use '''
+    def colored_volume(self):
+        if self.colors is None:
+            map_colors = vtk.vtkImageMapToColors()
+            map_colors.SetInputData(self.image)
+            map_colors.SetLookupTable(self.lookup_table)
+            map_colors.Update()
+            self.colors = map_colors.GetOutput()
+        return self.colors
+
+    ''' Show plane ("xy", "xz" or "yz") at voxel index along its normal '''
+    def show(self, plane, index):
+        actor = self.actors.get(plane)
+        if actor is None:
+            actor = vtk.vtkImageActor()
+            actor.GetMapper().SetInputData(self.colored_volume())
+            self.actors[plane] = actor
+            self.renderer.AddActor(actor)
+
+        extent = list(self.image.GetExtent())
+        axis = PLANE_AXES[plane]
+        index = min(max(extent[2 * axis] + int(index), extent[2 * axis]), extent[2 * axis + 1])
+        extent[2 * axis] = extent[2 * axis + 1] = index
+        actor.SetDisplayExtent(extent)
+        actor.VisibilityOn()
+
+    def hide(self, plane):
+        if plane in self.actors:
+            self.actors[plane].VisibilityOff()
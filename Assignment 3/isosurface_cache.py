@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory cache of extracted iso-surfaces.
+
+Marching cubes over the whole volume takes a noticeable time, and going
+back to a threshold that was shown a moment ago used to extract the very
+same surface again. The cache keeps the surfaces of one volume as
+vtkPolyData, keyed by threshold, together with their size in bytes. The
+total size is capped; when it is exceeded the least recently used surfaces
+are dropped (a hit makes a surface the most recently used).
+
+@author: Raunak Sarbajna
+"""
+
+from collections import OrderedDict
+
+
+class IsosurfaceCache:
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.surfaces = OrderedDict()   # threshold -> (polydata, size in bytes)
+        self.total_bytes = 0
+
+    ''' Forget every surface, e.g. when another volume is loaded '''
+    def clear(self):
+        self.surfaces.clear()
+        self.total_bytes = 0
+
+    ''' The cached surface for threshold, or None '''
+    def get(self, threshold):
+        entry = self.surfaces.get(threshold)
+        if entry is None:
+            return None
+        # Mark the entry as recently used
+        self.surfaces.move_to_end(threshold)
+        return entry[0]
+
+    '''
+        Store the surface extracted at threshold, then evict old entries over
+        the size cap. A surface larger than the whole cap is not kept. The
+        surface must not be modified afterwards (store a copy of a filter
+        output, which changes on the next update of the filter).
+    '''
+    def put(self, threshold, surface):
+        if threshold in self.surfaces:
+            self.total_bytes -= self.surfaces.pop(threshold)[1]
+        # GetActualMemorySize is in kibibytes
+        size = surface.GetActualMemorySize() * 1024
+        if size > self.max_bytes:
+            return
+        self.surfaces[threshold] = (surface, size)
+        self.total_bytes += size
+        self.evict()
+
+    ''' Remove the least recently used entries until the cache fits max_bytes '''
+    def evict(self):
+        while self.total_bytes > self.max_bytes and self.surfaces:
+            _, (_, size) = self.surfaces.popitem(last=False)
+            self.total_bytes -= size
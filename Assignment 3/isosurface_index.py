@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Min-max block index for iso-surface extraction.
+
+vtkMarchingCubes visits every cell of the volume for every threshold,
+although at a typical threshold only few cells are crossed by the surface.
+MinMaxBlockIndex splits the cells of a volume into blocks and keeps the
+smallest and largest scalar of every block, computed once when the volume
+is loaded. extract only runs marching cubes over the blocks whose range
+contains the iso value, one box per run of consecutive active blocks along
+x, and stitches the pieces together.
+
+Every box is extended by a margin of one point on the sides where the
+volume goes on, so that the gradients, and thus the normals, at its
+border are the central differences of the whole volume; the triangles of
+the margin cells are dropped again. A box is an image with the extent of
+its points in the volume and the origin and spacing of the volume, so
+marching cubes computes every point exactly as it does over the whole
+volume, and the points on a face shared by two boxes can be merged.
+
+When the iso value equals scalars of the volume, triangles can lie flat on
+a face between two cells, and both boxes next to that face extract the
+ones of both cells. Such triangles are kept by the box above the face, or
+by the box below it when the blocks above are not extracted. The result is
+the surface vtkMarchingCubes gives for the whole volume, up to the order
+of its points and triangles.
+
+An index only saves the visits of cells away from the surface: when many
+blocks are active, the surface is extracted as a single box.
+
+@author: Raunak Sarbajna
+"""
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+
+# Number of cells along every edge of a block of the index
+BLOCK_SIZE = 16
+
+# Fraction of active blocks above which the whole volume is extracted at once
+MAX_ACTIVE_FRACTION = 0.1
+
+
+'''
+    reduce (np.minimum or np.maximum) of values over blocks of block cells
+    along axis. A block covers the points of its cells, so its last point is
+    the first point of the next block.
+'''
+def _block_reduce(values, axis, block, reduce):
+    values = np.moveaxis(values, axis, 0)
+    starts = np.arange(0, max(values.shape[0] - 1, 1), block)
+    out = reduce.reduceat(values, starts, axis=0)
+    out[:-1] = reduce(out[:-1], values[starts[1:]])
+    return np.moveaxis(out, 0, axis)
+
+
+'''
+    The blocks of cells of one volume (a vtkImageData with one scalar per
+    point) and the range of the scalars in each of them.
+'''
+class MinMaxBlockIndex:
+
+    def __init__(self, image, block=BLOCK_SIZE):
+        self.block = block
+        self.dims = np.array(image.GetDimensions())
+        self.origin = np.array(image.GetOrigin())
+        self.spacing = np.array(image.GetSpacing())
+
+        scalars = image.GetPointData().GetScalars()
+        self.scalars_name = scalars.GetName()
+        values = numpy_support.vtk_to_numpy(scalars)
+        if values.ndim > 1:
+            values = values[:, 0]
+        # Image points are ordered x fastest, then y, then z
+        self.values = values.reshape(self.dims[::-1])
+
+        self.mins = self.values
+        self.maxs = self.values
+        for axis in range(3):
+            self.mins = _block_reduce(self.mins, axis, block, np.minimum)
+            self.maxs = _block_reduce(self.maxs, axis, block, np.maximum)
+
+    '''
+        The (z, y, x) mask of the blocks with a cell crossed by the surface
+        at value: marching cubes puts triangles in a cell when some of its
+        points are below value and some are not.
+    '''
+    def active_blocks(self, value):
+        return (self.mins < value) & (self.maxs >= value)
+
+    ''' vtkMarchingCubes over the points from lo to hi (x, y, z indices) '''
+    def _marching_cubes(self, value, lo, hi):
+        values = np.ascontiguousarray(self.values[lo[2]:hi[2] + 1, lo[1]:hi[1] + 1, lo[0]:hi[0] + 1])
+        box = vtk.vtkImageData()
+        box.SetExtent(lo[0], hi[0], lo[1], hi[1], lo[2], hi[2])
+        box.SetOrigin(*self.origin.tolist())
+        box.SetSpacing(*self.spacing.tolist())
+        scalars = numpy_support.numpy_to_vtk(values.ravel(), deep=False)
+        scalars.SetName(self.scalars_name)
+        box.GetPointData().SetScalars(scalars)
+
+        extractor = vtk.vtkMarchingCubes()
+        extractor.SetInputData(box)
+        extractor.SetValue(0, value)
+        extractor.Update()
+        return extractor.GetOutput()
+
+    '''
+        Marching cubes over the cells from point lo to point hi (x, y, z
+        indices), with a margin for the gradients. active is the mask of
+        the extracted blocks.
+        @return: points, normals, (n, 3) triangles and a mask of the points
+                 on the faces of the box, or None
+    '''
+    def _extract_box(self, value, lo, hi, active):
+        surface = self._marching_cubes(value, np.maximum(lo - 1, 0), np.minimum(hi + 1, self.dims - 1))
+        if surface.GetNumberOfPolys() == 0:
+            return None
+
+        points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData())
+        triangles = numpy_support.vtk_to_numpy(surface.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+        # The faces of the box, computed like the points of marching cubes:
+        # the points on a face have exactly these coordinates
+        face_lo = (self.origin + lo * self.spacing).astype(points.dtype)
+        face_hi = (self.origin + hi * self.spacing).astype(points.dtype)
+
+        # Drop the triangles of the margin cells: the points of a cell are on
+        # its edges, and a margin cell has some beyond the faces of the box,
+        # unless its triangle lies flat on a face
+        outside = np.any((points < face_lo) | (points > face_hi), axis=1)
+        keep = ~outside[triangles].any(axis=1)
+
+        # A triangle flat on an upper face is also extracted by the box
+        # above, if the block above it is active
+        corners = points[triangles]
+        for axis in range(3):
+            if hi[axis] == self.dims[axis] - 1:
+                continue
+            flat = keep & np.all(corners[:, :, axis] == face_hi[axis], axis=1)
+            if not flat.any():
+                continue
+            block = np.floor((corners[flat].mean(axis=1) - self.origin) / self.spacing).astype(np.intp) // self.block
+            block[:, axis] = hi[axis] // self.block
+            keep[np.flatnonzero(flat)[active[block[:, 2], block[:, 1], block[:, 0]]]] = False
+
+        triangles = triangles[keep]
+        if triangles.shape[0] == 0:
+            return None
+        used = np.zeros(points.shape[0], dtype=bool)
+        used[triangles] = True
+        triangles = (np.cumsum(used) - 1)[triangles]
+        # Runs along x never touch, only their y and z faces can be shared
+        on_face = np.any((points[used, 1:] == face_lo[1:]) | (points[used, 1:] == face_hi[1:]), axis=1)
+        normals = numpy_support.vtk_to_numpy(surface.GetPointData().GetNormals())
+        return points[used], normals[used], triangles, on_face
+
+    '''
+        The iso-surface at value, with the points, normals and scalars of
+        the vtkMarchingCubes output for the whole volume.
+        @return: a new vtkPolyData of triangles
+    '''
+    def extract(self, value):
+        active = self.active_blocks(value)
+        if active.mean() > MAX_ACTIVE_FRACTION:
+            return self._marching_cubes(value, np.zeros(3, dtype=np.intp), self.dims - 1)
+
+        # Runs of active blocks along x: where the padded mask steps up or down
+        padded = np.zeros(active.shape[:2] + (active.shape[2] + 2,), dtype=np.int8)
+        padded[:, :, 1:-1] = active
+        steps = np.diff(padded, axis=2)
+        bz, by, bx0 = np.nonzero(steps == 1)
+        bx1 = np.nonzero(steps == -1)[2]
+
+        pieces = []
+        for z, y, x0, x1 in zip(bz, by, bx0, bx1):
+            lo = np.array([x0, y, z]) * self.block
+            hi = np.minimum(np.array([x1, y + 1, z + 1]) * self.block, self.dims - 1)
+            piece = self._extract_box(value, lo, hi, active)
+            if piece is not None:
+                pieces.append(piece)
+
+        surface = vtk.vtkPolyData()
+        if not pieces:
+            return surface
+
+        points = np.concatenate([piece[0] for piece in pieces])
+        normals = np.concatenate([piece[1] for piece in pieces])
+        starts = np.cumsum([0] + [piece[0].shape[0] for piece in pieces[:-1]])
+        triangles = np.concatenate([piece[2] + start for piece, start in zip(pieces, starts)])
+
+        # Points on the faces between two boxes were extracted by both: each
+        # of them is replaced by the first point with the same coordinates
+        on_face = np.flatnonzero(np.concatenate([piece[3] for piece in pieces]))
+        _, first, inverse = np.unique(points[on_face], axis=0, return_index=True, return_inverse=True)
+        same = np.arange(points.shape[0])
+        same[on_face] = on_face[first][inverse.ravel()]
+        kept = same == np.arange(points.shape[0])
+        triangles = (np.cumsum(kept) - 1)[same][triangles]
+        points = points[kept]
+        normals = normals[kept]
+
+        vtk_points = vtk.vtkPoints()
+        vtk_points.SetData(numpy_support.numpy_to_vtk(points, deep=True))
+        surface.SetPoints(vtk_points)
+
+        polys = vtk.vtkCellArray()
+        polys.SetData(numpy_support.numpy_to_vtkIdTypeArray(np.arange(0, triangles.size + 1, 3, dtype=np.int64), deep=True),
+                      numpy_support.numpy_to_vtkIdTypeArray(triangles.ravel().astype(np.int64), deep=True))
+        surface.SetPolys(polys)
+
+        vtk_normals = numpy_support.numpy_to_vtk(normals, deep=True)
+        vtk_normals.SetName("Normals")
+        surface.GetPointData().SetNormals(vtk_normals)
+        vtk_scalars = numpy_support.numpy_to_vtk(np.full(points.shape[0], value, dtype=np.float32), deep=True)
+        vtk_scalars.SetName(self.scalars_name)
+        surface.GetPointData().SetScalars(vtk_scalars)
+        return surface
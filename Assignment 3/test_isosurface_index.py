@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+MinMaxBlockIndex.extract against vtkMarchingCubes over the whole volume.
+
+The volume holds small integers, so integer iso values hit scalars of the
+volume exactly and give triangles lying flat on the faces between cells.
+
+@author: Raunak Sarbajna
+"""
+
+import numpy as np
+import pytest
+import vtk
+from vtk.util import numpy_support
+
+import isosurface_index
+from isosurface_index import MinMaxBlockIndex
+
+
+''' An int16 volume with anisotropic spacing: a blob plus integer noise '''
+def integer_volume():
+    nx, ny, nz = 64, 60, 48
+    z, y, x = np.meshgrid(np.arange(nz), np.arange(ny), np.arange(nx), indexing='ij')
+    blob = 6 * np.exp(-(((x - 32) / 20.) ** 2 + ((y - 30) / 22.) ** 2 + ((z - 24) / 15.) ** 2))
+    values = (blob + np.random.default_rng(0).integers(0, 3, x.shape)).astype(np.int16)
+
+    image = vtk.vtkImageData()
+    image.SetDimensions(nx, ny, nz)
+    image.SetSpacing(0.9375, 0.9375, 1.5)
+    image.SetOrigin(-3.2, 7.1, 0.4)
+    scalars = numpy_support.numpy_to_vtk(values.ravel(), deep=True)
+    scalars.SetName("scalars")
+    image.GetPointData().SetScalars(scalars)
+    return image
+
+
+'''
+    The points and normals of a surface in sorted point order, and its
+    triangles as rows of point ranks, each rotated to start at its smallest
+    rank (which keeps its orientation), in sorted order. Only the points of
+    the triangles count: vtkMarchingCubes also keeps the points of the
+    degenerate triangles it drops.
+'''
+def canonical(surface):
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData())
+    normals = numpy_support.vtk_to_numpy(surface.GetPointData().GetNormals())
+    triangles = numpy_support.vtk_to_numpy(surface.GetPolys().GetConnectivityArray()).reshape(-1, 3)
+    used, triangles = np.unique(triangles, return_inverse=True)
+    points, normals, triangles = points[used], normals[used], triangles.reshape(-1, 3)
+
+    order = np.lexsort(points.T[::-1])
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    triangles = rank[triangles]
+    first = np.argmin(triangles, axis=1)
+    rows = np.arange(triangles.shape[0])[:, None]
+    triangles = triangles[rows, (first[:, None] + np.arange(3)) % 3]
+    return points[order], normals[order], triangles[np.lexsort(triangles.T[::-1])]
+
+
+@pytest.mark.parametrize("value", [1, 2, 3, 5, 6, 1.5, 2.5, 4.25])
+def test_extract_matches_marching_cubes(monkeypatch, value):
+    # Always go through the blocks, however many of them are active
+    monkeypatch.setattr(isosurface_index, "MAX_ACTIVE_FRACTION", 1.0)
+    image = integer_volume()
+    index = MinMaxBlockIndex(image, block=8)
+    assert 0 < index.active_blocks(value).mean() < 1
+
+    extractor = vtk.vtkMarchingCubes()
+    extractor.SetInputData(image)
+    extractor.SetValue(0, value)
+    extractor.Update()
+
+    expected = canonical(extractor.GetOutput())
+    result = canonical(index.extract(value))
+    assert result[0].shape == expected[0].shape
+    assert result[2].shape == expected[2].shape
+    np.testing.assert_array_equal(result[0], expected[0])
+    np.testing.assert_array_equal(result[1], expected[1])
+    np.testing.assert_array_equal(result[2], expected[2])
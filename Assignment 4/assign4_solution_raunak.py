@@ -6,14 +6,179 @@ Created on Sun Oct 17 08:49:30 2021
 """
 
 
+import os
 import sys
 import math
-import random
+import tempfile
+from collections import OrderedDict
+import numpy as np
 import vtk
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5 import Qt
 
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+from vtk.util import numpy_support
+
+import lic
+import seeding
+from lic_cache import LICCache, file_hash
+from noise import NOISE_KINDS, HashedNoise, NoisePyramid
+import streamlines
+from velocity_grid import VelocityGrid
+from coalesce import RENDER_INTERVAL, CoalescedCall
+
+
+# Resolution of the first, immediate LIC level in progressive mode
+LIC_PREVIEW_RES = 64
+
+# Texture resolutions offered on the interface. Above LIC_MAX_IN_MEMORY_RES
+# the texture is computed in row bands into a memory-mapped file and shown
+# block-averaged down to LIC_DISPLAY_RES.
+LIC_RESOLUTIONS = (256, 512, 1024, 2048, 4096, 8192)
+LIC_MAX_IN_MEMORY_RES = 1024
+LIC_DISPLAY_RES = 1024
+
+# Working memory of one band of a large LIC texture
+LIC_BAND_MEMORY = 64 * 1024 * 1024
+
+# Integrator settings of the streamlines (the vtkStreamTracer defaults)
+STREAMLINE_SETTINGS = dict(max_length=1.0, initial_step=0.5, min_step=0.01, max_step=1.0,
+                           max_steps=2000, max_error=1e-6, direction="both")
+
+# Number of traced streamline sets kept in memory
+STREAMLINE_CACHE_SIZE = 8
+
+
+'''
+    Background thread for progressive LIC: computes the LIC texture for a
+    list of increasingly fine noise levels and emits every finished level.
+    Everything it needs is handed over at construction, so it never touches
+    the widgets; cancel() makes it stop after the level in progress.
+'''
+class LICWorker(QtCore.QThread):
+
+    level_ready = QtCore.pyqtSignal(object)
+
+    def __init__(self, field, bounds, noise_levels, length, fast, workers, key, parent = None):
+        QtCore.QThread.__init__(self, parent)
+        self.field = field
+        self.bounds = bounds
+        self.noise_levels = noise_levels
+        self.length = length
+        self.fast = fast
+        self.workers = workers
+        # Cache key of the last level, built from the same settings
+        self.key = key
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        for noise in self.noise_levels:
+            if self.cancelled:
+                return
+            texture = lic.compute_texture(self.field, self.bounds, noise, self.length,
+                                          self.fast, self.workers)
+            if self.cancelled:
+                return
+            self.level_ready.emit(texture)
+
+
+'''
+    Background thread for large LIC textures: computes the texture band by
+    band into the .npy file out_path with lic.compute_lic_banded (unless the
+    file already exists), then emits it block-averaged to display_res.
+    The noise is a noise.HashedNoise, so nothing of size res x res is ever
+    held in memory; cancel() stops after the band in progress.
+'''
+class LICBandWorker(QtCore.QThread):
+
+    level_ready = QtCore.pyqtSignal(object)
+    progress = QtCore.pyqtSignal(float)
+
+    def __init__(self, field, bounds, noise, length, fast, out_path, display_res, key, parent = None):
+        QtCore.QThread.__init__(self, parent)
+        self.field = field
+        self.bounds = bounds
+        self.noise = noise
+        self.length = length
+        self.fast = fast
+        self.out_path = out_path
+        self.display_res = display_res
+        self.key = key
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def on_band(self, fraction):
+        self.progress.emit(fraction)
+        return self.cancelled
+
+    def run(self):
+        if not os.path.exists(self.out_path):
+            # Compute into a temporary file so that a cancelled or failed run
+            # never leaves a partial texture under the final name
+            fd, tmp_path = tempfile.mkstemp(suffix=".npy.tmp", dir=os.path.dirname(self.out_path))
+            os.close(fd)
+            try:
+                done = lic.compute_lic_banded(self.field, self.bounds, self.noise, self.length,
+                                              tmp_path, self.fast, LIC_BAND_MEMORY,
+                                              progress=self.on_band)
+                if done is None:
+                    return
+                os.replace(tmp_path, self.out_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        if self.cancelled:
+            return
+        self.level_ready.emit(lic.load_downsampled(self.out_path, self.display_res))
+
+
+'''
+    Background thread for the streamlines: traces the seeds (an (n, 3)
+    array) over the velocity grid, or with seeds None places the
+    evenly-spaced streamlines at separation. The lines that are finished
+    are emitted by chunk_ready as the tracing goes, and all the lines by
+    lines_ready at the end; cancel() stops at the next report.
+'''
+class StreamlineWorker(QtCore.QThread):
+
+    chunk_ready = QtCore.pyqtSignal(object)
+    progress = QtCore.pyqtSignal(float)
+    lines_ready = QtCore.pyqtSignal(object)
+
+    def __init__(self, field, bounds, seeds, separation, parent = None):
+        QtCore.QThread.__init__(self, parent)
+        self.field = field
+        self.bounds = bounds
+        self.seeds = seeds
+        self.separation = separation
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def on_lines(self, fraction, lines):
+        points, offsets = lines
+        if offsets.size > 1:
+            self.chunk_ready.emit(streamlines.to_polydata(points, offsets, self.bounds[4]))
+        self.progress.emit(fraction)
+        return self.cancelled
+
+    def run(self):
+        if self.seeds is None:
+            traced = streamlines.evenly_spaced_streamlines(self.field, self.bounds, self.separation,
+                                                           progress=self.on_lines)
+        else:
+            traced = streamlines.trace_streamlines(self.field, self.bounds,
+                                                   self.seeds[:, 0], self.seeds[:, 1],
+                                                   progress=self.on_lines, **STREAMLINE_SETTINGS)
+        if traced is None or self.cancelled:
+            return
+        self.lines_ready.emit(streamlines.to_polydata(traced[0], traced[1], self.bounds[4]))
 
 
 '''
@@ -40,6 +205,12 @@ class MainWindow(Qt.QMainWindow):
         
         #Initialize the vtk variables for the visualization tasks
         self.init_vtk_widget()
+
+        # LIC textures computed earlier are kept on disk
+        self.lic_cache = LICCache()
+
+        # Traced streamlines by settings, least recently used first
+        self.streamline_cache = OrderedDict()
         
         # Add an object to the rendering window
         # self.add_vtk_object()
@@ -83,6 +254,17 @@ class MainWindow(Qt.QMainWindow):
         self.bwLut.SetValueRange(0, 1)
         self.bwLut.Build()  # effective built
 
+        # Colour lookup table for blending an attribute with the LIC texture
+        self.lic_lut = vtk.vtkLookupTable()
+        self.lic_lut.SetNumberOfTableValues(256)
+        self.lic_lut.SetHueRange(0.667, 0)
+        self.lic_lut.Build()
+
+        # Spin box changes re-render at a capped rate and resample the
+        # arrows once for the latest value (see coalesce.py)
+        self.request_render = CoalescedCall(self.render, RENDER_INTERVAL, self)
+        self.coalesced_arrow_density = CoalescedCall(self.on_arrow_density_change, 0, self)
+
         # Start the vtk screen
         self.ren.ResetCamera()
         self.show()
@@ -134,6 +316,7 @@ class MainWindow(Qt.QMainWindow):
         self.arrow_scale.setValue(0.03)
         self.arrow_scale.setRange(0, 1)
         self.arrow_scale.setSingleStep (0.01)
+        self.arrow_scale.valueChanged.connect(self.on_arrow_scale_change)
         hbox_arrowplot.addWidget(self.arrow_scale)
 
         maxPointsLabel = Qt.QLabel("Choose Maximum Number of Arrows:")
@@ -143,6 +326,8 @@ class MainWindow(Qt.QMainWindow):
         self.max_points.setValue(500)
         self.max_points.setRange(200, 10000)
         self.max_points.setSingleStep (100)
+        self.max_points.setKeyboardTracking(False)
+        self.max_points.valueChanged.connect(self.coalesced_arrow_density)
         hbox_arrowplot.addWidget(self.max_points)
 
         arrow_widget = Qt.QWidget()
@@ -180,12 +365,47 @@ class MainWindow(Qt.QMainWindow):
         self.random_seed_radio.setChecked(False)
         self.random_seed_radio.toggled.connect(self.on_seeding_strategy)
         vbox_seed_strategy.addWidget(self.random_seed_radio)
+
+        # Blue-noise seeds: "number of seeds" is the total count here
+        self.poisson_seed_radio = Qt.QRadioButton("Poisson-Disk Seeding")
+        self.poisson_seed_radio.setChecked(False)
+        self.poisson_seed_radio.toggled.connect(self.on_seeding_strategy)
+        vbox_seed_strategy.addWidget(self.poisson_seed_radio)
+
+        # Evenly-spaced streamlines: lines are placed one after the other at
+        # a given separation (a fraction of the domain width)
+        hbox_evenly = Qt.QHBoxLayout()
+        self.evenly_seed_radio = Qt.QRadioButton("Evenly Spaced Streamlines")
+        self.evenly_seed_radio.setChecked(False)
+        self.evenly_seed_radio.toggled.connect(self.on_seeding_strategy)
+        hbox_evenly.addWidget(self.evenly_seed_radio)
+        hbox_evenly.addWidget(Qt.QLabel("    Separation:"))
+        self.streamline_separation = Qt.QDoubleSpinBox()
+        self.streamline_separation.setDecimals(3)
+        self.streamline_separation.setRange(0.005, 0.2)
+        self.streamline_separation.setSingleStep(0.005)
+        self.streamline_separation.setValue(0.03)
+        hbox_evenly.addWidget(self.streamline_separation)
+        vbox_seed_strategy.addLayout(hbox_evenly)
         self.seeding_strategy = 0 # Uniform seeding is the default strategy 
 
         seedingstrategy = Qt.QWidget()
         seedingstrategy.setLayout(vbox_seed_strategy)
         vbox_streamline.addWidget(seedingstrategy)
 
+        # Progress of the streamlines traced in the background
+        hbox_stream_progress = Qt.QHBoxLayout()
+        self.streamline_progress = Qt.QProgressBar()
+        self.streamline_progress.setRange(0, 100)
+        hbox_stream_progress.addWidget(self.streamline_progress)
+        self.streamline_cancel = Qt.QPushButton("Cancel")
+        self.streamline_cancel.clicked.connect(self.cancel_streamlines)
+        hbox_stream_progress.addWidget(self.streamline_cancel)
+        self.streamline_progress_widget = Qt.QWidget()
+        self.streamline_progress_widget.setLayout(hbox_stream_progress)
+        self.streamline_progress_widget.hide()
+        vbox_streamline.addWidget(self.streamline_progress_widget)
+
         streamline_widgets = Qt.QWidget()
         streamline_widgets.setLayout(vbox_streamline)
         self.groupBox_layout.addWidget(streamline_widgets)
@@ -195,17 +415,82 @@ class MainWindow(Qt.QMainWindow):
 
         maxIntLen = Qt.QLabel("Choose Maximum Integration Length:")
         self.groupBox_layout.addWidget(maxIntLen)
+        hbox_intlen = Qt.QHBoxLayout()
         self.max_len = Qt.QSpinBox()
          # set the initial values of some parameters
         self.max_len.setValue(40)
         self.max_len.setRange(0, 100)
         self.max_len.setSingleStep (5)
-        self.groupBox_layout.addWidget(self.max_len)
-
+        hbox_intlen.addWidget(self.max_len)
+
+        # Number of processes the LIC texture tiles are spread over
+        workersLabel = Qt.QLabel("    LIC worker processes:")
+        hbox_intlen.addWidget(workersLabel)
+        self.lic_workers = Qt.QSpinBox()
+        self.lic_workers.setRange(1, os.cpu_count() or 1)
+        self.lic_workers.setValue(1)
+        self.lic_workers.setSingleStep (1)
+        hbox_intlen.addWidget(self.lic_workers)
+
+        # Large textures are computed in bands into a file in the LIC cache
+        hbox_intlen.addWidget(Qt.QLabel("    Resolution:"))
+        self.lic_resolution = Qt.QComboBox()
+        for res in LIC_RESOLUTIONS:
+            self.lic_resolution.addItem("%d x %d" % (res, res))
+        hbox_intlen.addWidget(self.lic_resolution)
+
+        intlen_widget = Qt.QWidget()
+        intlen_widget.setLayout(hbox_intlen)
+        self.groupBox_layout.addWidget(intlen_widget)
+
+        hbox_lic = Qt.QHBoxLayout()
         self.LIC_checkbox = Qt.QCheckBox("LIC On")
         self.LIC_checkbox.setChecked(False)
         self.LIC_checkbox.toggled.connect(self.on_LIC_checkbox)
-        self.groupBox_layout.addWidget(self.LIC_checkbox)
+        hbox_lic.addWidget(self.LIC_checkbox)
+
+        # FastLIC reuses every traced streamline for all the pixels it crosses
+        self.fast_LIC_checkbox = Qt.QCheckBox("FastLIC")
+        self.fast_LIC_checkbox.setChecked(False)
+        hbox_lic.addWidget(self.fast_LIC_checkbox)
+
+        noiseLabel = Qt.QLabel("    Noise:")
+        hbox_lic.addWidget(noiseLabel)
+        self.noise_kind = Qt.QComboBox()
+        self.noise_kind.addItems(["White", "Blue", "Spot"])
+        hbox_lic.addWidget(self.noise_kind)
+        noiseSeedLabel = Qt.QLabel("Seed:")
+        hbox_lic.addWidget(noiseSeedLabel)
+        self.noise_seed = Qt.QSpinBox()
+        self.noise_seed.setRange(0, 99999)
+        self.noise_seed.setValue(0)
+        hbox_lic.addWidget(self.noise_seed)
+
+        # Show a coarse LIC at once and refine it in the background
+        self.progressive_LIC_checkbox = Qt.QCheckBox("Progressive")
+        self.progressive_LIC_checkbox.setChecked(True)
+        hbox_lic.addWidget(self.progressive_LIC_checkbox)
+
+        lic_widget = Qt.QWidget()
+        lic_widget.setLayout(hbox_lic)
+        self.groupBox_layout.addWidget(lic_widget)
+
+        # Colour the LIC texture by the velocity magnitude or a point scalar
+        hbox_lic_color = Qt.QHBoxLayout()
+        hbox_lic_color.addWidget(Qt.QLabel("Color LIC by:"))
+        self.lic_color_by = Qt.QComboBox()
+        self.lic_color_by.addItem("None")
+        self.lic_color_attributes = [None]
+        self.lic_color_by.currentIndexChanged.connect(self.on_LIC_color_change)
+        hbox_lic_color.addWidget(self.lic_color_by)
+        lic_color_widget = Qt.QWidget()
+        lic_color_widget.setLayout(hbox_lic_color)
+        self.groupBox_layout.addWidget(lic_color_widget)
+
+        # Progress and output file of the large LIC textures
+        self.lic_status = Qt.QLabel("")
+        self.lic_status.setWordWrap(True)
+        self.groupBox_layout.addWidget(self.lic_status)
 
 
         
@@ -241,15 +526,36 @@ class MainWindow(Qt.QMainWindow):
         # You need to modify the following actors' names based on how you define them!!!!!
         if hasattr(self, 'arrow_actor'):
             self.ren.RemoveActor(self.arrow_actor)
+        self.arrow_order = None
         
+        self.cancel_streamlines()
         if hasattr(self, 'streamline_actor'):
             self.ren.RemoveActor(self.streamline_actor)
+            del self.streamline_actor
             
         if hasattr(self, 'lic_actor'):
             self.ren.RemoveActor(self.lic_actor) 
+        self.cancel_LIC()
 
         self.seeding_strategy = 0 # Uniform seeding is the default strategy
 
+        # Cache the velocity on a regular grid once per loaded file
+        self.generate_velocity_grid()
+        self.vector_file_hash = file_hash(input_file_name)
+
+        # Attributes the LIC texture can be coloured by
+        self.lic_color_by.blockSignals(True)
+        self.lic_color_by.clear()
+        self.lic_color_by.addItem("None")
+        self.lic_color_attributes = [None]
+        if self.velocity_grid is not None:
+            self.lic_color_by.addItem("Velocity magnitude")
+            self.lic_color_attributes.append("magnitude")
+            for name in self.velocity_grid.scalars:
+                self.lic_color_by.addItem("Scalar: " + name)
+                self.lic_color_attributes.append(name)
+        self.lic_color_by.blockSignals(False)
+
         self.scalar_range = [self.reader.GetOutput().GetScalarRange()[0], self.reader.GetOutput().GetScalarRange()[1]]
         
         #Update the lookup table
@@ -289,7 +595,63 @@ class MainWindow(Qt.QMainWindow):
         
 
     
-    ''' Use the vtkGlyph2D filter to show an arrow plot on a 2D surface'''
+    '''
+        Rank the points of the loaded data once as a nested, stratified
+        density pyramid (see seeding.stratified_order) and keep the points and
+        the point arrays in that order, so the arrows for any maximum number
+        of arrows are simply a prefix of these arrays.
+    '''
+    def build_arrow_pyramid(self):
+        dataset = self.reader.GetOutput()
+        bound = dataset.GetBounds()
+        points = seeding.dataset_points(dataset)
+        self.arrow_order = seeding.stratified_order(points, bound, 2, seed=0)
+        self.arrow_points = np.ascontiguousarray(points[self.arrow_order])
+        point_data = dataset.GetPointData()
+        self.arrow_arrays = []
+        for i in range(point_data.GetNumberOfArrays()):
+            values = numpy_support.vtk_to_numpy(point_data.GetArray(i))
+            self.arrow_arrays.append((point_data.GetArrayName(i),
+                                      np.ascontiguousarray(values[self.arrow_order])))
+        self.arrow_scalars_name = point_data.GetScalars().GetName() if point_data.GetScalars() else None
+
+    ''' The first count points of the density pyramid as a vtkPolyData (no copies) '''
+    def arrow_sample(self, count):
+        if getattr(self, 'arrow_order', None) is None:
+            self.build_arrow_pyramid()
+        count = min(int(count), self.arrow_points.shape[0])
+        sample = vtk.vtkPolyData()
+        sample.SetPoints(seeding.to_vtk_points(self.arrow_points[:count]))
+        for name, values in self.arrow_arrays:
+            array = numpy_support.numpy_to_vtk(values[:count], deep=False)
+            array.SetName(name)
+            sample.GetPointData().AddArray(array)
+        sample.GetPointData().SetActiveVectors("velocity")
+        if self.arrow_scalars_name is not None:
+            sample.GetPointData().SetActiveScalars(self.arrow_scalars_name)
+        return sample
+
+    ''' Render the screen; spin box handlers call request_render instead '''
+    def render(self):
+        self.vtkWidget.GetRenderWindow().Render()
+
+    ''' A new maximum number of arrows only swaps the glyph input for another prefix '''
+    def on_arrow_density_change(self):
+        if self.qt_arrow_checkbox.isChecked() == True and hasattr(self, 'arrow_mapper'):
+            self.arrow_mapper.SetInputData(self.arrow_sample(self.max_points.value()))
+            self.request_render()
+
+    ''' A new arrow scale only changes the scale factor of the instanced glyphs '''
+    def on_arrow_scale_change(self):
+        if self.qt_arrow_checkbox.isChecked() == True and hasattr(self, 'arrow_mapper'):
+            self.arrow_mapper.SetScaleFactor(self.arrow_scale.value())
+            self.request_render()
+
+    ''' Show an arrow plot on a 2D surface.
+        A vtkGlyph3DMapper draws the one arrow mesh instanced at every sample
+        point, oriented and scaled by the velocity on the GPU, instead of
+        copying the arrow geometry once per point as vtkGlyph2D does.
+    '''
     def on_arrow_checkbox_change(self):
         if self.qt_arrow_checkbox.isChecked() == True:
             
@@ -302,30 +664,23 @@ class MainWindow(Qt.QMainWindow):
             glyphSource.SetGlyphTypeToArrow()
             glyphSource.FilledOff()
 
-            densityFilter = vtk.vtkMaskPoints()
-            densityFilter.SetInputData(self.reader.GetOutput())
-            densityFilter.RandomModeOn() # enable the random sampling mechanism
-            densityFilter.SetRandomModeType(3) #specify the sampling mode
-            # densityFilter.SetMaximumNumberOfPoints(500)
-            densityFilter.SetMaximumNumberOfPoints(int(self.max_points.value()))
-            # print(int(self.max_points.value()))
-            densityFilter.Update()
-
-            glyph2D = vtk.vtkGlyph2D()
-            glyph2D.SetSourceConnection(glyphSource.GetOutputPort())
-            glyph2D.SetInputData(densityFilter.GetOutput())
-            glyph2D.OrientOn()
-            glyph2D.SetScaleModeToScaleByVector()
-            # glyph2D.SetScaleFactor(0.03) # adjust the length of the arrows accordingly
-            # print(self.arrow_scale.value())
-            glyph2D.SetScaleFactor(self.arrow_scale.value()) # adjust the length of the arrows accordingly
-            glyph2D.Update()
-
-            arrows_mapper = vtk.vtkPolyDataMapper()
-            arrows_mapper.SetInputConnection(glyph2D.GetOutputPort())
-            arrows_mapper.Update()
+            # The arrow positions are a prefix of the density pyramid, which
+            # is computed once per file
+            arrowSample = self.arrow_sample(self.max_points.value())
+
+            self.arrow_mapper = vtk.vtkGlyph3DMapper()
+            self.arrow_mapper.SetSourceConnection(glyphSource.GetOutputPort())
+            self.arrow_mapper.SetInputData(arrowSample)
+            self.arrow_mapper.OrientOn()
+            self.arrow_mapper.SetOrientationModeToDirection()
+            self.arrow_mapper.SetOrientationArray("velocity")
+            self.arrow_mapper.ScalingOn()
+            self.arrow_mapper.SetScaleModeToScaleByMagnitude()
+            self.arrow_mapper.SetScaleArray("velocity")
+            self.arrow_mapper.SetScaleFactor(self.arrow_scale.value()) # adjust the length of the arrows accordingly
+
             self.arrow_actor = vtk.vtkActor()
-            self.arrow_actor.SetMapper(arrows_mapper)
+            self.arrow_actor.SetMapper(self.arrow_mapper)
             self.arrow_actor.GetProperty().SetColor(1,0,0) # set the color you want
 
             self.ren.AddActor(self.arrow_actor)
@@ -342,305 +697,446 @@ class MainWindow(Qt.QMainWindow):
     '''
     def on_seeding_strategy(self):
         if self.uniform_seed_radio.isChecked() == True:
-            self.random_seed_radio.setChecked(False)
             self.seeding_strategy = 0
         elif self.random_seed_radio.isChecked() ==  True:
-            self.uniform_seed_radio.setChecked(False)
             self.seeding_strategy = 1
+        elif self.evenly_seed_radio.isChecked() ==  True:
+            self.seeding_strategy = 2
+        elif self.poisson_seed_radio.isChecked() ==  True:
+            self.seeding_strategy = 3
 
    
     '''         
         Complete the following function for genenerate uniform seeds 
-        for streamline placement
+        for streamline placement: an n x n lattice over the data bounds
 
     '''
     def uniform_generate_seeds(self):
         num_seeds = int (self.number_seeds.value())
-        seedPoints = vtk.vtkPoints()
-
-        # Generate the uniformly positioned seeds below!!
-
-        bound = self.reader.GetPolyDataOutput().GetBounds()
-        for i in range(num_seeds):
-            for j in range(num_seeds):
-                x_i = random.randint(0,32768) / 32768.0
-                y_j = random.randint(0,32768) / 32768.0
-                x = bound[0] + x_i * (bound[1] - bound[0])
-                y = bound[2] + y_j * (bound[3] - bound[2])
-                seedPoints.InsertNextPoint(x, y, 0)
-
-        # Need to put the seed points in a vtkPolyData object
-        seedPolyData  = vtk.vtkPolyData()
-        seedPolyData.SetPoints(seedPoints)
-        return seedPolyData
+        bound = self.velocity_grid.bounds
+        return seeding.to_polydata(seeding.lattice_points(bound, num_seeds, 2))
 
     '''  
         Complete the following function for genenerate random seeds 
-        for streamline placement
+        for streamline placement: n x n uniformly distributed random points
     '''
     def random_generate_seeds(self):
         numb_seeds = int (self.number_seeds.value())
-        seedPoints = vtk.vtkPoints()       
-
-        # Generate the random seeds below!!
-
-        bound = self.reader.GetPolyDataOutput().GetBounds()
-        for i in range(numb_seeds):
-            for j in range(numb_seeds):
-                x_i = i * (1.0/(numb_seeds - 1))
-                y_j = j * (1.0/(numb_seeds - 1))
-                x = bound[0] + x_i * (bound[1] - bound[0])
-                y = bound[2] + y_j * (bound[3] - bound[2])
-                seedPoints.InsertNextPoint(x, y, 0)
+        bound = self.velocity_grid.bounds
+        return seeding.to_polydata(seeding.random_points(bound, numb_seeds * numb_seeds, 2))
 
-        # Need to put the seed points in a vtkPolyData object
-        seedPolyData  = vtk.vtkPolyData()
-        seedPolyData.SetPoints(seedPoints)
-        return seedPolyData
+    '''
+        Poisson-disk (blue-noise) seeds: about "number of seeds" points, no
+        two closer than the radius that gives this count, so they cover the
+        domain evenly
+    '''
+    def poisson_generate_seeds(self):
+        numb_seeds = int (self.number_seeds.value())
+        bound = self.velocity_grid.bounds
+        radius = seeding.radius_for_count(bound, numb_seeds, 2)
+        return seeding.to_polydata(seeding.poisson_disk(bound, radius, 2))
 
         
+    '''
+        Key of the streamline cache: everything the traced lines depend on
+    '''
+    def get_streamline_key(self):
+        key = (self.vector_file_hash, self.seeding_strategy, tuple(sorted(STREAMLINE_SETTINGS.items())))
+        if self.seeding_strategy == 2:
+            return key + (self.streamline_separation.value(),)
+        return key + (int(self.number_seeds.value()),)
+
     ''' 
         Complete the following function to generate a set of streamlines
-        from the above generated uniform or random seeds
+        from the above generated uniform or random seeds.
+        The seeds are traced by a StreamlineWorker in the background: all
+        the seeds are integrated together (adaptive RK45, in both
+        directions) over the cached velocity grid, or by vtkStreamTracer
+        when there are only a few of them, see streamlines.py, with
+        STREAMLINE_SETTINGS. The evenly-spaced strategy places and traces
+        its lines itself. Finished lines are shown as they come, and all
+        of them are swapped in and cached under key at the end.
     '''
-    def on_streamline_checkbox_change(self):
-        if self.qt_streamline_checkbox.isChecked() == True:
+    def trace_streamlines(self, key):
+        bound = self.velocity_grid.bounds
+        separation = None
+        seeds = None
+        if self.seeding_strategy == 2:
+            # Steps 1 and 2: seeds are chosen while the lines are traced
+            separation = self.streamline_separation.value() * (bound[1] - bound[0])
+        else:
             # Step 1: Create seeding points 
             if self.seeding_strategy == 1: 
                 seedPolyData = self.random_generate_seeds() # You also can try generate_seeding_line()
             elif self.seeding_strategy == 0:
                 seedPolyData = self.uniform_generate_seeds()
-            
-            # Step 2: Create a vtkStreamTracer object, set input data and seeding points
-
-            stream_tracer = vtk.vtkStreamTracer()
-            stream_tracer.SetInputData(self.reader.GetPolyDataOutput()) # set vector field
-            stream_tracer.SetSourceData(seedPolyData) # pass in the seeds
-
-            # Step 3: Set the parameters. 
-            # Check the reference https://vtk.org/doc/nightly/html/classvtkStreamTracer.html
-            # to have the full list of parameters
+            elif self.seeding_strategy == 3:
+                seedPolyData = self.poisson_generate_seeds()
+            seeds = numpy_support.vtk_to_numpy(seedPolyData.GetPoints().GetData())
+
+        # Step 2: Trace the seeds in the background, step 3 (the polylines)
+        # arrives chunk by chunk
+        self.traced_key = key
+        self.traced_lines = vtk.vtkAppendPolyData()
+        self.stream_mapper.SetInputData(vtk.vtkPolyData())
+        self.streamline_worker = StreamlineWorker(self.velocity_grid.field, bound, seeds, separation, self)
+        self.streamline_worker.chunk_ready.connect(self.on_streamline_chunk)
+        self.streamline_worker.progress.connect(self.on_streamline_progress)
+        self.streamline_worker.lines_ready.connect(self.on_streamlines_ready)
+        self.streamline_worker.finished.connect(self.streamline_worker.deleteLater)
+        self.streamline_progress.setValue(0)
+        self.streamline_progress_widget.show()
+        self.streamline_worker.start()
+
+    ''' Show the lines finished so far, with a new chunk of them '''
+    def on_streamline_chunk(self, chunk):
+        # Ignore the chunks of a cancelled worker that were already queued
+        if self.sender() is not self.streamline_worker:
+            return
+        self.traced_lines.AddInputData(chunk)
+        self.traced_lines.Update()
+        partial = vtk.vtkPolyData()
+        partial.ShallowCopy(self.traced_lines.GetOutput())
+        self.stream_mapper.SetInputData(partial)
+        self.vtkWidget.GetRenderWindow().Render()
 
-            stream_tracer.SetIntegratorTypeToRungeKutta45()
-            stream_tracer.SetIntegrationDirectionToBoth()
-            stream_tracer.Update()
+    def on_streamline_progress(self, fraction):
+        if self.sender() is self.streamline_worker:
+            self.streamline_progress.setValue(int(100 * fraction))
+
+    ''' All the seeds are traced: cache the lines and show them '''
+    def on_streamlines_ready(self, streamlinePolyData):
+        if self.sender() is not self.streamline_worker:
+            return
+        self.streamline_worker = None
+        self.streamline_progress_widget.hide()
+        self.show_streamlines(self.traced_key, streamlinePolyData)
+        self.vtkWidget.GetRenderWindow().Render()
 
+    '''
+        Stop the streamline tracing that is still in progress, if any. The
+        lines traced so far stay on display but are not cached.
+    '''
+    def cancel_streamlines(self):
+        if getattr(self, 'streamline_worker', None) is not None:
+            self.streamline_worker.cancel()
+            self.streamline_worker = None
+            self.streamline_key = None
+        self.streamline_progress_widget.hide()
+
+    ''' Display the traced lines of key, keeping them in the streamline cache '''
+    def show_streamlines(self, key, streamlinePolyData):
+        self.streamline_cache[key] = streamlinePolyData
+        while len(self.streamline_cache) > STREAMLINE_CACHE_SIZE:
+            self.streamline_cache.popitem(last=False)
+        self.streamline_key = key
+        self.stream_mapper.SetInputData(streamlinePolyData)
 
+    '''
+        Show or hide the streamlines. Traced lines are cached by
+        get_streamline_key, so unticking only hides the actor and ticking
+        again with unchanged settings shows it without tracing anything.
+        Lines that are not cached are traced in the background.
+    '''
+    def on_streamline_checkbox_change(self):
+        self.cancel_streamlines()
+        if self.qt_streamline_checkbox.isChecked() == True:
             # Step 4: Visualization
+            if not hasattr(self, 'streamline_actor'):
+                self.stream_mapper = vtk.vtkPolyDataMapper()
+                self.stream_mapper.ScalarVisibilityOff()
+
+                self.streamline_actor = vtk.vtkActor()
+                self.streamline_actor.GetProperty().SetColor(0,0,1)
+                self.streamline_actor.SetMapper(self.stream_mapper)
+                self.streamline_actor.GetProperty().SetOpacity(0.4)
+                self.ren.AddActor(self.streamline_actor)
+                self.streamline_key = None
+
+            key = self.get_streamline_key()
+            if key != self.streamline_key:
+                streamlinePolyData = self.streamline_cache.pop(key, None)
+                if streamlinePolyData is None:
+                    self.trace_streamlines(key)
+                else:
+                    self.show_streamlines(key, streamlinePolyData)
 
-            stream_mapper = vtk.vtkPolyDataMapper()
-            stream_mapper.SetInputConnection(stream_tracer.GetOutputPort())
-            stream_mapper.ScalarVisibilityOff()
-            stream_mapper.Update()
-
-            self.streamline_actor = vtk.vtkActor()
-            self.streamline_actor.GetProperty().SetColor(0,0,1)
-            self.streamline_actor.SetMapper(stream_mapper)
-            self.streamline_actor.GetProperty().SetOpacity(0.4)
-
-            self.ren.AddActor(self.streamline_actor)
-                    
+            self.streamline_actor.VisibilityOn()
         
-        # Turn on the following if you want to disable the streamline visualization
-        # But again you need to modify the "streamline_actor" name based on what you use!!!
-        else:
-            self.ren.RemoveActor(self.streamline_actor)
+        # Unticking only hides the streamlines, they stay cached
+        elif hasattr(self, 'streamline_actor'):
+            self.streamline_actor.VisibilityOff()
         
            
         # Re-render the screen
         self.vtkWidget.GetRenderWindow().Render()       
     
 
-    ''' Create a white noise texture for LIC computation '''
+    ''' Get the noise texture for LIC computation
+        The noise comes from a pyramid of pre-filtered levels down from
+        LIC_MAX_IN_MEMORY_RES that is kept until the noise type or seed
+        changes, so LIC at another IMG_RES reuses the same noise. Large
+        textures use HashedNoise instead.
+    '''
     def create_noise_texture(self):
-
-        for i in range( 0, self.IMG_RES):
-            for j in range( 0, self.IMG_RES):   
-                noise_value = int(255*(random.randint(0,32768) / 32768.0))
-                self.noise_tex[i][j] = [noise_value,noise_value,noise_value]
+        kind = NOISE_KINDS[self.noise_kind.currentIndex()]
+        seed = self.noise_seed.value()
+        if (not hasattr(self, 'noise_pyramid') or self.noise_pyramid.kind != kind
+                or self.noise_pyramid.seed != seed):
+            self.noise_pyramid = NoisePyramid(kind, seed, LIC_MAX_IN_MEMORY_RES)
+        self.noise_tex = self.noise_pyramid.level(min(self.IMG_RES, LIC_MAX_IN_MEMORY_RES))
                 
  
-    ''' This function generates a uniform grid for the input data '''
-    def generate_uniform_grid(self):
-        self.vectorFieldPolyData = self.reader.GetPolyDataOutput()
-        self.bounds = self.vectorFieldPolyData.GetBounds()
-        
-        #Create a uniform grid of points to interpolate over
-        gridPoints = vtk.vtkPoints()
-        
-        self.space_x = (self.bounds[1]-self.bounds[0])/(self.IMG_RES-1)
-        self.space_y = (self.bounds[3]-self.bounds[2])/(self.IMG_RES-1)
-        self.space_z = 0
-        for i in range( 0, self.IMG_RES):   
-            for j in range( 0, self.IMG_RES):           
-                x = self.bounds[0] + i * self.space_x
-                y = self.bounds[2] + j * self.space_y
-                gridPoints.InsertNextPoint ( x, y, 0)
-        
-        self.LICPolyData = vtk.vtkPolyData() # We will reuse this object for the final visualization of the LIC texture
-        self.LICPolyData.SetPoints(gridPoints)
-        # print(self.LICPolyData.GetNumberOfPoints())
+    ''' This function caches the velocity of the input data on a regular grid
+        (the original lattice when the data is one, a resampled grid otherwise).
+        LIC, the arrow plots and the seeding all sample this grid.
+    '''
+    def generate_velocity_grid(self):
+        vectorFieldData = self.reader.GetOutput()
+        if vectorFieldData.GetPointData().GetArray("velocity") is None:
+            self.velocity_grid = None
+            return
+        self.velocity_grid = VelocityGrid.from_dataset(vectorFieldData)
  
     
 
-    ''' COMPLETE THE FOLLOWING LIC COMPUTATION    
-        For each pixel:
-            1. Compute a streamline from the center of this pixel using vtlStreamTracer. 
-               Set the maximum length of the streamline and the step size properly
-            2. From the above obtained streamline, get its integration points and find
-               their corresponding pixel indices in the white noise texture
-            3. Accumulate the color values from the pixels obtained in the previous step
+    ''' LIC computation
+        All the pixel centers are advected together over the cached velocity
+        grid of the loaded field (see lic.py):
+            1. Advect every pixel center forward and backward along the
+               normalized field for the given integration length
+            2. Map the integration points to their pixels in the noise texture
+            3. Average the noise values found along each path
+        With a key, the texture is stored in the on-disk cache under it.
         @return: the LIC texture in a vtkImageData object
     '''
    
-    def Compute_LIC(self, integration_length):
-        
-        # Create the vtkImageData to store the lic texture for rendering
-        licImage = vtk.vtkImageData()
-
-        vectorFieldPolyData = self.reader.GetPolyDataOutput()
-        self.bounds = vectorFieldPolyData.GetBounds()
-        self.space_x = (self.bounds[1]-self.bounds[0])/(self.IMG_RES-1)
-        self.space_y = (self.bounds[3]-self.bounds[2])/(self.IMG_RES-1)
-        self.space_z = 0
-       
-        # Initialize the vtkImageData object
-        licImage.SetDimensions([self.IMG_RES,self.IMG_RES,1])
-        licImage.SetSpacing(self.space_x,self.space_y,self.space_z)
-        licImage.SetOrigin(self.bounds[0], self.bounds[2], self.bounds[4])
-        licImage.AllocateScalars(vtk.VTK_UNSIGNED_CHAR,3)
-        
-        integration_len = (self.bounds[1]-self.bounds[0])/self.max_len.value()
-
-        # LIC calculation   (PLEAE COMPLETE)
-
-        # seedPoints = vtk.vtkPoints() 
-        bound = self.reader.GetPolyDataOutput().GetBounds()
-        # print(bound)
-        # return licImage
-        for i in range(0, self.IMG_RES):
-            for j in range(0, self.IMG_RES):
-                x_j = (j + 0.5) / self.IMG_RES # remember j is the column index that corresponds to x direction!
-                y_i = (i + 0.5) / self.IMG_RES # i is the row index corresponding to the y direction!
-                x = bound[0] + x_j * (bound[1] - bound[0])
-                y = bound[2] + y_i * (bound[3] - bound[2])
-                # seedPoints.InsertNextPoint(x, y, bound[4])
-                # print(self.IMG_RES)
-                # print(self.space_x)
-
-                # Need to put the seed points in a vtkPolyData object
-                # seedPolyData  = vtk.vtkPolyData()
-                # seedPolyData.SetPoints(seedPoints)
-
-                stream_tracer = vtk.vtkStreamTracer()
-                stream_tracer.SetInputData(self.reader.GetPolyDataOutput()) # set vector field
-                # stream_tracer.SetSourceData(seedPolyData) # pass in the seeds
-                stream_tracer.SetStartPosition(x, y, bound[4]) 
-                stream_tracer.SetMaximumPropagation(integration_len)
-                stream_tracer.SetInitialIntegrationStep(self.space_x )
-                stream_tracer.SetIntegrationDirectionToBoth()
-
-                stream_tracer.Update()
-
-                streamline = stream_tracer.GetOutput()
-                integrationPts = streamline.GetPoints()
-                nPts = integrationPts.GetNumberOfPoints()
-                # print(integrationPts.GetBounds())
-                # return licImage
-                curSum = 0
-                for val in range (nPts):
-                    fin_x = integrationPts.GetPoint(val)[0]
-                    fin_y = integrationPts.GetPoint(val)[1]
-                    # print(fin_x, fin_y)
-                    fin_j = (self.IMG_RES * ( (fin_x - bound[0]) / (bound[1] - bound[0]) )) - 0.5
-                    fin_i = (self.IMG_RES * ( (fin_y - bound[2]) / (bound[3] - bound[2]) )) - 0.5
-                    # fin_j = (self.IMG_RES * fin_x) - 0.5
-                    # fin_i = (self.IMG_RES * fin_y) - 0.5
-                    # print(fin_i, fin_j)
-                    curSum += self.noise_tex[int(fin_i)][int(fin_j)][0]
-
-                # return licImage
-                if nPts == 0:
-                    self.LIC_tex[i][j][0] = self.LIC_tex[i][j][1] = self.LIC_tex[i][j][2] = 0
-                else:
-                    self.LIC_tex[i][j][0] = self.LIC_tex[i][j][1] = self.LIC_tex[i][j][2] = curSum/nPts
-                # return licImage
- 
+    def Compute_LIC(self, integration_length, res, fast, key=None):
+        # Convolve all the pixels together over the cached velocity grid
+        self.LIC_tex = lic.compute_texture(self.velocity_grid.field, self.velocity_grid.bounds,
+                                           self.noise_pyramid.level(res), integration_length,
+                                           fast, self.lic_workers.value())
+        if key is not None:
+            self.lic_cache.put(key, self.LIC_tex)
 
-       # Convert the LIC texture to a vtkImageData      
-        k = 0
-        for j in range( 0, self.IMG_RES):
-            for i in range( 0, self.IMG_RES):
-                # try:                
-                    # r = (self.LIC_tex[i][j][0] * 0.5) + (self.LICPolyData.GetPoint((i+1)*(j+1)) * 0.5)
-                    # g = (self.LIC_tex[i][j][1] * 0.5) + (self.LICPolyData.GetPoint((i+1)*(j+1)) * 0.5)
-                    # b = (self.LIC_tex[i][j][2] * 0.5) + (self.LICPolyData.GetPoint((i+1)*(j+1)) * 0.5)
-                r = self.LIC_tex[i][j][0]
-                g = self.LIC_tex[i][j][1]
-                b = self.LIC_tex[i][j][2]
-                # except TypeError:
-                #     print(self.LICPolyData.GetPoint((i+1)*(j+1)))
-                #     print(type(self.LICPolyData.GetPoint((i+1)*(j+1))))
-                #     return licImage
-                                               
-                # Update the color value for the licImage
-                licImage.SetScalarComponentFromDouble(j,i,k,0, r) # Note: we need to flip j,i to get the correct result
-                licImage.SetScalarComponentFromDouble(j,i,k,1, g)
-                licImage.SetScalarComponentFromDouble(j,i,k,2, b)
-        
-        return licImage
+        return self.update_LIC_image(self.LIC_tex)
+
+    '''
+        Key of the on-disk cache entry at resolution res for the FastLIC
+        setting fast and the "Maximum Integration Length" max_len; these are
+        the values the texture is computed with, not the current widgets.
+    '''
+    def LIC_cache_key(self, res, fast, max_len):
+        kernel = "fastlic-box" if fast else "lic-box"
+        # The pyramid levels are averaged down from its base resolution
+        noise = (self.noise_pyramid.kind, self.noise_pyramid.seed, self.noise_pyramid.base_res)
+        if res > LIC_MAX_IN_MEMORY_RES:
+            # Large textures are banded and use hashed white noise
+            kernel += "-banded"
+            noise = ("hashed", self.noise_pyramid.seed)
+        return LICCache.key(self.vector_file_hash, res, max_len, noise, kernel)
+
+    '''
+        Hand the LIC texture over to the vtkImageData used for rendering.
+        The image scalars are a view of self.lic_buffer, a contiguous
+        (IMG_RES, IMG_RES, 3) uint8 array, so the texture is written with one
+        array assignment instead of per-pixel calls. The buffer and the image
+        are only reallocated when the resolution or the data bounds change.
+        @return: the LIC texture in a vtkImageData object
+    '''
+    def update_LIC_image(self, texture):
+        res = texture.shape[0]
+        self.bounds = self.velocity_grid.bounds
+        if (not hasattr(self, 'lic_buffer') or self.lic_buffer.shape[0] != res
+                or self.lic_image_bounds != self.bounds):
+            self.space_x = (self.bounds[1]-self.bounds[0])/(res-1)
+            self.space_y = (self.bounds[3]-self.bounds[2])/(res-1)
+            self.space_z = 0
+
+            # Create the vtkImageData to store the lic texture for rendering
+            self.licImage = vtk.vtkImageData()
+            self.licImage.SetDimensions([res,res,1])
+            self.licImage.SetSpacing(self.space_x,self.space_y,self.space_z)
+            self.licImage.SetOrigin(self.bounds[0], self.bounds[2], self.bounds[4])
+
+            # vtkImageData stores x fastest, i.e. row i (y) and column j (x) of
+            # the buffer is point j + i * res of the image
+            self.lic_buffer = np.zeros((res, res, 3), dtype=np.uint8)
+            scalars = numpy_support.numpy_to_vtk(self.lic_buffer.reshape(-1, 3), deep=False)
+            self.licImage.GetPointData().SetScalars(scalars)
+            self.lic_image_bounds = self.bounds
+
+        attribute = self.lic_color_attributes[max(self.lic_color_by.currentIndex(), 0)]
+        if attribute is None:
+            self.lic_buffer[...] = np.clip(texture, 0, 255)[:, :, None]
+        else:
+            # Blend the attribute colours in, as one pass over the whole texture
+            x, y = lic.pixel_centers(self.bounds, res)
+            self.attribute_vals = self.velocity_grid.attribute(attribute, x, y)
+            if attribute == "magnitude":
+                u, v = self.velocity_grid.field[:, :, 0], self.velocity_grid.field[:, :, 1]
+                value_range = (0.0, float(np.hypot(u, v).max()))
+            else:
+                values = self.velocity_grid.scalars[attribute]
+                value_range = (float(values.min()), float(values.max()))
+            self.lic_lut.SetTableRange(value_range)
+            table = numpy_support.vtk_to_numpy(self.lic_lut.GetTable())
+            self.lic_buffer[...] = lic.colorize(texture, self.attribute_vals, table, value_range)
+        self.licImage.GetPointData().GetScalars().Modified()
+        return self.licImage
+
+    ''' Re-colour the LIC texture on display, no LIC recomputation needed '''
+    def on_LIC_color_change(self):
+        if self.LIC_checkbox.isChecked() == True and hasattr(self, 'LIC_tex'):
+            self.update_LIC_image(self.LIC_tex)
+            self.vtkWidget.GetRenderWindow().Render()
     
 
 
     def generate_LIC(self):
         
-        # Step 1: Set up three texture arrays
-        self.IMG_RES = 256 #Specify the texture resolution
-        
-        # Initialize the arrays for LIC computation 
-        self.noise_tex = [[ 0 for col in range(self.IMG_RES)] for row in range(self.IMG_RES)]
-        self.vec_img = [[ [0,0,0] for col in range(self.IMG_RES)] for row in range(self.IMG_RES)] 
-        self.LIC_tex = [[ [0,0,0] for col in range(self.IMG_RES)] for row in range(self.IMG_RES)] 
+        # Step 1: Specify the texture resolution
+        self.IMG_RES = LIC_RESOLUTIONS[self.lic_resolution.currentIndex()]
+        self.lic_status.setText("")
 
-        # Initialize an attribute image for color blending with the LIC texture
-        self.attribute_vals = [[ 0 for col in range(self.IMG_RES)] for row in range(self.IMG_RES)] 
-        self.attribute_img = [[ [0,0,0] for col in range(self.IMG_RES)] for row in range(self.IMG_RES)] 
-
-        # Step 2: Create a white noise texture
+        # Step 2: Get the (single channel) noise texture
         self.create_noise_texture()
 
         # Step 3: Compute the LIC texture
-        # self.bounds = vectorFieldPolyData.GetBounds()
-        bound = self.reader.GetPolyDataOutput().GetBounds()  
-
-        length = (bound[1]-bound[0])/self.max_len.value() # Make this a user-specified parameter on the interface
-        self.generate_uniform_grid()
-        # tex_Colors = vtk.vtkImageMapToColors()
-        # tex_Colors.SetInputConnection(self.LICPolyData.GetOutputPort())
-        # tex_Colors.SetLookupTable(self.bwLut)
-        # tex_Colors.Update()
-
-        licImage = self.Compute_LIC(length)
+        bound = self.velocity_grid.bounds
+
+        # The settings are read once: the refinement in the background and
+        # the cache entries use these values even if the widgets change
+        max_len = self.max_len.value()
+        self.lic_fast = self.fast_LIC_checkbox.isChecked()
+        self.lic_key = self.LIC_cache_key(self.IMG_RES, self.lic_fast, max_len)
+        length = (bound[1]-bound[0])/max_len # Make this a user-specified parameter on the interface
+
+        # In progressive mode only the coarse preview is computed here,
+        # refine_LIC computes the finer levels in the background
+        self.lic_length = length
+        # Large textures always start from the preview, refine_LIC computes
+        # (or reloads) the full texture file in the background
+        if self.IMG_RES > LIC_MAX_IN_MEMORY_RES:
+            cached = None
+        else:
+            cached = self.lic_cache.get(self.lic_key)
+        if cached is not None:
+            self.lic_res = self.IMG_RES
+            self.LIC_tex = cached
+            licImage = self.update_LIC_image(cached)
+        else:
+            if (self.progressive_LIC_checkbox.isChecked() == True
+                    or self.IMG_RES > LIC_MAX_IN_MEMORY_RES):
+                self.lic_res = min(LIC_PREVIEW_RES, self.IMG_RES)
+            else:
+                self.lic_res = self.IMG_RES
+            licImage = self.Compute_LIC(length, self.lic_res, self.lic_fast,
+                                        self.lic_key if self.lic_res == self.IMG_RES else None)
 
 
         # Step 4: Visualize
         
-        img_mapper = vtk.vtkDataSetMapper()
-        img_mapper.SetInputData(licImage)
-        img_mapper.Update()
+        self.lic_mapper = vtk.vtkDataSetMapper()
+        self.lic_mapper.SetInputData(licImage)
+        self.lic_mapper.Update()
         
         lic_actor = vtk.vtkActor()
-        lic_actor.SetMapper(img_mapper)
+        lic_actor.SetMapper(self.lic_mapper)
         
         return lic_actor
+
+    '''
+        Start a background worker that computes the LIC levels between the
+        preview and IMG_RES (doubling the resolution each time) and swaps
+        each of them into the lic_actor as it finishes. Large textures are
+        computed by a LICBandWorker instead.
+    '''
+    def refine_LIC(self):
+        if self.IMG_RES > LIC_MAX_IN_MEMORY_RES:
+            self.refine_large_LIC()
+            return
+
+        levels = []
+        res = self.lic_res * 2
+        while res < self.IMG_RES:
+            levels.append(res)
+            res *= 2
+        if self.lic_res < self.IMG_RES:
+            levels.append(self.IMG_RES)
+        if len(levels) == 0:
+            return
+
+        noise_levels = [self.noise_pyramid.level(res) for res in levels]
+        self.lic_worker = LICWorker(self.velocity_grid.field, self.velocity_grid.bounds, noise_levels,
+                                    self.lic_length, self.lic_fast,
+                                    self.lic_workers.value(), self.lic_key, self)
+        self.lic_worker.level_ready.connect(self.on_LIC_level_ready)
+        self.lic_worker.finished.connect(self.on_LIC_finished)
+        self.lic_worker.finished.connect(self.lic_worker.deleteLater)
+        self.lic_worker.start()
+
+    '''
+        Start a background worker that computes the IMG_RES texture in row
+        bands into a .npy file of the LIC cache directory, with a bounded
+        amount of memory, and shows it downsampled to LIC_DISPLAY_RES.
+        A texture computed earlier with the same settings is only reloaded.
+    '''
+    def refine_large_LIC(self):
+        self.lic_out_path = self.lic_cache.array_path(self.lic_key, touch=True)
+        noise = HashedNoise(self.IMG_RES, self.noise_pyramid.seed)
+        self.lic_worker = LICBandWorker(self.velocity_grid.field, self.velocity_grid.bounds, noise,
+                                        self.lic_length, self.lic_fast,
+                                        self.lic_out_path, LIC_DISPLAY_RES, self.lic_key, self)
+        self.lic_worker.level_ready.connect(self.on_LIC_level_ready)
+        self.lic_worker.progress.connect(self.on_LIC_progress)
+        self.lic_worker.finished.connect(self.on_LIC_finished)
+        self.lic_worker.finished.connect(self.lic_worker.deleteLater)
+        self.lic_worker.start()
+
+    ''' Report the progress of a large LIC texture '''
+    def on_LIC_progress(self, fraction):
+        if self.sender() is self.lic_worker:
+            self.lic_status.setText("Computing %d x %d LIC: %d%%"
+                                    % (self.IMG_RES, self.IMG_RES, int(100 * fraction)))
+
+    ''' Stop the LIC refinement that is still in progress, if any '''
+    def cancel_LIC(self):
+        if getattr(self, 'lic_worker', None) is not None:
+            self.lic_worker.cancel()
+            self.lic_worker = None
+
+    ''' Forget the LIC worker once it is done (it deletes itself) '''
+    def on_LIC_finished(self):
+        if self.sender() is self.lic_worker:
+            self.lic_worker = None
+
+    ''' Show a refined LIC level computed by the background worker '''
+    def on_LIC_level_ready(self, texture):
+        # Ignore the levels of a cancelled worker that were already queued
+        if self.sender() is not self.lic_worker or self.LIC_checkbox.isChecked() == False:
+            return
+
+        self.LIC_tex = texture
+        self.lic_res = texture.shape[0]
+        if self.lic_res == self.IMG_RES:
+            self.lic_cache.put(self.lic_worker.key, texture)
+        elif self.IMG_RES > LIC_MAX_IN_MEMORY_RES:
+            self.lic_status.setText("%d x %d LIC texture: %s"
+                                    % (self.IMG_RES, self.IMG_RES, self.lic_out_path))
+            self.lic_cache.evict()
+        self.lic_mapper.SetInputData(self.update_LIC_image(texture))
+        self.vtkWidget.GetRenderWindow().Render()
     
     def on_LIC_checkbox(self):
+        self.cancel_LIC()
         if hasattr(self, 'lic_actor'):
             self.ren.RemoveActor(self.lic_actor)   
         
         if self.LIC_checkbox.isChecked() == True:
             self.lic_actor = self.generate_LIC()
             self.ren.AddActor(self.lic_actor)
+            self.refine_LIC()
 
         # Re-render the screen
         self.vtkWidget.GetRenderWindow().Render()
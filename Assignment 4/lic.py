@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized line integral convolution (LIC) for the Assignment 4 window.
+
+Instead of building one vtkStreamTracer per pixel, all the pixel seeds are
+advected together as NumPy arrays over the regular velocity grid of the
+loaded field (see velocity_grid.py), and the noise texture is averaged along
+the resulting paths.
+
+@author: Raunak Sarbajna
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from velocity_grid import sample_bilinear
+
+
+'''
+    Unit direction of the field at (x, y), plus a mask of the positions where
+    the field does not vanish (critical points stop the integration).
+'''
+def _direction(field, bounds, x, y):
+    u, v = sample_bilinear(field, bounds, x, y)
+    mag = np.hypot(u, v)
+    ok = mag > 1e-12
+    inv = np.where(ok, 1.0 / np.where(ok, mag, 1.0), 0.0)
+    return u * inv, v * inv, ok
+
+
+'''
+    Advect the seeds (x, y) for n_steps midpoint (RK2) steps of arc length h
+    along the normalized field, in the direction given by sign (+1 or -1).
+    Yields the new positions and the mask of streamlines still alive after
+    each step; a streamline dies when it leaves the domain or hits a critical
+    point.
+'''
+def _advect(field, bounds, x, y, h, n_steps, sign):
+    x = x.copy()
+    y = y.copy()
+    alive = np.ones(x.shape, dtype=bool)
+    for _ in range(n_steps):
+        dx, dy, ok1 = _direction(field, bounds, x, y)
+        xm = x + 0.5 * sign * h * dx
+        ym = y + 0.5 * sign * h * dy
+        dx, dy, ok2 = _direction(field, bounds, xm, ym)
+        xn = x + sign * h * dx
+        yn = y + sign * h * dy
+
+        inside = (xn >= bounds[0]) & (xn <= bounds[1]) & (yn >= bounds[2]) & (yn <= bounds[3])
+        alive &= ok1 & ok2 & inside
+        if not alive.any():
+            break
+        x = np.where(alive, xn, x)
+        y = np.where(alive, yn, y)
+        yield x, y, alive
+
+
+'''
+    Map world positions to (row, column) indices of a res x res texture
+    that covers the bounds.
+'''
+def _pixel_index(bounds, res, x, y):
+    col = ((x - bounds[0]) / (bounds[1] - bounds[0]) * res).astype(np.intp)
+    row = ((y - bounds[2]) / (bounds[3] - bounds[2]) * res).astype(np.intp)
+    return np.clip(row, 0, res - 1), np.clip(col, 0, res - 1)
+
+
+'''
+    World coordinates of the centers of the pixels in rows [row0, row1) and
+    columns [col0, col1) of a res x res texture covering the bounds.
+'''
+def pixel_centers(bounds, res, row0=0, row1=None, col0=0, col1=None):
+    if row1 is None:
+        row1 = res
+    if col1 is None:
+        col1 = res
+    xs = bounds[0] + (np.arange(col0, col1) + 0.5) / res * (bounds[1] - bounds[0])
+    ys = bounds[2] + (np.arange(row0, row1) + 0.5) / res * (bounds[3] - bounds[2])
+    return np.meshgrid(xs, ys)
+
+
+'''
+    Default integration step (half a pixel) and number of steps per direction
+    for a streamline of the given length.
+'''
+def _steps(bounds, res, length, step):
+    if step is None:
+        step = 0.5 * (bounds[1] - bounds[0]) / res
+    return step, max(int(np.ceil(length / step)), 1)
+
+
+'''
+    Convolve the noise along the streamlines through the seeds (x, y):
+    each seed is advected forward and backward by n_steps steps and the
+    noise is box-filtered along the path. The noise is anything indexable
+    as noise[row, col] with a shape, i.e. an array or a noise.HashedNoise.
+'''
+def _convolve(field, bounds, noise, x, y, step, n_steps):
+    res = noise.shape[0]
+    row, col = _pixel_index(bounds, res, x, y)
+    total = noise[row, col].astype(np.float32)
+    count = np.ones(total.shape, dtype=np.float32)
+
+    for sign in (1.0, -1.0):
+        for xs, ys, alive in _advect(field, bounds, x, y, step, n_steps, sign):
+            row, col = _pixel_index(bounds, res, xs, ys)
+            total += np.where(alive, noise[row, col], 0.0)
+            count += alive
+
+    return total / count
+
+
+'''
+    Compute the LIC texture of the field.
+        field:  (ny, nx, 2) velocity array of a VelocityGrid
+        bounds: the dataset bounds the grid covers
+        noise:  (res, res) noise texture; the LIC has the same resolution
+        length: streamline length (world units) in each direction
+        step:   integration step in world units, half a pixel by default
+    Every pixel center is advected forward and backward by `length` and the
+    noise is box-filtered along the path.
+    @return: a float32 (res, res) array, row index = y, column index = x
+'''
+def compute_lic(field, bounds, noise, length, step=None):
+    res = noise.shape[0]
+    noise = np.asarray(noise, dtype=np.float32)
+    step, n_steps = _steps(bounds, res, length, step)
+    x, y = pixel_centers(bounds, res)
+    return _convolve(field, bounds, noise, x, y, step, n_steps)
+
+
+'''
+    Trace full streamlines through the seeds (x, y): n_steps steps backward
+    and n_steps steps forward.
+    @return: xs, ys of shape (len(x), K) ordered from the backward end to the
+             forward end, the column of the seed, and per line the first and
+             last valid columns (lo, hi)
+'''
+def _trace(field, bounds, x, y, step, n_steps):
+    backward = list(_advect(field, bounds, x, y, step, n_steps, -1.0))
+    forward = list(_advect(field, bounds, x, y, step, n_steps, 1.0))
+
+    xs = [p[0] for p in backward[::-1]] + [x] + [p[0] for p in forward]
+    ys = [p[1] for p in backward[::-1]] + [y] + [p[1] for p in forward]
+    center = len(backward)
+    # Streamlines only ever die, so the number of alive steps is the valid length
+    n_back = sum(p[2] for p in backward) if backward else np.zeros(x.shape, dtype=np.intp)
+    n_fwd = sum(p[2] for p in forward) if forward else np.zeros(x.shape, dtype=np.intp)
+    return np.stack(xs, axis=1), np.stack(ys, axis=1), center, center - n_back, center + n_fwd
+
+
+'''
+    FastLIC (Stalling and Hege): compute the LIC texture by tracing long
+    streamlines once and reusing each of them for every pixel it crosses.
+        field, bounds, noise, length, step: as in compute_lic
+        line_factor: streamlines are traced line_factor times longer than the
+                     convolution kernel in each direction
+        seed:        seed of the random order in which uncovered pixels
+                     start new streamlines
+    A running (box filter) sum along every streamline gives the convolution
+    at each of its points. The results are accumulated per pixel and new
+    streamlines are started from pixels that no streamline has hit yet,
+    until all the pixels are covered.
+    @return: a float32 (res, res) array, row index = y, column index = x
+'''
+def compute_fast_lic(field, bounds, noise, length, step=None, line_factor=4, seed=0):
+    res = noise.shape[0]
+    noise = np.asarray(noise, dtype=np.float32)
+    step, n_kernel = _steps(bounds, res, length, step)
+    rng = np.random.default_rng(seed)
+    return _fast_lic_rows(field, bounds, noise, 0, res, step, n_kernel, line_factor, rng)
+
+
+'''
+    FastLIC restricted to the rows [row0, row1) of the texture: streamlines
+    are seeded from the uncovered pixels of these rows and only the points
+    that fall inside them are written.
+    @return: a float32 (row1 - row0, res) array
+'''
+def _fast_lic_rows(field, bounds, noise, row0, row1, step, n_kernel, line_factor, rng):
+    res = noise.shape[0]
+    n_pixels = (row1 - row0) * res
+    n_line = n_kernel * line_factor
+    # Each streamline covers on the order of n_line pixels
+    batch_size = max(n_pixels // n_line, 64)
+
+    total = np.zeros(n_pixels, dtype=np.float64)
+    hits = np.zeros(n_pixels, dtype=np.float64)
+    cx, cy = pixel_centers(bounds, res, row0, row1)
+    cx = cx.ravel()
+    cy = cy.ravel()
+
+    while True:
+        uncovered = np.flatnonzero(hits == 0)
+        if uncovered.size == 0:
+            break
+        seeds = rng.permutation(uncovered)[:batch_size]
+        xs, ys, center, lo, hi = _trace(field, bounds, cx[seeds], cy[seeds], step, n_line)
+
+        row, col = _pixel_index(bounds, res, xs, ys)
+        values = noise[row, col]
+        csum = np.zeros((values.shape[0], values.shape[1] + 1), dtype=np.float64)
+        np.cumsum(values, axis=1, out=csum[:, 1:])
+
+        # Box filter of half width n_kernel, truncated at the streamline ends
+        k = np.arange(values.shape[1])[None, :]
+        lo = lo[:, None]
+        hi = hi[:, None]
+        valid = (k >= lo) & (k <= hi)
+        start = np.maximum(k - n_kernel, lo)
+        end = np.minimum(k + n_kernel, hi)
+        start = np.where(valid, start, 0)
+        end = np.where(valid, end, 0)
+        conv = (np.take_along_axis(csum, end + 1, axis=1) -
+                np.take_along_axis(csum, start, axis=1)) / (end - start + 1)
+
+        valid &= (row >= row0) & (row < row1)
+        pixels = ((row - row0) * res + col)[valid]
+        total += np.bincount(pixels, weights=conv[valid], minlength=n_pixels)
+        hits += np.bincount(pixels, minlength=n_pixels)
+
+    return (total / hits).reshape(row1 - row0, res).astype(np.float32)
+
+
+# Arrays shared with the LIC worker processes, attached once per worker
+_worker_arrays = {}
+
+
+'''
+    Copy an array into a new shared memory block.
+    @return: the block and a description (name, shape, dtype) that a worker
+             process can attach to
+'''
+def _to_shared(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+'''
+    Process pool initializer: attach the shared field, noise and output
+    arrays and remember the LIC parameters for the tasks of this worker.
+'''
+def _init_worker(specs, bounds, step, n_steps):
+    for key, (name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _worker_arrays[key] = (shm, np.ndarray(shape, np.dtype(dtype), buffer=shm.buf))
+    _worker_arrays["params"] = (bounds, step, n_steps)
+
+
+'''
+    Worker task: compute the LIC of the tile [row0, row1) x [col0, col1)
+    straight into the shared output texture.
+'''
+def _lic_tile(tile):
+    row0, row1, col0, col1 = tile
+    field = _worker_arrays["field"][1]
+    noise = _worker_arrays["noise"][1]
+    out = _worker_arrays["out"][1]
+    bounds, step, n_steps = _worker_arrays["params"]
+
+    x, y = pixel_centers(bounds, noise.shape[0], row0, row1, col0, col1)
+    out[row0:row1, col0:col1] = _convolve(field, bounds, noise, x, y, step, n_steps)
+    return tile
+
+
+'''
+    Split a res x res texture into square tiles of (at most) tile x tile pixels.
+'''
+def split_tiles(res, tile):
+    return [(r, min(r + tile, res), c, min(c + tile, res))
+            for r in range(0, res, tile) for c in range(0, res, tile)]
+
+
+'''
+    Compute the same texture as compute_lic, with the tiles spread over a
+    pool of `workers` processes. The field, the noise and the output live in
+    shared memory, so each task only sends its tile bounds.
+'''
+def compute_lic_parallel(field, bounds, noise, length, workers, step=None, tile=64):
+    res = noise.shape[0]
+    noise = np.asarray(noise, dtype=np.float32)
+    step, n_steps = _steps(bounds, res, length, step)
+    if workers <= 1:
+        x, y = pixel_centers(bounds, res)
+        return _convolve(field, bounds, noise, x, y, step, n_steps)
+
+    blocks = {}
+    try:
+        specs = {}
+        for key, array in (("field", np.ascontiguousarray(field, dtype=np.float32)),
+                           ("noise", noise),
+                           ("out", np.zeros((res, res), dtype=np.float32))):
+            blocks[key], specs[key] = _to_shared(array)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(specs, tuple(bounds), step, n_steps)) as pool:
+            for _ in pool.map(_lic_tile, split_tiles(res, tile)):
+                pass
+
+        _, shape, dtype = specs["out"]
+        return np.ndarray(shape, np.dtype(dtype), buffer=blocks["out"].buf).copy()
+    finally:
+        for shm in blocks.values():
+            shm.close()
+            shm.unlink()
+
+
+'''
+    Compute a LIC texture with the selected engine: FastLIC when fast is
+    True, otherwise the per-pixel engine spread over `workers` processes.
+'''
+def compute_texture(field, bounds, noise, length, fast=False, workers=1):
+    if fast:
+        return compute_fast_lic(field, bounds, noise, length)
+    return compute_lic_parallel(field, bounds, noise, length, workers)
+
+
+'''
+    Blend a LIC texture with the colours of an attribute.
+        texture:     (res, res) LIC texture in the 0..255 range
+        values:      (res, res) attribute values at the pixel centers
+        table:       (n, 3 or 4) uint8 colour table, e.g. of a vtkLookupTable
+        value_range: attribute values mapped to the first and last colour
+        weight:      share of the attribute colour in the result
+    Everything is one pass of array operations over the whole texture.
+    @return: a (res, res, 3) uint8 image
+'''
+def colorize(texture, values, table, value_range, weight=0.5):
+    lo, hi = value_range
+    scale = (len(table) - 1) / (hi - lo) if hi > lo else 0.0
+    index = np.clip((values - lo) * scale, 0, len(table) - 1).astype(np.intp)
+    colors = table[index, :3].astype(np.float32)
+    rgb = (1.0 - weight) * texture[:, :, None] + weight * colors
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+# Working memory of the LIC engines per pixel of a band, in bytes
+BAND_BYTES_PER_PIXEL = 512
+
+# Standard deviation, in grey levels, a banded texture is stretched to: the
+# kernel covers more pixels at higher resolutions, so the raw convolution
+# gets flatter and flatter
+BANDED_STD = 48.0
+
+# Number of pixels the statistics of a banded texture are estimated from
+BANDED_STATS_SAMPLES = 1 << 14
+
+
+'''
+    Mean and standard deviation of the LIC of a res x res texture, estimated
+    from the convolution at randomly chosen pixel centers.
+'''
+def _sample_stats(field, bounds, noise, step, n_steps, n_samples, rng):
+    res = noise.shape[0]
+    row, col = np.divmod(rng.integers(0, res * res, n_samples), res)
+    x = bounds[0] + (col + 0.5) / res * (bounds[1] - bounds[0])
+    y = bounds[2] + (row + 0.5) / res * (bounds[3] - bounds[2])
+    values = _convolve(field, bounds, noise, x, y, step, n_steps)
+    return float(values.mean()), float(values.std())
+
+
+'''
+    Memory-bounded LIC for very large textures (4096 x 4096 and beyond).
+        noise:         res x res noise, typically a noise.HashedNoise that
+                       computes its values on the fly and takes no memory
+        out_path:      .npy file receiving the uint8 texture
+        fast:          use FastLIC inside each band; streamlines soon leave
+                       a thin band, so short lines (line_factor 1) are the
+                       cheapest there
+        memory_budget: bytes of working memory for one band
+        progress:      optional callback taking the fraction done; it may
+                       return True to cancel
+    The texture is computed in bands of rows sized to the memory budget and
+    each finished band is written through its own short-lived memory map of
+    the output file, so the peak memory use does not depend on res. Before
+    quantizing, every band is stretched to the mean 127.5 and the standard
+    deviation BANDED_STD, with the statistics of the whole texture estimated
+    from a sample of pixels first.
+    @return: out_path, or None if cancelled
+'''
+def compute_lic_banded(field, bounds, noise, length, out_path, fast=False,
+                       memory_budget=64 * 1024 * 1024, step=None, line_factor=1, seed=0,
+                       progress=None):
+    res = noise.shape[0]
+    step, n_steps = _steps(bounds, res, length, step)
+    band_rows = int(max(1, min(res, memory_budget // (res * BAND_BYTES_PER_PIXEL))))
+    rng = np.random.default_rng(seed)
+
+    mean, std = _sample_stats(field, bounds, noise, step, n_steps,
+                              min(BANDED_STATS_SAMPLES, band_rows * res), np.random.default_rng(seed))
+    scale = BANDED_STD / std if std > 0 else 1.0
+
+    out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.uint8, shape=(res, res))
+    header = out.offset
+    del out
+
+    for row0 in range(0, res, band_rows):
+        row1 = min(row0 + band_rows, res)
+        if fast:
+            band = _fast_lic_rows(field, bounds, noise, row0, row1, step, n_steps, line_factor, rng)
+        else:
+            x, y = pixel_centers(bounds, res, row0, row1)
+            band = _convolve(field, bounds, noise, x, y, step, n_steps)
+
+        window = np.memmap(out_path, dtype=np.uint8, mode='r+',
+                           offset=header + row0 * res, shape=(row1 - row0, res))
+        window[...] = np.clip(np.rint(127.5 + (band - mean) * scale), 0, 255)
+        window.flush()
+        del window, band
+
+        if progress is not None and progress(row1 / res):
+            return None
+    return out_path
+
+
+'''
+    Read a (large) LIC texture file back at display_res x display_res by
+    averaging blocks of pixels, one band of rows at a time.
+    @return: a float32 (display_res, display_res) array
+'''
+def load_downsampled(path, display_res):
+    texture = np.load(path, mmap_mode='r')
+    res = texture.shape[0]
+    factor = max(res // display_res, 1)
+    display_res = res // factor
+    out = np.empty((display_res, display_res), dtype=np.float32)
+    for i in range(display_res):
+        rows = texture[i * factor:(i + 1) * factor, :display_res * factor]
+        out[i] = rows.reshape(factor, display_res, factor).mean(axis=(0, 2))
+    return out
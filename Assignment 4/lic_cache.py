@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache of LIC textures.
+
+A texture is stored as a compressed .npz file named after a hash of
+everything it depends on: the content of the vector field file, the texture
+resolution, the integration length, the noise and the convolution kernel.
+The total size of the cache is capped; when it is exceeded the least
+recently used textures are removed (a hit refreshes the file's timestamp).
+Very large textures are written by lic.compute_lic_banded as plain .npy
+files that can be memory mapped; they live in the same directory and count
+towards the same cap.
+
+@author: Raunak Sarbajna
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+
+# Bump when the LIC engines change their output, to invalidate old entries
+CACHE_VERSION = 3
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "cosc6344_lic")
+
+
+''' SHA-1 of the content of a file, read in chunks '''
+def file_hash(file_name):
+    sha = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class LICCache:
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    '''
+        Cache key of a LIC texture.
+            data_hash: file_hash of the vector field file
+            res:       texture resolution
+            max_len:   the "Maximum Integration Length" setting
+            noise:     (kind, seed, base resolution) of the noise pyramid,
+                       or ("hashed", seed) for the noise of banded textures
+            kernel:    name of the LIC engine / convolution kernel
+    '''
+    @staticmethod
+    def key(data_hash, res, max_len, noise, kernel):
+        text = repr((CACHE_VERSION, data_hash, int(res), max_len, tuple(noise), kernel))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    '''
+        Path of the .npy file of a large texture for key; the texture is
+        written there by the caller. touch marks an existing file as recently
+        used.
+    '''
+    def array_path(self, key, touch=False):
+        path = os.path.join(self.directory, key + ".npy")
+        if touch and os.path.exists(path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path
+
+    ''' The cached texture for key, or None '''
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                texture = data['texture']
+        except (OSError, KeyError, ValueError):
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return texture
+
+    ''' Store a texture under key, then evict old entries over the size cap '''
+    def put(self, key, texture):
+        # Write to a temporary file first so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, texture=texture)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    ''' Remove the least recently used entries until the cache fits max_bytes '''
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith((".npz", ".npy")):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Noise textures for LIC.
+
+Every generator fills a whole single-channel res x res uint8 texture with one
+vectorized call and is reproducible from its seed. NoisePyramid keeps
+pre-filtered mip levels of one noise texture so that LIC at different
+resolutions reuses the same (cached) noise.
+
+@author: Raunak Sarbajna
+"""
+
+import numpy as np
+
+
+NOISE_KINDS = ("white", "blue", "spot")
+
+# Resolution of the finest level of a NoisePyramid
+PYRAMID_BASE_RES = 1024
+
+
+'''
+    Map values to uint8 by rank, so the texture uses the full 0..255 range
+    with a flat histogram.
+'''
+def _equalize(values):
+    ranks = np.empty(values.size, dtype=np.int64)
+    ranks[np.argsort(values, axis=None, kind="stable")] = np.arange(values.size)
+    return (ranks * 256 // values.size).astype(np.uint8).reshape(values.shape)
+
+
+''' White noise: independent uniform values in 0..255 '''
+def white_noise(res, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, size=(res, res), dtype=np.uint8)
+
+
+'''
+    Blue noise: white noise with its low frequencies removed in the Fourier
+    domain, so neighbouring pixels are anti-correlated and no clumps appear.
+'''
+def blue_noise(res, seed=0):
+    rng = np.random.default_rng(seed)
+    spectrum = np.fft.rfft2(rng.standard_normal((res, res)))
+    fy = np.fft.fftfreq(res)[:, None]
+    fx = np.fft.rfftfreq(res)[None, :]
+    radius = np.sqrt(fx * fx + fy * fy) / 0.5
+    # Smooth high-pass, flat above half of the Nyquist frequency
+    spectrum *= np.clip(radius / 0.5, 0, 1) ** 2
+    return _equalize(np.fft.irfft2(spectrum, s=(res, res)))
+
+
+'''
+    Sparse spot noise: discs of random intensity scattered over the texture.
+        density: expected fraction of the texture covered by spots
+        radius:  spot radius in pixels
+'''
+def spot_noise(res, seed=0, density=0.5, radius=2.0):
+    rng = np.random.default_rng(seed)
+    n_spots = max(int(density * res * res / (np.pi * radius * radius)), 1)
+    impulses = np.zeros((res, res))
+    np.add.at(impulses, (rng.integers(0, res, n_spots), rng.integers(0, res, n_spots)),
+              rng.uniform(-1, 1, n_spots))
+
+    # Splat a disc at every impulse with one (periodic) FFT convolution
+    d = np.minimum(np.arange(res), res - np.arange(res))
+    disc = (d[:, None] ** 2 + d[None, :] ** 2 <= radius * radius).astype(float)
+    spots = np.fft.irfft2(np.fft.rfft2(impulses) * np.fft.rfft2(disc), s=(res, res))
+
+    scale = max(np.abs(spots).max(), 1e-12)
+    return np.clip(np.rint(127.5 + 127.5 * spots / scale), 0, 255).astype(np.uint8)
+
+
+''' Generate a res x res noise texture of the given kind ("white", "blue" or "spot") '''
+def make_noise(kind, res, seed=0):
+    if kind == "white":
+        return white_noise(res, seed)
+    if kind == "blue":
+        return blue_noise(res, seed)
+    if kind == "spot":
+        return spot_noise(res, seed)
+    raise ValueError("unknown noise kind: %s" % kind)
+
+
+'''
+    White noise whose values are computed on the fly from a hash of the
+    pixel index, so a texture of any resolution takes no memory. Indexing
+    noise[row, col] with index arrays returns float32 values in 0..255;
+    used by the memory-bounded LIC of very large textures.
+'''
+class HashedNoise:
+
+    def __init__(self, res, seed=0):
+        self.shape = (res, res)
+        self.seed = seed
+
+    def __getitem__(self, index):
+        row, col = index
+        h = (np.asarray(row).astype(np.uint32) * np.uint32(0x9E3779B1)) ^ \
+            (np.asarray(col).astype(np.uint32) * np.uint32(0x85EBCA77)) ^ \
+            np.uint32((self.seed * 0x27D4EB2F) & 0xFFFFFFFF)
+        # murmur3 finalizer
+        h ^= h >> np.uint32(16)
+        h *= np.uint32(0x85EBCA6B)
+        h ^= h >> np.uint32(13)
+        h *= np.uint32(0xC2B2AE35)
+        h ^= h >> np.uint32(16)
+        return (h >> np.uint32(24)).astype(np.float32)
+
+
+'''
+    Pre-filtered mip levels of one noise texture.
+    The finest level is generated at base_res, whatever is asked for first;
+    every coarser level averages 2x2 blocks of the previous one and is
+    rescaled to the mean and contrast of the finest level, so that low
+    resolution LIC does not turn grey. Resolutions that are not a power of
+    two fraction of base_res are generated on their own. Either way the
+    noise at a resolution only depends on (kind, seed, base_res). Levels
+    are float32 in the 0..255 range.
+'''
+class NoisePyramid:
+
+    def __init__(self, kind="white", seed=0, base_res=PYRAMID_BASE_RES):
+        self.kind = kind
+        self.seed = seed
+        self.base_res = base_res
+        self.levels = {}
+
+    ''' Build the pyramid down from the finest level of base_res x base_res '''
+    def _build(self):
+        level = make_noise(self.kind, self.base_res, self.seed).astype(np.float32)
+        mean, std = level.mean(), level.std()
+        self.levels[self.base_res] = level
+        res = self.base_res
+        while res > 1 and res % 2 == 0:
+            res //= 2
+            level = level.reshape(res, 2, res, 2).mean(axis=(1, 3))
+            level_std = level.std()
+            if level_std > 0:
+                level = np.clip((level - level.mean()) * (std / level_std) + mean, 0, 255)
+            self.levels[res] = level.astype(np.float32)
+
+    ''' True if res is base_res divided by a power of two '''
+    def in_pyramid(self, res):
+        if res < 1 or self.base_res % res != 0:
+            return False
+        ratio = self.base_res // res
+        return ratio & (ratio - 1) == 0
+
+    ''' The noise texture at resolution res '''
+    def level(self, res):
+        if res not in self.levels:
+            if self.in_pyramid(res):
+                self._build()
+            else:
+                self.levels[res] = make_noise(self.kind, res, self.seed).astype(np.float32)
+        return self.levels[res]
@@ -0,0 +1,584 @@
+# -*- coding: utf-8 -*-
+"""
+Lockstep streamline integration over the regular velocity grid.
+
+vtkStreamTracer integrates one seed after another. Here every seed (forward
+and backward) is one particle of a batch and all the particles that are
+still alive advance together as NumPy arrays: each iteration takes one
+adaptive Runge-Kutta 4(5) step per particle, with its own step size and
+error control, and particles are masked out as they terminate. The result
+is a vtkPolyData of polylines, as the output of vtkStreamTracer. Every
+iteration costs about the same for a few particles as for thousands, so
+small sets of seeds are still handed to vtkStreamTracer.
+
+@author: Raunak Sarbajna
+"""
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+
+
+# Cash-Karp coefficients of the embedded Runge-Kutta 4(5) pair, the scheme
+# of vtkRungeKutta45
+_STAGES = ((),
+           (1 / 5,),
+           (3 / 40, 9 / 40),
+           (3 / 10, -9 / 10, 6 / 5),
+           (-11 / 54, 5 / 2, -70 / 27, 35 / 27),
+           (1631 / 55296, 175 / 512, 575 / 13824, 44275 / 110592, 253 / 4096))
+_WEIGHTS_5 = (37 / 378, 0, 250 / 621, 125 / 594, 0, 512 / 1771)
+_WEIGHTS_4 = (2825 / 27648, 0, 18575 / 48384, 13525 / 55296, 277 / 14336, 1 / 4)
+
+_DIRECTIONS = {"forward": (1.0,), "backward": (-1.0,), "both": (-1.0, 1.0)}
+
+# Below this number of seeds the seeds are traced by vtkStreamTracer: each
+# lockstep iteration costs about the same for a few particles as for
+# thousands, and the iterations run until the longest line is done
+LOCKSTEP_MIN_SEEDS = 1000
+
+# Number of seeds vtkStreamTracer traces between two progress reports
+VTK_CHUNK_SEEDS = 50
+
+
+'''
+    Bilinear lookup of the unit direction of a (ny, nx, 2) velocity grid at
+    arrays of positions, for the lockstep integrator. The (u, v) of the four
+    corners of every cell are gathered into one table when the tracing
+    starts, so a lookup takes a single gather instead of one per corner and
+    component.
+'''
+class _GridDirection:
+
+    def __init__(self, field, bounds, terminal_speed):
+        ny, nx = field.shape[:2]
+        f = field[:, :, :2].astype(np.float64)
+        # Cell (i, j) holds the corners (i, j), (i + 1, j), (i, j + 1), (i + 1, j + 1)
+        self.corners = np.concatenate((f[:-1, :-1], f[:-1, 1:], f[1:, :-1], f[1:, 1:]),
+                                      axis=2).reshape(-1, 8)
+        self.nx = nx
+        self.ny = ny
+        self.x0 = bounds[0]
+        self.y0 = bounds[2]
+        self.sx = (nx - 1) / (bounds[1] - bounds[0])
+        self.sy = (ny - 1) / (bounds[3] - bounds[2])
+        self.terminal_speed = terminal_speed
+
+    '''
+        Unit direction at (x, y) and a mask of the positions where the speed
+        is above terminal_speed. Positions are clamped to the grid.
+    '''
+    def __call__(self, x, y):
+        fx = np.clip((x - self.x0) * self.sx, 0, self.nx - 1)
+        fy = np.clip((y - self.y0) * self.sy, 0, self.ny - 1)
+        i = np.minimum(fx.astype(np.intp), self.nx - 2)
+        j = np.minimum(fy.astype(np.intp), self.ny - 2)
+        tx = fx - i
+        ty = fy - j
+        c = self.corners[j * (self.nx - 1) + i]
+        # Along x on the rows j and j + 1, then along y
+        u0 = c[:, 0] + tx * (c[:, 2] - c[:, 0])
+        v0 = c[:, 1] + tx * (c[:, 3] - c[:, 1])
+        u = u0 + ty * (c[:, 4] + tx * (c[:, 6] - c[:, 4]) - u0)
+        v = v0 + ty * (c[:, 5] + tx * (c[:, 7] - c[:, 5]) - v0)
+
+        mag = np.hypot(u, v)
+        ok = mag > self.terminal_speed
+        inv = 1.0 / np.where(ok, mag, np.inf)
+        return u * inv, v * inv, ok
+
+
+'''
+    One Cash-Karp step of length h (signed by sign) for every particle.
+    @return: the 5th order positions, the error estimate and a mask of the
+             particles whose start position is above the terminal speed
+'''
+def _rk45_step(direction, x, y, h, sign):
+    sh = sign * h
+    kx = []
+    ky = []
+    for coeffs in _STAGES:
+        sx = x
+        sy = y
+        for c, ku, kv in zip(coeffs, kx, ky):
+            sx = sx + c * ku
+            sy = sy + c * kv
+        u, v, ok = direction(sx, sy)
+        if not kx:
+            alive = ok
+        kx.append(sh * u)
+        ky.append(sh * v)
+
+    dx5 = sum(w * k for w, k in zip(_WEIGHTS_5, kx) if w != 0)
+    dy5 = sum(w * k for w, k in zip(_WEIGHTS_5, ky) if w != 0)
+    dx4 = sum(w * k for w, k in zip(_WEIGHTS_4, kx) if w != 0)
+    dy4 = sum(w * k for w, k in zip(_WEIGHTS_4, ky) if w != 0)
+    error = np.hypot(dx5 - dx4, dy5 - dy4)
+    return x + dx5, y + dy5, error, alive
+
+
+'''
+    Trace the streamlines through the seeds (seed_x, seed_y) of a
+    (ny, nx, 2) velocity grid, all the seeds in lockstep.
+    The parameters follow vtkStreamTracer, with the step sizes and the error
+    in units of the grid cell diagonal:
+        max_length:     maximum propagation in each direction, in world units
+        initial_step, min_step, max_step: adaptive step size limits
+        max_steps:      maximum number of steps in each direction
+        max_error:      error allowed per step
+        terminal_speed: particles stop where the speed drops below it
+        direction:      "forward", "backward" or "both"
+        progress:       optional callback, called every report_steps steps
+                        with the fraction of seeds done and the (points,
+                        offsets) of the lines finished since the last call;
+                        it may return True to stop the tracing
+    Particles also stop when they leave the grid bounds. Fewer than
+    LOCKSTEP_MIN_SEEDS seeds are traced by vtkStreamTracer instead, see
+    _trace_vtk.
+    @return: (points, offsets), the (m, 2) float64 points of all the lines
+             one after the other and the start of every line in points,
+             with a final entry of m; the backward part of a line comes
+             first, so each line runs along the flow. Lines with fewer
+             than two points are left out. None if stopped.
+'''
+def trace_streamlines(field, bounds, seed_x, seed_y, max_length=1.0, initial_step=0.5,
+                      min_step=0.01, max_step=1.0, max_steps=2000, max_error=1e-6,
+                      terminal_speed=1e-12, direction="both", progress=None, report_steps=50):
+    seed_x = np.asarray(seed_x, dtype=np.float64).ravel()
+    seed_y = np.asarray(seed_y, dtype=np.float64).ravel()
+    n_seeds = seed_x.size
+    signs = _DIRECTIONS[direction]
+    if n_seeds < LOCKSTEP_MIN_SEEDS:
+        return _trace_vtk(field, bounds, seed_x, seed_y, max_length, initial_step, min_step,
+                          max_step, max_steps, max_error, terminal_speed, direction, progress)
+
+    direction = _GridDirection(field, bounds, terminal_speed)
+    ny, nx = field.shape[:2]
+    cell = np.hypot((bounds[1] - bounds[0]) / (nx - 1), (bounds[3] - bounds[2]) / (ny - 1))
+    min_h, max_h = min_step * cell, max_step * cell
+
+    # Particle k follows seed k % n_seeds in the direction signs[k // n_seeds]
+    x = np.tile(seed_x, len(signs))
+    y = np.tile(seed_y, len(signs))
+    sign = np.repeat(signs, n_seeds)
+    h = np.full(x.size, min(max(initial_step * cell, min_h), max_h, max_length))
+    length = np.zeros(x.size)
+    steps = np.zeros(x.size, dtype=np.intp)
+
+    inside = (x >= bounds[0]) & (x <= bounds[1]) & (y >= bounds[2]) & (y <= bounds[3])
+    active = np.flatnonzero(inside & (max_length > 0) & (max_steps > 0))
+
+    log_id, log_x, log_y = [], [], []
+    reported = np.zeros(n_seeds, dtype=bool)
+    iteration = 0
+    while active.size > 0:
+        iteration += 1
+        if progress is not None and iteration % report_steps == 0:
+            log_id, log_x, log_y = [np.concatenate(log_id)], [np.concatenate(log_x)], [np.concatenate(log_y)]
+            done = np.ones(n_seeds, dtype=bool)
+            done[active % n_seeds] = False
+            lines = _finished(seed_x, seed_y, signs, log_id[0], log_x[0], log_y[0], done & ~reported)
+            reported |= done
+            if progress(np.count_nonzero(reported) / float(n_seeds), lines):
+                return None
+
+        ax, ay, ah = x[active], y[active], h[active]
+        nx5, ny5, error, alive = _rk45_step(direction, ax, ay, ah, sign[active])
+
+        # Per-particle step control
+        error = error / (max_error * cell)
+        accept = alive & ((error <= 1.0) | (ah <= min_h * (1 + 1e-9)))
+        with np.errstate(divide='ignore'):
+            factor = np.clip(0.9 * error ** -0.2, 0.1, 5.0)
+        new_h = np.clip(ah * factor, min_h, max_h)
+
+        inside = ((nx5 >= bounds[0]) & (nx5 <= bounds[1]) &
+                  (ny5 >= bounds[2]) & (ny5 <= bounds[3]))
+        moved = accept & inside
+        ids = active[moved]
+        x[ids] = nx5[moved]
+        y[ids] = ny5[moved]
+        length[ids] += ah[moved]
+        steps[ids] += 1
+        log_id.append(ids)
+        log_x.append(nx5[moved])
+        log_y.append(ny5[moved])
+
+        # The last step of a particle ends exactly at max_length
+        h[active] = new_h
+        h[ids] = np.minimum(h[ids], max_length - length[ids])
+
+        stopped = ~alive | (accept & ~inside)
+        stopped[moved] |= (steps[ids] >= max_steps) | (h[ids] <= 1e-12 * cell)
+        active = active[~stopped]
+
+    return _assemble(seed_x, seed_y, signs, log_id, log_x, log_y)
+
+
+'''
+    trace_streamlines with vtkStreamTracer over a vtkImageData of the grid,
+    VTK_CHUNK_SEEDS seeds at a time, with progress reported after every
+    chunk. The image belongs to the call, so it can run in any thread.
+'''
+def _trace_vtk(field, bounds, seed_x, seed_y, max_length, initial_step, min_step, max_step,
+               max_steps, max_error, terminal_speed, direction, progress):
+    ny, nx = field.shape[:2]
+    image = vtk.vtkImageData()
+    image.SetDimensions(nx, ny, 1)
+    image.SetOrigin(bounds[0], bounds[2], 0.0)
+    image.SetSpacing((bounds[1] - bounds[0]) / (nx - 1), (bounds[3] - bounds[2]) / (ny - 1), 1.0)
+    vectors = np.zeros((nx * ny, 3))
+    vectors[:, :2] = field[:, :, :2].reshape(-1, 2)
+    vtk_vectors = numpy_support.numpy_to_vtk(vectors, deep=True)
+    vtk_vectors.SetName("velocity")
+    image.GetPointData().SetVectors(vtk_vectors)
+
+    tracer = vtk.vtkStreamTracer()
+    tracer.SetInputData(image)
+    tracer.SetIntegratorTypeToRungeKutta45()
+    tracer.SetIntegrationStepUnit(vtk.vtkStreamTracer.CELL_LENGTH_UNIT)
+    tracer.SetMaximumPropagation(max_length)
+    tracer.SetInitialIntegrationStep(initial_step)
+    tracer.SetMinimumIntegrationStep(min_step)
+    tracer.SetMaximumIntegrationStep(max_step)
+    tracer.SetMaximumNumberOfSteps(max_steps)
+    tracer.SetMaximumError(max_error)
+    tracer.SetTerminalSpeed(terminal_speed)
+    tracer.SetComputeVorticity(False)
+    if direction == "forward":
+        tracer.SetIntegrationDirectionToForward()
+    elif direction == "backward":
+        tracer.SetIntegrationDirectionToBackward()
+    else:
+        tracer.SetIntegrationDirectionToBoth()
+
+    n_seeds = seed_x.size
+    chunks = []
+    for start in range(0, n_seeds, VTK_CHUNK_SEEDS):
+        stop = min(start + VTK_CHUNK_SEEDS, n_seeds)
+        xyz = np.zeros((stop - start, 3))
+        xyz[:, 0] = seed_x[start:stop]
+        xyz[:, 1] = seed_y[start:stop]
+        seed_points = vtk.vtkPoints()
+        seed_points.SetData(numpy_support.numpy_to_vtk(xyz, deep=True))
+        seeds = vtk.vtkPolyData()
+        seeds.SetPoints(seed_points)
+        tracer.SetSourceData(seeds)
+        tracer.Update()
+
+        chunks.append(_join_directions(tracer.GetOutput()))
+        if progress is not None and progress(stop / float(n_seeds), chunks[-1]):
+            return None
+
+    points = np.concatenate([chunk[0] for chunk in chunks]) if chunks else np.zeros((0, 2))
+    starts = np.cumsum([0] + [chunk[0].shape[0] for chunk in chunks[:-1]])
+    offsets = np.concatenate([chunk[1][:-1] + start for chunk, start in zip(chunks, starts)] +
+                             [[points.shape[0]]]).astype(np.intp)
+    return points, offsets
+
+
+'''
+    Join the lines of a vtkStreamTracer output into one line per seed, as
+    trace_streamlines returns them: the backward line (negative integration
+    time) reversed, then the forward line without its seed.
+'''
+def _join_directions(traced):
+    if traced.GetNumberOfLines() == 0:
+        return np.zeros((0, 2)), np.zeros(1, dtype=np.intp)
+    xy = numpy_support.vtk_to_numpy(traced.GetPoints().GetData())[:, :2].astype(np.float64)
+    time = numpy_support.vtk_to_numpy(traced.GetPointData().GetArray("IntegrationTime"))
+    seed_ids = numpy_support.vtk_to_numpy(traced.GetCellData().GetArray("SeedIds"))
+    offsets = numpy_support.vtk_to_numpy(traced.GetLines().GetOffsetsArray())
+    connectivity = numpy_support.vtk_to_numpy(traced.GetLines().GetConnectivityArray())
+
+    lines = {}
+    for k in range(seed_ids.size):
+        ids = connectivity[offsets[k]:offsets[k + 1]]
+        backward = time[ids[-1]] < 0
+        line = lines.setdefault(seed_ids[k], [None, None])
+        line[0 if backward else 1] = ids
+    order = []
+    for seed in sorted(lines):
+        backward, forward = lines[seed]
+        if backward is None:
+            ids = forward
+        elif forward is None:
+            ids = backward[::-1]
+        else:
+            ids = np.concatenate((backward[::-1], forward[1:]))
+        if ids.size >= 2:
+            order.append(ids)
+    if not order:
+        return np.zeros((0, 2)), np.zeros(1, dtype=np.intp)
+    sizes = [ids.size for ids in order]
+    return xy[np.concatenate(order)], np.concatenate(([0], np.cumsum(sizes))).astype(np.intp)
+
+
+''' The lines of the seeds in the boolean mask finished, as _assemble '''
+def _finished(seed_x, seed_y, signs, ids, px, py, finished):
+    n_seeds = seed_x.size
+    seeds = np.flatnonzero(finished)
+    renumber = np.full(n_seeds, -1, dtype=np.intp)
+    renumber[seeds] = np.arange(seeds.size)
+    keep = finished[ids % n_seeds]
+    ids = ids[keep]
+    ids = (ids // n_seeds) * seeds.size + renumber[ids % n_seeds]
+    return _assemble(seed_x[seeds], seed_y[seeds], signs, [ids], [px[keep]], [py[keep]])
+
+
+'''
+    Order the logged particle positions into one polyline per seed: the
+    backward points reversed, the seed, then the forward points.
+'''
+def _assemble(seed_x, seed_y, signs, log_id, log_x, log_y):
+    n_seeds = seed_x.size
+    ids = np.concatenate(log_id) if log_id else np.zeros(0, dtype=np.intp)
+    px = np.concatenate(log_x) if log_x else np.zeros(0)
+    py = np.concatenate(log_y) if log_y else np.zeros(0)
+
+    # A stable sort keeps the points of every particle in step order
+    order = np.argsort(ids, kind='stable')
+    ids, px, py = ids[order], px[order], py[order]
+    counts = np.bincount(ids, minlength=n_seeds * len(signs)).reshape(len(signs), n_seeds)
+    rank = np.arange(ids.size) - np.repeat(np.cumsum(counts.ravel()) - counts.ravel(), counts.ravel())
+
+    n_back = counts[0] if signs[0] < 0 else np.zeros(n_seeds, dtype=np.intp)
+    n_fwd = counts[-1] if signs[-1] > 0 else np.zeros(n_seeds, dtype=np.intp)
+    sizes = n_back + 1 + n_fwd
+    keep = sizes >= 2
+    starts = np.cumsum(np.where(keep, sizes, 0)) - np.where(keep, sizes, 0)
+
+    points = np.empty((int(np.where(keep, sizes, 0).sum()), 2))
+    seed = np.flatnonzero(keep)
+    points[starts[seed] + n_back[seed]] = np.column_stack((seed_x[seed], seed_y[seed]))
+
+    particle_seed = ids % n_seeds
+    kept = keep[particle_seed]
+    backward = (np.take(signs, ids // n_seeds) < 0) & kept
+    forward = ~backward & kept
+    s = particle_seed[backward]
+    points[starts[s] + n_back[s] - 1 - rank[backward]] = np.column_stack((px[backward], py[backward]))
+    s = particle_seed[forward]
+    points[starts[s] + n_back[s] + 1 + rank[forward]] = np.column_stack((px[forward], py[forward]))
+
+    offsets = np.append(starts[seed], points.shape[0])
+    return points, offsets
+
+
+'''
+    Build the vtkPolyData of polylines from the (points, offsets) of
+    trace_streamlines, in the plane z.
+'''
+def to_polydata(points, offsets, z=0.0):
+    xyz = np.empty((points.shape[0], 3), dtype=np.float32)
+    xyz[:, :2] = points
+    xyz[:, 2] = z
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(xyz, deep=True))
+
+    # Legacy cell array layout: (n, id_0, ..., id_n-1) for every line
+    n_lines = offsets.size - 1
+    sizes = np.diff(offsets)
+    cells = np.empty(points.shape[0] + n_lines, dtype=np.int64)
+    heads = offsets[:-1] + np.arange(n_lines)
+    cells[heads] = sizes
+    body = np.ones(cells.size, dtype=bool)
+    body[heads] = False
+    cells[body] = np.arange(points.shape[0])
+
+    lines = vtk.vtkCellArray()
+    lines.SetCells(n_lines, numpy_support.numpy_to_vtkIdTypeArray(cells, deep=True))
+
+    polydata = vtk.vtkPolyData()
+    polydata.SetPoints(vtk_points)
+    polydata.SetLines(lines)
+    return polydata
+
+
+'''
+    Uniform spatial hash grid of 2D points for the distance tests of the
+    evenly-spaced streamlines. Points are bucketed by square cells of
+    cell_size, so a query within a radius of at most cell_size only looks
+    at the 3 x 3 cells around it.
+'''
+class SpatialHashGrid:
+
+    def __init__(self, bounds, cell_size):
+        self.x0 = bounds[0]
+        self.y0 = bounds[2]
+        self.cell_size = cell_size
+        self.nx = int((bounds[1] - bounds[0]) / cell_size) + 1
+        self.cells = {}
+
+    def _cell(self, x, y):
+        return int((x - self.x0) / self.cell_size), int((y - self.y0) / self.cell_size)
+
+    def insert(self, x, y):
+        i, j = self._cell(x, y)
+        self.cells.setdefault(i + j * self.nx, []).append((x, y))
+
+    ''' Fraction of the cells of bounds that hold at least one point '''
+    def coverage(self, bounds):
+        ny = int((bounds[3] - bounds[2]) / self.cell_size) + 1
+        return len(self.cells) / float(self.nx * ny)
+
+    ''' True if any point of the grid lies closer than radius to (x, y) '''
+    def near(self, x, y, radius):
+        i, j = self._cell(x, y)
+        r2 = radius * radius
+        for cj in (j - 1, j, j + 1):
+            for ci in (i - 1, i, i + 1):
+                if ci < 0 or ci >= self.nx:
+                    continue
+                for px, py in self.cells.get(ci + cj * self.nx, ()):
+                    if (px - x) * (px - x) + (py - y) * (py - y) < r2:
+                        return True
+        return False
+
+
+'''
+    Bilinear lookup of the unit direction of a velocity grid at one point,
+    in plain Python: the evenly-spaced placement traces one point at a time,
+    where the overhead of NumPy calls would dominate.
+'''
+class _PointLookup:
+
+    def __init__(self, field, bounds, terminal_speed):
+        self.ny, self.nx = field.shape[:2]
+        self.u = field[:, :, 0].astype(np.float64).tolist()
+        self.v = field[:, :, 1].astype(np.float64).tolist()
+        self.bounds = bounds
+        self.sx = (self.nx - 1) / (bounds[1] - bounds[0])
+        self.sy = (self.ny - 1) / (bounds[3] - bounds[2])
+        self.terminal_speed = terminal_speed
+
+    def inside(self, x, y):
+        b = self.bounds
+        return b[0] <= x <= b[1] and b[2] <= y <= b[3]
+
+    ''' The unit direction at (x, y), or None where the field vanishes '''
+    def direction(self, x, y):
+        fx = min(max((x - self.bounds[0]) * self.sx, 0.0), self.nx - 1)
+        fy = min(max((y - self.bounds[2]) * self.sy, 0.0), self.ny - 1)
+        i = min(int(fx), self.nx - 2)
+        j = min(int(fy), self.ny - 2)
+        tx = fx - i
+        ty = fy - j
+        r0, r1 = self.u[j], self.u[j + 1]
+        u = (r0[i] * (1 - tx) + r0[i + 1] * tx) * (1 - ty) + (r1[i] * (1 - tx) + r1[i + 1] * tx) * ty
+        r0, r1 = self.v[j], self.v[j + 1]
+        v = (r0[i] * (1 - tx) + r0[i + 1] * tx) * (1 - ty) + (r1[i] * (1 - tx) + r1[i + 1] * tx) * ty
+        mag = (u * u + v * v) ** 0.5
+        if mag <= self.terminal_speed:
+            return None
+        return u / mag, v / mag
+
+
+'''
+    Trace one evenly-spaced streamline from (x, y) in the direction sign,
+    with fixed midpoint (RK2) steps, until it leaves the domain, reaches a
+    critical point, comes closer than d_test to a line of the grid or
+    closes on its own seed.
+    @return: the list of points after the seed
+'''
+def _trace_separated(lookup, grid, x, y, sign, step, d_test, max_steps):
+    points = []
+    sx, sy = x, y
+    travelled = 0.0
+    for _ in range(max_steps):
+        d = lookup.direction(x, y)
+        if d is None:
+            break
+        mx = x + 0.5 * step * sign * d[0]
+        my = y + 0.5 * step * sign * d[1]
+        d = lookup.direction(mx, my)
+        if d is None:
+            break
+        x += step * sign * d[0]
+        y += step * sign * d[1]
+        travelled += step
+        if not lookup.inside(x, y) or grid.near(x, y, d_test):
+            break
+        # Closed orbit: back at the seed
+        if travelled > 2 * d_test and (x - sx) * (x - sx) + (y - sy) * (y - sy) < d_test * d_test:
+            break
+        points.append((x, y))
+    return points
+
+
+'''
+    Evenly-spaced streamlines (Jobard and Lefer 1997).
+        separation: distance between neighbouring lines, in world units
+        test_ratio: lines stop when they come closer than
+                    test_ratio * separation to an existing line
+        step_ratio: integration step, as a fraction of separation
+    Starting from a seed at the center of the domain, new seeds are taken at
+    the distance separation on both sides of every point of the accepted
+    lines, and a seed is only traced where no line is closer than
+    separation. All the distance tests go through a SpatialHashGrid.
+        progress:   optional callback, called after every line with the
+                    fraction of the domain covered so far and the new line
+                    as (points, offsets); it may return True to stop the
+                    placement
+    @return: (points, offsets) as trace_streamlines, or None if stopped
+'''
+def evenly_spaced_streamlines(field, bounds, separation, test_ratio=0.5, step_ratio=0.25,
+                              max_steps=2000, terminal_speed=1e-12, min_points=3,
+                              progress=None):
+    lookup = _PointLookup(field, bounds, terminal_speed)
+    grid = SpatialHashGrid(bounds, separation)
+    d_test = test_ratio * separation
+    step = step_ratio * separation
+
+    # Start from the point closest to the center where the field is defined
+    n = 16
+    cx = 0.5 * (bounds[0] + bounds[1])
+    cy = 0.5 * (bounds[2] + bounds[3])
+    tx = np.linspace(bounds[0], bounds[1], n)
+    ty = np.linspace(bounds[2], bounds[3], n)
+    candidates = sorted(((x - cx) ** 2 + (y - cy) ** 2, x, y) for x in tx for y in ty)
+
+    lines = []
+    queue = []
+    for _, x, y in candidates:
+        if lookup.direction(x, y) is not None:
+            queue.append([(x, y)])
+            break
+
+    while queue:
+        seeds = queue.pop(0)
+        for x, y in seeds:
+            if not lookup.inside(x, y) or grid.near(x, y, separation) or lookup.direction(x, y) is None:
+                continue
+            backward = _trace_separated(lookup, grid, x, y, -1.0, step, d_test, max_steps)
+            forward = _trace_separated(lookup, grid, x, y, 1.0, step, d_test, max_steps)
+            line = backward[::-1] + [(x, y)] + forward
+            if len(line) < min_points:
+                continue
+            for px, py in line:
+                grid.insert(px, py)
+            lines.append(line)
+            if progress is not None and progress(grid.coverage(bounds),
+                                                 (np.array(line), np.array([0, len(line)]))):
+                return None
+
+            # Candidate seeds at the distance separation on both sides
+            candidates = []
+            for k in range(len(line)):
+                px, py = line[k]
+                qx, qy = line[min(k + 1, len(line) - 1)]
+                ox, oy = line[max(k - 1, 0)]
+                dx, dy = qx - ox, qy - oy
+                norm = (dx * dx + dy * dy) ** 0.5
+                if norm == 0:
+                    continue
+                nx, ny = -dy / norm * separation, dx / norm * separation
+                candidates.append((px + nx, py + ny))
+                candidates.append((px - nx, py - ny))
+            queue.append(candidates)
+
+    sizes = [len(line) for line in lines]
+    points = np.array([p for line in lines for p in line], dtype=np.float64).reshape(-1, 2)
+    offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.intp)
+    return points, offsets
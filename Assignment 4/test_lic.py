@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+The LIC engines of lic.py on the dipole field, against the per-pixel
+vtkStreamTracer LIC they replace.
+
+@author: Raunak Sarbajna
+"""
+
+import os
+
+import numpy as np
+import pytest
+import vtk
+from vtk.util import numpy_support
+
+import lic
+from noise import HashedNoise, white_noise
+from velocity_grid import VelocityGrid
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data")
+
+
+''' Read Data/dipole.vtk '''
+def read_dipole():
+    reader = vtk.vtkDataSetReader()
+    reader.SetFileName(os.path.join(DATA_DIR, "dipole.vtk"))
+    reader.Update()
+    return reader
+
+
+''' The velocity grid of Data/dipole.vtk and its integration length '''
+def dipole():
+    grid = VelocityGrid.from_dataset(read_dipole().GetOutput())
+    bounds = grid.bounds
+    return grid, (bounds[1] - bounds[0]) / 40
+
+
+'''
+    The LIC of the window before the NumPy engine: one vtkStreamTracer over
+    the dataset per pixel center, and the noise averaged over the points of
+    its streamline. Pixels are looked up with floor(x * res), as in lic.py.
+'''
+def stream_tracer_lic(dataset, noise, length):
+    res = noise.shape[0]
+    bounds = dataset.GetBounds()
+    texture = np.zeros((res, res))
+    for i in range(res):
+        for j in range(res):
+            tracer = vtk.vtkStreamTracer()
+            tracer.SetInputData(dataset)
+            tracer.SetStartPosition(bounds[0] + (j + 0.5) / res * (bounds[1] - bounds[0]),
+                                    bounds[2] + (i + 0.5) / res * (bounds[3] - bounds[2]), bounds[4])
+            tracer.SetMaximumPropagation(length)
+            tracer.SetInitialIntegrationStep((bounds[1] - bounds[0]) / (res - 1))
+            tracer.SetIntegrationDirectionToBoth()
+            tracer.Update()
+            points = tracer.GetOutput().GetPoints()
+            if points is None or points.GetNumberOfPoints() == 0:
+                continue
+            xy = numpy_support.vtk_to_numpy(points.GetData())
+            col = ((xy[:, 0] - bounds[0]) / (bounds[1] - bounds[0]) * res).astype(np.intp)
+            row = ((xy[:, 1] - bounds[2]) / (bounds[3] - bounds[2]) * res).astype(np.intp)
+            texture[i, j] = noise[np.clip(row, 0, res - 1), np.clip(col, 0, res - 1)].mean()
+    return texture
+
+
+def test_lic_matches_stream_tracer_lic():
+    reader = read_dipole()
+    grid, length = dipole()
+    noise = white_noise(32, seed=1).astype(np.float32)
+    texture = lic.compute_lic(grid.field, grid.bounds, noise, length)
+    reference = stream_tracer_lic(reader.GetPolyDataOutput(), noise, length)
+    assert np.corrcoef(texture.ravel(), reference.ravel())[0, 1] > 0.9
+    assert np.abs(texture - reference).mean() < 12
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_banded_texture_is_stretched(tmp_path, fast):
+    grid, length = dipole()
+    res = 256
+    noise = HashedNoise(res, seed=3)
+    out_path = str(tmp_path / "lic.npy")
+    assert lic.compute_lic_banded(grid.field, grid.bounds, noise, length, out_path, fast,
+                                  memory_budget=res * 32 * lic.BAND_BYTES_PER_PIXEL) == out_path
+    texture = np.load(out_path)
+    assert texture.shape == (res, res) and texture.dtype == np.uint8
+    assert abs(texture.mean() - 127.5) < 3
+    assert abs(texture.std() - lic.BANDED_STD) < 0.1 * lic.BANDED_STD
+
+    if not fast:
+        # The same convolution as in memory, up to the contrast stretch
+        # (FastLIC seeds its lines band by band, so it only approximates it)
+        rows, cols = np.indices((res, res))
+        reference = lic.compute_lic(grid.field, grid.bounds, np.asarray(noise[rows, cols]), length)
+        assert np.corrcoef(texture.ravel(), reference.ravel())[0, 1] > 0.98
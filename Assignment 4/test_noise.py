@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+The noise of a NoisePyramid only depends on its kind, seed and base
+resolution, not on the levels asked for before.
+
+@author: Raunak Sarbajna
+"""
+
+import numpy as np
+import pytest
+
+from noise import NOISE_KINDS, NoisePyramid
+
+
+@pytest.mark.parametrize("kind", NOISE_KINDS)
+def test_level_does_not_depend_on_earlier_requests(kind):
+    pyramid = NoisePyramid(kind, seed=7, base_res=256)
+    first = pyramid.level(64).copy()
+    # A finer level, the base, and resolutions outside the pyramid
+    for res in (128, 256, 512, 96):
+        pyramid.level(res)
+    np.testing.assert_array_equal(pyramid.level(64), first)
+
+    fresh = NoisePyramid(kind, seed=7, base_res=256)
+    for res in (512, 96, 256, 128, 64, 32):
+        np.testing.assert_array_equal(fresh.level(res), pyramid.level(res))
+
+
+def test_levels_come_from_the_base():
+    pyramid = NoisePyramid("white", seed=3, base_res=256)
+    base = pyramid.level(256)
+    level = pyramid.level(128)
+    assert level.shape == (128, 128)
+    # The coarse level is the 2x2 average of the base, up to an affine rescale
+    average = base.reshape(128, 2, 128, 2).mean(axis=(1, 3))
+    assert np.corrcoef(level.ravel(), average.ravel())[0, 1] > 0.99
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+The lockstep streamline integrator against vtkStreamTracer over the same
+velocity grid.
+
+@author: Raunak Sarbajna
+"""
+
+import os
+
+import numpy as np
+import pytest
+import vtk
+from vtk.util import numpy_support
+
+import streamlines
+from velocity_grid import VelocityGrid
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data")
+
+# The integrator settings of the Assignment 4 window
+SETTINGS = dict(max_length=1.0, initial_step=0.5, min_step=0.01, max_step=1.0,
+                max_steps=2000, max_error=1e-6)
+
+
+''' The velocity grid of one of the data files '''
+def load_grid(name):
+    reader = vtk.vtkDataSetReader()
+    reader.SetFileName(os.path.join(DATA_DIR, name))
+    reader.Update()
+    return VelocityGrid.from_dataset(reader.GetOutput())
+
+
+''' An n x n grid of seeds at the centers of the cells of a partition of the bounds '''
+def seed_grid(bounds, n):
+    t = (np.arange(n) + 0.5) / n
+    x, y = np.meshgrid(bounds[0] + t * (bounds[1] - bounds[0]), bounds[2] + t * (bounds[3] - bounds[2]))
+    return x.ravel(), y.ravel()
+
+
+'''
+    vtkStreamTracer over a vtkImageData of the grid, in both directions.
+    @return: per seed index, the (backward, forward) halves of its line as
+             (k, 2) arrays starting at the seed, or None
+'''
+def vtk_halves(grid, seed_x, seed_y):
+    ny, nx = grid.shape
+    bounds = grid.bounds
+    image = vtk.vtkImageData()
+    image.SetDimensions(nx, ny, 1)
+    image.SetOrigin(bounds[0], bounds[2], 0.0)
+    image.SetSpacing((bounds[1] - bounds[0]) / (nx - 1), (bounds[3] - bounds[2]) / (ny - 1), 1.0)
+    vectors = np.zeros((nx * ny, 3))
+    vectors[:, :2] = grid.field.reshape(-1, 2)
+    vtk_vectors = numpy_support.numpy_to_vtk(vectors, deep=True)
+    vtk_vectors.SetName("velocity")
+    image.GetPointData().SetVectors(vtk_vectors)
+
+    seed_points = vtk.vtkPoints()
+    seed_points.SetData(numpy_support.numpy_to_vtk(np.column_stack((seed_x, seed_y, 0 * seed_x)), deep=True))
+    seeds = vtk.vtkPolyData()
+    seeds.SetPoints(seed_points)
+
+    tracer = vtk.vtkStreamTracer()
+    tracer.SetInputData(image)
+    tracer.SetSourceData(seeds)
+    tracer.SetIntegratorTypeToRungeKutta45()
+    tracer.SetIntegrationDirectionToBoth()
+    tracer.SetMaximumPropagation(SETTINGS["max_length"])
+    tracer.SetInitialIntegrationStep(SETTINGS["initial_step"])
+    tracer.SetMinimumIntegrationStep(SETTINGS["min_step"])
+    tracer.SetMaximumIntegrationStep(SETTINGS["max_step"])
+    tracer.SetMaximumNumberOfSteps(SETTINGS["max_steps"])
+    tracer.SetMaximumError(SETTINGS["max_error"])
+    tracer.Update()
+    traced = tracer.GetOutput()
+
+    points = numpy_support.vtk_to_numpy(traced.GetPoints().GetData())[:, :2]
+    time = numpy_support.vtk_to_numpy(traced.GetPointData().GetArray("IntegrationTime"))
+    seed_ids = numpy_support.vtk_to_numpy(traced.GetCellData().GetArray("SeedIds"))
+    offsets = numpy_support.vtk_to_numpy(traced.GetLines().GetOffsetsArray())
+    connectivity = numpy_support.vtk_to_numpy(traced.GetLines().GetConnectivityArray())
+    halves = [[np.zeros((1, 2)), np.zeros((1, 2))] for _ in range(seed_x.size)]
+    for k, seed in enumerate(seed_ids):
+        ids = connectivity[offsets[k]:offsets[k + 1]]
+        halves[seed][0 if time[ids[-1]] < 0 else 1] = points[ids]
+    return halves
+
+
+''' The (backward, forward) halves of a line of trace_streamlines that goes through (x, y) '''
+def lockstep_halves(line, x, y):
+    center = np.flatnonzero((line[:, 0] == x) & (line[:, 1] == y))[0]
+    return line[center::-1], line[center:]
+
+
+''' Points at the arc lengths s along a polyline that starts at its first point '''
+def along(line, s):
+    arc = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(line, axis=0).T))))
+    return np.column_stack((np.interp(s, arc, line[:, 0]), np.interp(s, arc, line[:, 1])))
+
+
+@pytest.mark.parametrize("name", ["dipole.vtk", "cnoise.vtk"])
+@pytest.mark.parametrize("lockstep", [True, False])
+def test_trace_matches_stream_tracer(monkeypatch, name, lockstep):
+    # In lockstep however few the seeds, or through vtkStreamTracer in chunks
+    monkeypatch.setattr(streamlines, "LOCKSTEP_MIN_SEEDS", 0 if lockstep else 1000)
+    monkeypatch.setattr(streamlines, "VTK_CHUNK_SEEDS", 10)
+    grid = load_grid(name)
+    seed_x, seed_y = seed_grid(grid.bounds, 8)
+    points, offsets = streamlines.trace_streamlines(grid.field, grid.bounds, seed_x, seed_y, **SETTINGS)
+    expected = vtk_halves(grid, seed_x, seed_y)
+
+    lines = [points[offsets[k]:offsets[k + 1]] for k in range(offsets.size - 1)]
+    assert len(lines) == sum(1 for halves in expected if max(h.shape[0] for h in halves) > 1)
+
+    ny, nx = grid.shape
+    cell = np.hypot((grid.bounds[1] - grid.bounds[0]) / (nx - 1), (grid.bounds[3] - grid.bounds[2]) / (ny - 1))
+    seeds = dict(((x, y), k) for k, (x, y) in enumerate(zip(seed_x, seed_y)))
+    deviations = []
+    for line in lines:
+        k = next(seeds[p] for p in map(tuple, line) if p in seeds)
+        for half, reference in zip(lockstep_halves(line, seed_x[k], seed_y[k]), expected[k]):
+            # The lines may stop a few steps apart, compare them up to the shorter one
+            length = min(np.hypot(*np.diff(half, axis=0).T).sum(), np.hypot(*np.diff(reference, axis=0).T).sum())
+            s = np.linspace(0, length, 50)
+            deviations.append(np.hypot(*(along(half, s) - along(reference, s)).T).max())
+
+    # Over lines about 45 cells long, within a fraction of a cell
+    deviations = np.array(deviations) / cell
+    assert np.median(deviations) < 0.05
+    assert deviations.max() < 0.25
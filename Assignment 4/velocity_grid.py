@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Regular-grid velocity sampler shared by the Assignment 4 visualizations.
+
+Most of the 2D vector fields are regular lattices stored as POLYGONS polydata.
+The lattice is detected when the file is opened and the velocity is copied
+into a contiguous (ny, nx, 2) float32 array; other datasets are resampled
+onto a regular grid once. LIC, the arrow plots and the streamline seeding
+then use the same O(1) bilinear lookup instead of locating cells in the
+polydata.
+
+@author: Raunak Sarbajna
+"""
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+
+'''
+    Resample the point arrays of a vtk dataset onto a regular nx x ny grid
+    covering the dataset bounds. Grid nodes outside the dataset get zeros.
+    @return: a dict mapping every array name to a float32 array of shape
+             (ny, nx, components)
+'''
+def resample_arrays(dataset, nx, ny):
+    bounds = dataset.GetBounds()
+
+    grid = vtk.vtkImageData()
+    grid.SetDimensions(nx, ny, 1)
+    grid.SetOrigin(bounds[0], bounds[2], bounds[4])
+    grid.SetSpacing((bounds[1] - bounds[0]) / (nx - 1),
+                    (bounds[3] - bounds[2]) / (ny - 1), 1)
+
+    probe = vtk.vtkProbeFilter()
+    probe.SetInputData(grid)
+    probe.SetSourceData(dataset)
+    probe.Update()
+
+    arrays = {}
+    point_data = probe.GetOutput().GetPointData()
+    for i in range(dataset.GetPointData().GetNumberOfArrays()):
+        name = dataset.GetPointData().GetArrayName(i)
+        values = numpy_support.vtk_to_numpy(point_data.GetArray(name))
+        # vtkImageData stores x fastest, so the flat array reshapes to (ny, nx, c)
+        arrays[name] = np.ascontiguousarray(values.reshape(ny, nx, -1), dtype=np.float32)
+    return arrays
+
+
+'''
+    Resample the velocity array of a vtk dataset onto a regular nx x ny grid.
+    @return: a float32 array of shape (ny, nx, 2) holding (u, v) per grid node
+'''
+def resample_velocity(dataset, nx, ny, array_name="velocity"):
+    return np.ascontiguousarray(resample_arrays(dataset, nx, ny)[array_name][:, :, :2])
+
+
+'''
+    Sorted distinct values of a coordinate, merging values closer than tol.
+'''
+def _distinct(values, tol):
+    values = np.sort(values)
+    keep = np.concatenate(([True], np.diff(values) > tol))
+    return values[keep]
+
+
+'''
+    Try to read the points of a dataset as a regular lattice.
+    @return: (ix, iy, nx, ny), the lattice index of every point and the
+             lattice size, or None if the points do not form a lattice
+'''
+def detect_lattice(points, bounds):
+    n = points.shape[0]
+    tol = 1e-5 * max(bounds[1] - bounds[0], bounds[3] - bounds[2], 1e-30)
+    xs = _distinct(points[:, 0], tol)
+    ys = _distinct(points[:, 1], tol)
+    nx, ny = len(xs), len(ys)
+    if nx < 2 or ny < 2 or nx * ny != n:
+        return None
+
+    # The spacing has to be uniform for the O(1) lookup
+    dx = np.diff(xs)
+    dy = np.diff(ys)
+    if dx.max() - dx.min() > 1e-3 * dx.mean() or dy.max() - dy.min() > 1e-3 * dy.mean():
+        return None
+
+    ix = np.rint((points[:, 0] - xs[0]) / dx.mean()).astype(np.intp)
+    iy = np.rint((points[:, 1] - ys[0]) / dy.mean()).astype(np.intp)
+    if ix.min() < 0 or ix.max() >= nx or iy.min() < 0 or iy.max() >= ny:
+        return None
+    if np.unique(iy * nx + ix).size != n:
+        return None
+    return ix, iy, nx, ny
+
+
+'''
+    Bilinear lookup of a (ny, nx, components) grid at the world positions
+    (x, y), e.g. (u, v) for the velocity field.
+    x and y are arrays of the same shape; positions are clamped to the grid.
+    @return: one array per component
+'''
+def sample_bilinear(field, bounds, x, y):
+    ny, nx = field.shape[:2]
+    fx = (x - bounds[0]) / (bounds[1] - bounds[0]) * (nx - 1)
+    fy = (y - bounds[2]) / (bounds[3] - bounds[2]) * (ny - 1)
+    fx = np.clip(fx, 0, nx - 1)
+    fy = np.clip(fy, 0, ny - 1)
+
+    i0 = np.minimum(fx.astype(np.intp), nx - 2)
+    j0 = np.minimum(fy.astype(np.intp), ny - 2)
+    tx = fx - i0
+    ty = fy - j0
+    w00 = (1 - tx) * (1 - ty)
+    w10 = tx * (1 - ty)
+    w01 = (1 - tx) * ty
+    w11 = tx * ty
+
+    # Gather from the flattened components, the four corners are k, k + 1,
+    # k + nx and k + nx + 1
+    k = j0 * nx + i0
+    result = []
+    for c in range(field.shape[2]):
+        comp = field[:, :, c].ravel()
+        result.append(np.take(comp, k) * w00 + np.take(comp, k + 1) * w10 +
+                      np.take(comp, k + nx) * w01 + np.take(comp, k + nx + 1) * w11)
+    return tuple(result)
+
+
+'''
+    The velocity of a 2D vector field on a regular grid.
+        field:      contiguous float32 array of shape (ny, nx, 2)
+        bounds:     the dataset bounds (xmin, xmax, ymin, ymax, zmin, zmax)
+        is_lattice: True when field holds the original data values, False
+                    when the dataset had to be resampled
+        scalars:    the one-component point arrays of the dataset (e.g. "s"
+                    in diesel_field1.vtk) on the same grid, by name
+'''
+class VelocityGrid:
+
+    def __init__(self, field, bounds, is_lattice, scalars=None):
+        self.field = np.ascontiguousarray(field, dtype=np.float32)
+        self.bounds = tuple(bounds)
+        self.is_lattice = is_lattice
+        self.scalars = scalars if scalars is not None else {}
+
+    '''
+        Build the grid of a vtk dataset. Lattices are copied as they are,
+        anything else is resampled on a resolution x resolution grid
+        (by default twice the square root of the number of points).
+    '''
+    @classmethod
+    def from_dataset(cls, dataset, array_name="velocity", resolution=None):
+        bounds = dataset.GetBounds()
+        points = numpy_support.vtk_to_numpy(dataset.GetPoints().GetData())
+        point_data = dataset.GetPointData()
+        scalar_names = [point_data.GetArrayName(i) for i in range(point_data.GetNumberOfArrays())
+                        if point_data.GetArray(i).GetNumberOfComponents() == 1]
+
+        lattice = detect_lattice(points, bounds)
+        if lattice is not None:
+            ix, iy, nx, ny = lattice
+            field = np.zeros((ny, nx, 2), dtype=np.float32)
+            field[iy, ix] = numpy_support.vtk_to_numpy(point_data.GetArray(array_name))[:, :2]
+            scalars = {}
+            for name in scalar_names:
+                scalars[name] = np.zeros((ny, nx), dtype=np.float32)
+                scalars[name][iy, ix] = numpy_support.vtk_to_numpy(point_data.GetArray(name))
+            return cls(field, bounds, True, scalars)
+
+        if resolution is None:
+            resolution = max(int(np.ceil(2 * np.sqrt(points.shape[0]))), 2)
+        arrays = resample_arrays(dataset, resolution, resolution)
+        scalars = dict((name, np.ascontiguousarray(arrays[name][:, :, 0])) for name in scalar_names)
+        return cls(arrays[array_name][:, :, :2], bounds, False, scalars)
+
+    @property
+    def shape(self):
+        return self.field.shape[:2]
+
+    ''' Velocity (u, v) at the world positions (x, y) '''
+    def sample(self, x, y):
+        return sample_bilinear(self.field, self.bounds, np.asarray(x), np.asarray(y))
+
+    '''
+        Value of an attribute at the world positions (x, y): "magnitude" is
+        the velocity magnitude, any other name one of the point scalars.
+    '''
+    def attribute(self, name, x, y):
+        if name == "magnitude":
+            u, v = self.sample(x, y)
+            return np.hypot(u, v)
+        return sample_bilinear(self.scalars[name][:, :, None], self.bounds,
+                               np.asarray(x), np.asarray(y))[0]
+
+    ''' True for the positions (x, y) that lie inside the grid bounds '''
+    def contains(self, x, y):
+        b = self.bounds
+        return (x >= b[0]) & (x <= b[1]) & (y >= b[2]) & (y <= b[3])
@@ -8,12 +8,115 @@ Created on Sun Nov 7 23:31:22 2021
 
 import sys
 import math
-import random
+import hashlib
+from collections import OrderedDict
+from functools import partial
+import numpy as np
 import vtk
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5 import Qt
 
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+from vtk.util import numpy_support
+
+import seeding
+import simplify
+from coalesce import RENDER_INTERVAL, CoalescedCall
+
+
+# Number of traced streamline sets kept in memory
+STREAMLINE_CACHE_SIZE = 8
+
+# Seeds and fraction of the propagation length of the streamlines that
+# follow the line widget while it is dragged
+WIDGET_PREVIEW_SEEDS = 8
+WIDGET_PREVIEW_PROPAGATION = 0.25
+
+# Default maximum number of streamline seeds; the n x n x n seed grids
+# are thinned out to stay within it
+STREAMLINE_SEED_BUDGET = 20000
+
+# The seeds are traced in this many chunks, shown as they finish
+STREAMLINE_CHUNKS = 20
+
+
+'''
+    SHA-1 of the content of a file, read in chunks. The same function as
+    lic_cache.file_hash in Assignment 4, copied like coalesce.py and
+    seeding.py so that every assignment folder stays self-contained.
+'''
+def file_hash(file_name):
+    sha = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+'''
+    Background thread for the streamlines: traces the seeds (an (n, 3)
+    array) through dataset with vtkStreamTracer in STREAMLINE_CHUNKS chunks
+    and emits the lines of every finished chunk. Seeds that take long to
+    generate can be given as a function returning the array instead; it is
+    called in the thread and seeds_ready emits the number of seeds. The tracer works on a deep
+    copy of dataset, made on the GUI thread: a shallow copy would share its
+    point and cell arrays with the line widget preview tracer, which runs
+    on the GUI thread at the same time, and VTK filters must not use the
+    same data concurrently. lines_ready emits all the lines once every seed
+    is traced; cancel() stops after the chunk in progress.
+'''
+class StreamlineWorker(QtCore.QThread):
+
+    seeds_ready = QtCore.pyqtSignal(int)
+    chunk_ready = QtCore.pyqtSignal(object)
+    progress = QtCore.pyqtSignal(float)
+    lines_ready = QtCore.pyqtSignal(object)
+
+    def __init__(self, dataset, seeds, max_propagation, parent = None):
+        QtCore.QThread.__init__(self, parent)
+        self.dataset = dataset.NewInstance()
+        self.dataset.DeepCopy(dataset)
+        self.seeds = seeds
+        self.max_propagation = max_propagation
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        seeds = self.seeds
+        if callable(seeds):
+            seeds = seeds()
+            self.seeds_ready.emit(len(seeds))
+        traced = vtk.vtkAppendPolyData()
+        chunks = np.array_split(seeds, min(STREAMLINE_CHUNKS, max(len(seeds), 1)))
+        for i, chunk in enumerate(chunks):
+            if self.cancelled:
+                return
+            # Step 2: Create a vtkStreamTracer object, set input data and seeding points
+            stream_tracer = vtk.vtkStreamTracer()
+            stream_tracer.SetInputData(self.dataset) # set vector field
+            stream_tracer.SetSourceData(seeding.to_polydata(chunk)) # pass in the seeds
+
+            # Step 3: Set the parameters. 
+            # Check the reference https://vtk.org/doc/nightly/html/classvtkStreamTracer.html
+            # to have the full list of parameters
+            stream_tracer.SetMaximumPropagation(self.max_propagation)
+            stream_tracer.SetIntegratorTypeToRungeKutta45()
+            stream_tracer.SetIntegrationDirectionToBoth()
+            stream_tracer.Update()
+
+            if self.cancelled:
+                return
+            lines = vtk.vtkPolyData()
+            lines.ShallowCopy(stream_tracer.GetOutput())
+            traced.AddInputData(lines)
+            self.chunk_ready.emit(lines)
+            self.progress.emit((i + 1) / float(len(chunks)))
+        traced.Update()
+        lines = vtk.vtkPolyData()
+        lines.ShallowCopy(traced.GetOutput())
+        self.lines_ready.emit(lines)
 
 
 '''
@@ -53,6 +156,9 @@ class MainWindow(Qt.QMainWindow):
         
         # The controls will be added here
         self.add_controls()
+
+        # Traced streamlines by settings, least recently used first
+        self.streamline_cache = OrderedDict()
                 
         
     '''
@@ -83,6 +189,13 @@ class MainWindow(Qt.QMainWindow):
         self.bwLut.SetValueRange(0, 1)
         self.bwLut.Build()  # effective built
 
+        # Spin box changes re-render at a capped rate and recompute the
+        # arrows or the simplified lines once for the latest value (see
+        # coalesce.py)
+        self.request_render = CoalescedCall(self.render, RENDER_INTERVAL, self)
+        self.coalesced_arrow_density = CoalescedCall(self.on_arrow_density_change, 0, self)
+        self.coalesced_simplify = CoalescedCall(self.on_simplify_tolerance_change, 0, self)
+
         # Start the vtk screen
         self.ren.ResetCamera()
         self.show()
@@ -134,6 +247,7 @@ class MainWindow(Qt.QMainWindow):
         self.arrow_scale.setValue(0.03)
         self.arrow_scale.setRange(0, 20)
         self.arrow_scale.setSingleStep (0.01)
+        self.arrow_scale.valueChanged.connect(self.on_arrow_scale_change)
         hbox_arrowplot.addWidget(self.arrow_scale)
 
         maxPointsLabel = Qt.QLabel("Choose Maximum Number of Arrows:")
@@ -143,6 +257,8 @@ class MainWindow(Qt.QMainWindow):
         self.max_points.setRange(200, 10000)
         self.max_points.setValue(500)
         self.max_points.setSingleStep (100)
+        self.max_points.setKeyboardTracking(False)
+        self.max_points.valueChanged.connect(self.coalesced_arrow_density)
         hbox_arrowplot.addWidget(self.max_points)
 
         arrow_widget = Qt.QWidget()
@@ -169,6 +285,20 @@ class MainWindow(Qt.QMainWindow):
         #self.groupBox_layout.addWidget(streamline_widget)
         vbox_streamline.addWidget(streamline_hwidget)
 
+        # Upper limit of the number of seeds actually traced
+        hbox_budget = Qt.QHBoxLayout()
+        hbox_budget.addWidget(Qt.QLabel("Seed budget:"))
+        self.seed_budget = Qt.QSpinBox()
+        self.seed_budget.setRange(1, 1000000)
+        self.seed_budget.setSingleStep(1000)
+        self.seed_budget.setValue(STREAMLINE_SEED_BUDGET)
+        hbox_budget.addWidget(self.seed_budget)
+        self.seed_count = Qt.QLabel("")
+        hbox_budget.addWidget(self.seed_count)
+        budget_widget = Qt.QWidget()
+        budget_widget.setLayout(hbox_budget)
+        vbox_streamline.addWidget(budget_widget)
+
         label_seed = Qt.QLabel("Select Seeding Strategy")
         vbox_streamline.addWidget(label_seed)
      
@@ -188,6 +318,12 @@ class MainWindow(Qt.QMainWindow):
         self.widget_seed_radio.setChecked(False)
         self.widget_seed_radio.toggled.connect(self.on_seeding_strategy)
         vbox_seed_strategy.addWidget(self.widget_seed_radio)
+
+        # Blue-noise seeds: "number of seeds" is the total count here
+        self.poisson_seed_radio = Qt.QRadioButton("Poisson-Disk Seeding")
+        self.poisson_seed_radio.setChecked(False)
+        self.poisson_seed_radio.toggled.connect(self.on_seeding_strategy)
+        vbox_seed_strategy.addWidget(self.poisson_seed_radio)
         self.seeding_strategy = 0 # Uniform seeding is the default strategy 
 
         seedingstrategy = Qt.QWidget()
@@ -210,12 +346,29 @@ class MainWindow(Qt.QMainWindow):
         label_render = Qt.QLabel("Select Streamline Type")
         vbox_streamline.addWidget(label_render)
 
-        self.render_strategy = 0
+        self.render_strategy = 2
      
         vbox_renderer = Qt.QVBoxLayout()
         # Add radio buttons for the selection of the seed generation strategy
-        self.tube_radio = Qt.QRadioButton("Tube")
-        self.tube_radio.setChecked(True)
+        # The polylines themselves, shaded as tubes of a width in pixels:
+        # no tube geometry is generated
+        hbox_lines = Qt.QHBoxLayout()
+        self.lines_radio = Qt.QRadioButton("Lines as Tubes")
+        self.lines_radio.setChecked(True)
+        self.lines_radio.toggled.connect(self.on_rendering_strategy)
+        hbox_lines.addWidget(self.lines_radio)
+        hbox_lines.addWidget(Qt.QLabel("    Width:"))
+        self.line_width = Qt.QDoubleSpinBox()
+        self.line_width.setRange(1, 20)
+        self.line_width.setSingleStep(0.5)
+        self.line_width.setValue(3)
+        self.line_width.valueChanged.connect(self.on_line_width_change)
+        hbox_lines.addWidget(self.line_width)
+        vbox_renderer.addLayout(hbox_lines)
+
+        # vtkTubeFilter meshes, for export quality pictures
+        self.tube_radio = Qt.QRadioButton("Tube (export quality)")
+        self.tube_radio.setChecked(False)
         self.tube_radio.toggled.connect(self.on_rendering_strategy)
         vbox_renderer.addWidget(self.tube_radio)
 
@@ -234,6 +387,37 @@ class MainWindow(Qt.QMainWindow):
         render_strategy.setLayout(vbox_renderer)
         vbox_streamline.addWidget(render_strategy)
 
+        # Douglas-Peucker simplification of the traced lines before the tube
+        # or ribbon filter, with a tolerance in percent of the data diagonal
+        hbox_simplify = Qt.QHBoxLayout()
+        hbox_simplify.addWidget(Qt.QLabel("Simplify tolerance (%):"))
+        self.simplify_tolerance = Qt.QDoubleSpinBox()
+        self.simplify_tolerance.setDecimals(3)
+        self.simplify_tolerance.setRange(0, 5)
+        self.simplify_tolerance.setSingleStep(0.05)
+        self.simplify_tolerance.setValue(0.1)
+        self.simplify_tolerance.setKeyboardTracking(False)
+        self.simplify_tolerance.valueChanged.connect(self.coalesced_simplify)
+        hbox_simplify.addWidget(self.simplify_tolerance)
+        self.simplify_count = Qt.QLabel("")
+        hbox_simplify.addWidget(self.simplify_count)
+        simplify_widget = Qt.QWidget()
+        simplify_widget.setLayout(hbox_simplify)
+        vbox_streamline.addWidget(simplify_widget)
+
+        # Progress of the streamlines traced in the background
+        hbox_stream_progress = Qt.QHBoxLayout()
+        self.streamline_progress = Qt.QProgressBar()
+        self.streamline_progress.setRange(0, 100)
+        hbox_stream_progress.addWidget(self.streamline_progress)
+        self.streamline_cancel = Qt.QPushButton("Cancel")
+        self.streamline_cancel.clicked.connect(self.cancel_streamlines)
+        hbox_stream_progress.addWidget(self.streamline_cancel)
+        self.streamline_progress_widget = Qt.QWidget()
+        self.streamline_progress_widget.setLayout(hbox_stream_progress)
+        self.streamline_progress_widget.hide()
+        vbox_streamline.addWidget(self.streamline_progress_widget)
+
         rendering_widgets = Qt.QWidget()
         rendering_widgets.setLayout(vbox_streamline)
         self.groupBox_layout.addWidget(rendering_widgets)     
@@ -264,6 +448,10 @@ class MainWindow(Qt.QMainWindow):
             self.reader = vtk.vtkDataSetReader()
             self.reader.SetFileName(input_file_name)
             self.reader.Update()       
+
+        # The streamline cache keys name the data actually loaded, whatever
+        # the file name field says later on
+        self.data_file_hash = file_hash(input_file_name)
         
         # Some initialization to remove actors that are created previously
             
@@ -273,16 +461,25 @@ class MainWindow(Qt.QMainWindow):
         # You need to modify the following actors' names based on how you define them!!!!!
         if hasattr(self, 'arrow_actor'):
             self.ren.RemoveActor(self.arrow_actor)
+        self.arrow_order = None
         
+        self.cancel_streamlines()
         if hasattr(self, 'streamline_actor'):
             self.ren.RemoveActor(self.streamline_actor)
+            del self.streamline_actor
+
+        # The line widget and its preview tracer belong to the data set
+        if hasattr(self, 'lineWidget'):
+            self.lineWidget.Off()
+            del self.lineWidget
             
         if hasattr(self, 'lic_actor'):
             self.ren.RemoveActor(self.lic_actor) 
 
         self.seeding_strategy = 0 # Uniform seeding is the default strategy
-        self.render_strategy = 0 # Tubes are default
-        self.withinWidget = False # Not within line selector widget
+        self.uniform_seed_radio.setChecked(True)
+        self.render_strategy = 2 # Lines drawn as tubes are default
+        self.lines_radio.setChecked(True)
 
         self.scalar_range = [self.reader.GetOutput().GetScalarRange()[0], self.reader.GetOutput().GetScalarRange()[1]]
         
@@ -323,7 +520,66 @@ class MainWindow(Qt.QMainWindow):
         
 
     
-    ''' Use the vtkGlyph2D filter to show an arrow plot on a 2D surface'''
+    '''
+        Rank the points of the loaded data once as a nested, stratified
+        density pyramid (see seeding.stratified_order) and keep the points and
+        the point arrays in that order, so the arrows for any maximum number
+        of arrows are simply a prefix of these arrays.
+    '''
+    def build_arrow_pyramid(self):
+        dataset = self.reader.GetOutput()
+        bound = dataset.GetBounds()
+        points = seeding.dataset_points(dataset)
+        # Flat data sets are stratified in their plane
+        dims = 3 if bound[5] > bound[4] else 2
+        self.arrow_order = seeding.stratified_order(points, bound, dims, seed=0)
+        self.arrow_points = np.ascontiguousarray(points[self.arrow_order])
+        point_data = dataset.GetPointData()
+        self.arrow_arrays = []
+        for i in range(point_data.GetNumberOfArrays()):
+            values = numpy_support.vtk_to_numpy(point_data.GetArray(i))
+            self.arrow_arrays.append((point_data.GetArrayName(i),
+                                      np.ascontiguousarray(values[self.arrow_order])))
+        self.arrow_scalars_name = point_data.GetScalars().GetName() if point_data.GetScalars() else None
+
+    ''' The first count points of the density pyramid as a vtkPolyData (no copies) '''
+    def arrow_sample(self, count):
+        if getattr(self, 'arrow_order', None) is None:
+            self.build_arrow_pyramid()
+        count = min(int(count), self.arrow_points.shape[0])
+        sample = vtk.vtkPolyData()
+        sample.SetPoints(seeding.to_vtk_points(self.arrow_points[:count]))
+        for name, values in self.arrow_arrays:
+            array = numpy_support.numpy_to_vtk(values[:count], deep=False)
+            array.SetName(name)
+            sample.GetPointData().AddArray(array)
+        sample.GetPointData().SetActiveVectors("velocity")
+        if self.arrow_scalars_name is not None:
+            sample.GetPointData().SetActiveScalars(self.arrow_scalars_name)
+        return sample
+
+    ''' Render the screen; spin box handlers call request_render instead '''
+    def render(self):
+        self.vtkWidget.GetRenderWindow().Render()
+
+    ''' A new maximum number of arrows only swaps the glyph input for another prefix '''
+    def on_arrow_density_change(self):
+        if self.qt_arrow_checkbox.isChecked() == True and hasattr(self, 'arrow_mapper'):
+            self.arrow_mapper.SetInputData(self.arrow_sample(self.max_points.value()))
+            self.request_render()
+
+    ''' A new arrow scale only changes the scale factor of the instanced glyphs '''
+    def on_arrow_scale_change(self):
+        if self.qt_arrow_checkbox.isChecked() == True and hasattr(self, 'arrow_mapper'):
+            self.arrow_mapper.SetScaleFactor(self.arrow_scale.value())
+            self.request_render()
+
+    ''' Show an arrow plot.
+        A vtkGlyph3DMapper draws the one arrow mesh instanced at every sample
+        point, oriented by the velocity and scaled by the point scalars on
+        the GPU, instead of copying the arrow geometry once per point as
+        vtkGlyph3D does.
+    '''
     def on_arrow_checkbox_change(self):
         if self.qt_arrow_checkbox.isChecked() == True:
             
@@ -336,32 +592,27 @@ class MainWindow(Qt.QMainWindow):
             glyphSource.SetGlyphTypeToArrow()
             glyphSource.FilledOff()
 
-            densityFilter = vtk.vtkMaskPoints()
-            densityFilter.SetInputData(self.reader.GetOutput())
-            densityFilter.RandomModeOn() # enable the random sampling mechanism
-            densityFilter.SetRandomModeType(3) #specify the sampling mode
-            # densityFilter.SetMaximumNumberOfPoints(500)
-            densityFilter.SetMaximumNumberOfPoints(int(self.max_points.value()))
-            # print(int(self.max_points.value()))
-            densityFilter.Update()
-
-            glyph3D = vtk.vtkGlyph3D()
-            glyph3D.SetSourceConnection(glyphSource.GetOutputPort())
-            glyph3D.SetInputData(densityFilter.GetOutput())
-            # glyph2D.OrientOn()
-            # glyph3D.SetScaleModeToScaleByVector()
-            glyph3D.SetVectorModeToUseVector()
-            # glyph2D.SetScaleFactor(0.03) # adjust the length of the arrows accordingly
-            # print(self.arrow_scale.value())
-            glyph3D.SetScaleFactor(self.arrow_scale.value()) # adjust the length of the arrows accordingly
-            glyph3D.SetColorModeToColorByScalar()
-            glyph3D.Update()
-
-            arrows_mapper = vtk.vtkPolyDataMapper()
-            arrows_mapper.SetInputConnection(glyph3D.GetOutputPort())
-            arrows_mapper.Update()
+            # The arrow positions are a prefix of the density pyramid, which
+            # is computed once per file
+            arrowSample = self.arrow_sample(self.max_points.value())
+
+            self.arrow_mapper = vtk.vtkGlyph3DMapper()
+            self.arrow_mapper.SetSourceConnection(glyphSource.GetOutputPort())
+            self.arrow_mapper.SetInputData(arrowSample)
+            self.arrow_mapper.OrientOn()
+            self.arrow_mapper.SetOrientationModeToDirection()
+            self.arrow_mapper.SetOrientationArray("velocity")
+            # Scaled and coloured by the point scalars, as vtkGlyph3D did
+            if self.arrow_scalars_name is not None:
+                self.arrow_mapper.ScalingOn()
+                self.arrow_mapper.SetScaleModeToScaleByMagnitude()
+                self.arrow_mapper.SetScaleArray(self.arrow_scalars_name)
+            else:
+                self.arrow_mapper.SetScaleModeToNoDataScaling()
+            self.arrow_mapper.SetScaleFactor(self.arrow_scale.value()) # adjust the length of the arrows accordingly
+
             self.arrow_actor = vtk.vtkActor()
-            self.arrow_actor.SetMapper(arrows_mapper)
+            self.arrow_actor.SetMapper(self.arrow_mapper)
             self.arrow_actor.GetProperty().SetColor(1,0,0) # set the color you want
 
             self.ren.AddActor(self.arrow_actor)
@@ -389,160 +640,371 @@ class MainWindow(Qt.QMainWindow):
             self.random_seed_radio.setChecked(False)
             self.uniform_seed_radio.setChecked(False)
             self.seeding_strategy = 2
+        elif self.poisson_seed_radio.isChecked() ==  True:
+            self.seeding_strategy = 3
 
+        # The line widget is only shown while it seeds the streamlines
+        if self.seeding_strategy != 2 and hasattr(self, 'lineWidget'):
+            self.lineWidget.Off()
+
+    '''
+        A new streamline type reuses the traced lines on display and only
+        reruns the tube or ribbon filter, if any
+    '''
     def on_rendering_strategy(self):
-        if self.tube_radio.isChecked() == True:
-            self.ribbon_radio.setChecked(False)
-            self.render_strategy = 0
+        if self.lines_radio.isChecked() == True:
+            render_strategy = 2
+        elif self.tube_radio.isChecked() == True:
+            render_strategy = 0
         elif self.ribbon_radio.isChecked() ==  True:
-            self.tube_radio.setChecked(False)
-            self.render_strategy = 1
+            render_strategy = 1
+        else:
+            return
+        # The button that is switched off reports the change too
+        if render_strategy == self.render_strategy:
+            return
+        self.render_strategy = render_strategy
 
-   
-    '''         
-        Complete the following function for genenerate uniform seeds 
-        for streamline placement
+        if self.qt_streamline_checkbox.isChecked() == True and hasattr(self, 'streamline_actor'):
+            self.show_streamline_lines(self.streamline_lines)
+            self.vtkWidget.GetRenderWindow().Render()
 
+   
     '''
-    def random_generate_seeds(self):
-        num_seeds = int (self.number_seeds.value())
-        seedPoints = vtk.vtkPoints()
+        Number of the seeds actually traced: count, or the seed budget if
+        that is lower. The number is reported next to the budget.
+    '''
+    def budgeted_seed_count(self, count):
+        self.report_seed_count(min(count, self.seed_budget.value()), count)
+        return min(count, self.seed_budget.value())
 
-        # Generate the uniformly positioned seeds below!!
+    def report_seed_count(self, count, requested):
+        if count < requested:
+            self.seed_count.setText("%d seeds (of %d)" % (count, requested))
+        else:
+            self.seed_count.setText("%d seeds" % count)
 
-        bound = self.reader.GetOutput().GetBounds()
-        print(bound)
-        for i in range(num_seeds):
-            for j in range(num_seeds):
-                for k in range(num_seeds):
-                    x_i = random.randint(0,32768) / 32768.0
-                    y_j = random.randint(0,32768) / 32768.0
-                    z_k = random.randint(0,32768) / 32768.0
-                    x = bound[0] + x_i * (bound[1] - bound[0])
-                    y = bound[2] + y_j * (bound[3] - bound[2])
-                    z = bound[4] + z_k * (bound[5] - bound[4])
-                    seedPoints.InsertNextPoint(x, y, z)
-
-        # Need to put the seed points in a vtkPolyData object
-        seedPolyData  = vtk.vtkPolyData()
-        seedPolyData.SetPoints(seedPoints)
-        return seedPolyData
+    '''
+        Points per axis of the n x n (x n) seed grids within the seed
+        budget. Flat data sets get n x n seeds in their plane.
+    '''
+    def budgeted_grid(self, numb_seeds, bound):
+        dims = 3 if bound[5] > bound[4] else 2
+        n = numb_seeds
+        if n ** dims > self.seed_budget.value():
+            n = int(round(self.seed_budget.value() ** (1.0 / dims)))
+            while n ** dims > self.seed_budget.value():
+                n -= 1
+        self.report_seed_count(n ** dims, numb_seeds ** dims)
+        return n, dims
 
     '''  
         Complete the following function for genenerate random seeds 
-        for streamline placement
+        for streamline placement: n x n x n uniformly distributed random
+        points, at most the seed budget
+    '''
+    def random_generate_seeds(self):
+        num_seeds = int (self.number_seeds.value())
+        bound = self.reader.GetOutput().GetBounds()
+        dims = 3 if bound[5] > bound[4] else 2
+        count = self.budgeted_seed_count(num_seeds ** dims)
+        return seeding.to_polydata(seeding.random_points(bound, count, dims))
+
+    '''         
+        Complete the following function for genenerate uniform seeds 
+        for streamline placement: an n x n x n lattice over the data
+        bounds, made coarser to stay within the seed budget
     '''
     def uniform_generate_seeds(self):
         numb_seeds = int (self.number_seeds.value())
-        seedPoints = vtk.vtkPoints()       
-
-        # Generate the random seeds below!!
-
         bound = self.reader.GetOutput().GetBounds()
-        print(bound)
-        for i in range(numb_seeds):
-            for j in range(numb_seeds):
-                for k in range(numb_seeds):
-                    x_i = i * (1.0/(numb_seeds - 1))
-                    y_j = j * (1.0/(numb_seeds - 1))
-                    z_k = k * (1.0/(numb_seeds - 1))
-                    x = bound[0] + x_i * (bound[1] - bound[0])
-                    y = bound[2] + y_j * (bound[3] - bound[2])
-                    z = bound[4] + z_k * (bound[5] - bound[4])
-                    seedPoints.InsertNextPoint(x, y, z)
-
-        # Need to put the seed points in a vtkPolyData object
-        seedPolyData  = vtk.vtkPolyData()
-        seedPolyData.SetPoints(seedPoints)
-        return seedPolyData
+        n, dims = self.budgeted_grid(numb_seeds, bound)
+        return seeding.to_polydata(seeding.lattice_points(bound, n, dims))
     
+    '''
+        Poisson-disk (blue-noise) seeds: about "number of seeds" points in
+        the data volume, no two closer than the radius that gives this count,
+        and never more than the seed budget. Sampling thousands of them in
+        3D takes seconds, so this only returns the function that samples
+        them; the StreamlineWorker calls it in its thread.
+    '''
+    def poisson_generate_seeds(self):
+        numb_seeds = min(int (self.number_seeds.value()), self.seed_budget.value())
+        bound = self.reader.GetOutput().GetBounds()
+        # Flat data sets are seeded in their plane
+        dims = 3 if bound[5] > bound[4] else 2
+        radius = seeding.radius_for_count(bound, numb_seeds, dims)
+        self.seed_count.setText("Sampling seeds...")
+        return partial(seeding.poisson_disk, bound, radius, dims, max_points=self.seed_budget.value())
+    
+    '''
+        Seeds along the line widget: "number of seeds" points (within the
+        seed budget) evenly spaced between its end points. The widget is
+        created once per data set; dragging it shows a preview of a few
+        short streamlines and releasing it traces the full set.
+    '''
     def widget_generate_seeds(self):
         numb_seeds = int (self.number_seeds.value())
 
-        self.lineWidget = vtk.vtkLineWidget()
-        self.lineWidget.SetCurrentRenderer(self.ren)
-        self.lineWidget.SetInteractor(self.iren)
+        if not hasattr(self, 'lineWidget'):
+            self.lineWidget = vtk.vtkLineWidget()
+            self.lineWidget.SetCurrentRenderer(self.ren)
+            self.lineWidget.SetInteractor(self.iren)
+            self.lineWidget.SetInputData(self.reader.GetOutput())
+            self.lineWidget.SetAlignToYAxis()
+            self.lineWidget.PlaceWidget()
+            # lineWidget.SetKeyPressActivationValue('L')
+            self.lineWidget.ClampToBoundsOn()
+            self.lineWidget.AddObserver("InteractionEvent", self.on_line_widget_interaction)
+            self.lineWidget.AddObserver("EndInteractionEvent", self.on_line_widget_release)
+
+            # Persistent tracer of the preview, over the preview seeds
+            self.widget_preview_seeds = vtk.vtkPolyData()
+            self.widget_tracer = vtk.vtkStreamTracer()
+            self.widget_tracer.SetInputData(self.reader.GetOutput())
+            self.widget_tracer.SetSourceData(self.widget_preview_seeds)
+            self.widget_tracer.SetIntegratorTypeToRungeKutta45()
+            self.widget_tracer.SetIntegrationDirectionToBoth()
+        self.lineWidget.On()
+
+        self.widget_seeds = seeding.to_polydata(self.widget_line_points(self.budgeted_seed_count(numb_seeds)))
+        return self.widget_seeds
+
+    ''' count points evenly spaced between the end points of the line widget '''
+    def widget_line_points(self, count):
+        t = np.linspace(0.0, 1.0, count)[:, None] if count > 1 else np.full((1, 1), 0.5)
+        p1 = np.array(self.lineWidget.GetPoint1())
+        p2 = np.array(self.lineWidget.GetPoint2())
+        return p1 + t * (p2 - p1)
 
-        self.widget_seeds = vtk.vtkPolyData()
-        self.lineWidget.SetInputData(self.reader.GetOutput())
-        self.lineWidget.SetAlignToYAxis()
-        self.lineWidget.PlaceWidget()
-        self.lineWidget.GetPolyData(self.widget_seeds)
-        # lineWidget.SetKeyPressActivationValue('L')
-        self.lineWidget.ClampToBoundsOn()
-        self.withinWidget = True
-        self.lineWidget.AddObserver("EndInteractionEvent", self.on_streamline_checkbox_change)
+    '''
+        While the line widget is dragged, trace a few short streamlines from
+        it with the persistent preview tracer, on the GUI thread
+    '''
+    def on_line_widget_interaction(self, obj, event):
+        if self.qt_streamline_checkbox.isChecked() == False or not hasattr(self, 'streamline_actor'):
+            return
+        self.cancel_streamlines()
+        self.streamline_key = None
+        count = min(WIDGET_PREVIEW_SEEDS, int(self.number_seeds.value()))
+        self.widget_preview_seeds.SetPoints(seeding.to_vtk_points(self.widget_line_points(count)))
+        self.widget_tracer.SetMaximumPropagation(WIDGET_PREVIEW_PROPAGATION * self.propagation_length.value())
+        self.widget_tracer.Update()
+        lines = vtk.vtkPolyData()
+        lines.ShallowCopy(self.widget_tracer.GetOutput())
+        self.show_streamline_lines(lines)
+        self.vtkWidget.GetRenderWindow().Render()
+
+    ''' Released line widget: trace (or reuse) the full set of streamlines '''
+    def on_line_widget_release(self, obj, event):
+        if self.qt_streamline_checkbox.isChecked() == True and self.seeding_strategy == 2:
+            self.on_streamline_checkbox_change()
 
         
+    '''
+        Key of the streamline cache: everything the traced lines depend on.
+        Widget seeds are part of the key by the hash of their coordinates.
+    '''
+    def get_streamline_key(self, seedPolyData=None):
+        key = (self.data_file_hash, self.seeding_strategy,
+               int(self.number_seeds.value()), self.seed_budget.value(),
+               self.propagation_length.value(), "RK45", "both")
+        if seedPolyData is not None:
+            seeds = numpy_support.vtk_to_numpy(seedPolyData.GetPoints().GetData())
+            key += (hashlib.sha1(seeds.tobytes()).hexdigest(),)
+        return key
+
     ''' 
         Complete the following function to generate a set of streamlines
-        from the above generated uniform or random seeds
+        from the above generated uniform or random seeds.
+        The seeds are traced by a StreamlineWorker in the background; the
+        lines (without tubes or ribbons) are shown chunk by chunk, and all
+        of them are swapped in and cached under key at the end. seeds is
+        the seed vtkPolyData, or a function that generates the seeds in the
+        worker thread (see poisson_generate_seeds).
     '''
-    def on_streamline_checkbox_change(self):
-        if self.qt_streamline_checkbox.isChecked() == True:
-            # Step 1: Create seeding points 
-            if (self.withinWidget == False):
-                if self.seeding_strategy == 1: 
-                    seedPolyData = self.random_generate_seeds() # You also can try generate_seeding_line()
-                elif self.seeding_strategy == 0:
-                    seedPolyData = self.uniform_generate_seeds()
-                elif self.seeding_strategy == 2:
-                    self.widget_generate_seeds()
-                    seedPolyData = self.widget_seeds    
-            elif (self.withinWidget == True):
-                seedPolyData = self.widget_seeds
-            
-            self.withinWidget = False
-            # Step 2: Create a vtkStreamTracer object, set input data and seeding points
+    def trace_streamlines(self, key, seeds):
+        if isinstance(seeds, vtk.vtkPolyData):
+            seeds = numpy_support.vtk_to_numpy(seeds.GetPoints().GetData())
+        self.traced_key = key
+        self.traced_lines = vtk.vtkAppendPolyData()
+        self.show_streamline_lines(vtk.vtkPolyData())
+        self.streamline_worker = StreamlineWorker(self.reader.GetOutput(), seeds,
+                                                  int(self.propagation_length.value()), self)
+        self.streamline_worker.seeds_ready.connect(self.on_streamline_seeds)
+        self.streamline_worker.chunk_ready.connect(self.on_streamline_chunk)
+        self.streamline_worker.progress.connect(self.on_streamline_progress)
+        self.streamline_worker.lines_ready.connect(self.on_streamlines_ready)
+        self.streamline_worker.finished.connect(self.streamline_worker.deleteLater)
+        self.streamline_progress.setValue(0)
+        self.streamline_progress_widget.show()
+        self.streamline_worker.start()
+
+    ''' The seeds generated in the worker thread are ready '''
+    def on_streamline_seeds(self, count):
+        if self.sender() is self.streamline_worker:
+            self.seed_count.setText("%d seeds" % count)
+
+    ''' Show the lines traced so far, with a newly finished chunk '''
+    def on_streamline_chunk(self, chunk):
+        # Ignore the chunks of a cancelled worker that were already queued
+        if self.sender() is not self.streamline_worker:
+            return
+        self.traced_lines.AddInputData(chunk)
+        self.traced_lines.Update()
+        partial = vtk.vtkPolyData()
+        partial.ShallowCopy(self.traced_lines.GetOutput())
+        self.show_streamline_lines(partial)
+        self.vtkWidget.GetRenderWindow().Render()
 
-            stream_tracer = vtk.vtkStreamTracer()
-            stream_tracer.SetInputData(self.reader.GetOutput()) # set vector field
-            stream_tracer.SetSourceData(seedPolyData) # pass in the seeds
+    def on_streamline_progress(self, fraction):
+        if self.sender() is self.streamline_worker:
+            self.streamline_progress.setValue(int(100 * fraction))
+
+    ''' All the seeds are traced: cache the lines and show them '''
+    def on_streamlines_ready(self, lines):
+        if self.sender() is not self.streamline_worker:
+            return
+        self.streamline_worker = None
+        self.streamline_progress_widget.hide()
+        self.cache_streamlines(self.traced_key, lines)
+        self.show_streamline_lines(lines)
+        self.vtkWidget.GetRenderWindow().Render()
 
-            # Step 3: Set the parameters. 
-            # Check the reference https://vtk.org/doc/nightly/html/classvtkStreamTracer.html
-            # to have the full list of parameters
+    '''
+        Stop the streamline tracing that is still in progress, if any. The
+        lines traced so far stay on display but are not cached.
+    '''
+    def cancel_streamlines(self):
+        if getattr(self, 'streamline_worker', None) is not None:
+            self.streamline_worker.cancel()
+            self.streamline_worker = None
+            self.streamline_key = None
+        self.streamline_progress_widget.hide()
+
+    ''' Keep the traced lines of key in the streamline cache '''
+    def cache_streamlines(self, key, lines):
+        self.streamline_cache[key] = lines
+        while len(self.streamline_cache) > STREAMLINE_CACHE_SIZE:
+            self.streamline_cache.popitem(last=False)
+        self.streamline_key = key
 
-            stream_tracer.SetMaximumPropagation(int(self.propagation_length.value()))
-            stream_tracer.SetIntegratorTypeToRungeKutta45()
-            stream_tracer.SetIntegrationDirectionToBoth()
-            stream_tracer.Update()
+    '''
+        Display lines, after simplifying them, as lines shaded like tubes
+        or through the tube or ribbon filter
+    '''
+    def show_streamline_lines(self, lines):
+        self.streamline_lines = lines
+        if self.render_strategy == 2:
+            self.stream_filter = None
+            self.stream_mapper.SetInputData(self.simplify_streamlines(lines))
+        else:
+            self.stream_filter = self.streamline_geometry(self.simplify_streamlines(lines))
+            self.stream_mapper.SetInputConnection(self.stream_filter.GetOutputPort())
+        self.streamline_actor.GetProperty().SetRenderLinesAsTubes(self.render_strategy == 2)
+        self.streamline_actor.GetProperty().SetLineWidth(self.line_width.value())
 
-            if self.render_strategy == 0:
-                stream_filter = vtk.vtkTubeFilter()
-                stream_filter.SetInputConnection(stream_tracer.GetOutputPort())
-                stream_filter.SetInputArrayToProcess(1, 0, 0, vtk.vtkDataObject.FIELD_ASSOCIATION_POINTS, "vectors")
-                stream_filter.SetRadius(0.02)
-                stream_filter.SetNumberOfSides(12)
-                stream_filter.SetVaryRadiusToVaryRadiusByVector()
-            elif self.render_strategy == 1:
-                stream_filter = vtk.vtkRibbonFilter()
-                stream_filter.SetInputConnection(stream_tracer.GetOutputPort())
-                stream_filter.SetWidth(0.1)
-                stream_filter.SetWidthFactor(5)
+    ''' A new line width only changes the actor property, no geometry '''
+    def on_line_width_change(self):
+        if hasattr(self, 'streamline_actor'):
+            self.streamline_actor.GetProperty().SetLineWidth(self.line_width.value())
+            self.request_render()
 
+    '''
+        The lines simplified with the tolerance set on the interface (none
+        at 0). The last result is kept, so a new streamline type does not
+        simplify the same lines again.
+    '''
+    def simplify_streamlines(self, lines):
+        bound = self.reader.GetOutput().GetBounds()
+        diagonal = math.sqrt((bound[1] - bound[0]) ** 2 + (bound[3] - bound[2]) ** 2 + (bound[5] - bound[4]) ** 2)
+        tolerance = self.simplify_tolerance.value() / 100.0 * diagonal
+        if getattr(self, 'simplified_from', None) is not lines or self.simplified_tolerance != tolerance:
+            if tolerance > 0 and lines.GetNumberOfCells() > 0:
+                self.simplified_lines = simplify.simplify_polylines(lines, tolerance)
+            else:
+                self.simplified_lines = lines
+            self.simplified_from = lines
+            self.simplified_tolerance = tolerance
+            self.simplify_count.setText("Vertices: %d -> %d" % (lines.GetNumberOfPoints(),
+                                                                  self.simplified_lines.GetNumberOfPoints()))
+        return self.simplified_lines
+
+    ''' A new tolerance only simplifies the traced lines again '''
+    def on_simplify_tolerance_change(self):
+        if self.qt_streamline_checkbox.isChecked() == True and hasattr(self, 'streamline_actor'):
+            self.show_streamline_lines(self.streamline_lines)
+            self.request_render()
+
+    ''' The tube or ribbon filter of the selected streamline type over the traced lines '''
+    def streamline_geometry(self, lines):
+        if self.render_strategy == 0:
+            stream_filter = vtk.vtkTubeFilter()
+            stream_filter.SetInputData(lines)
+            stream_filter.SetInputArrayToProcess(1, 0, 0, vtk.vtkDataObject.FIELD_ASSOCIATION_POINTS, "vectors")
+            stream_filter.SetRadius(0.02)
+            stream_filter.SetNumberOfSides(12)
+            stream_filter.SetVaryRadiusToVaryRadiusByVector()
+        elif self.render_strategy == 1:
+            stream_filter = vtk.vtkRibbonFilter()
+            stream_filter.SetInputData(lines)
+            stream_filter.SetWidth(0.1)
+            stream_filter.SetWidthFactor(5)
+        return stream_filter
 
+    '''
+        Show or hide the streamlines. Traced lines are cached by
+        get_streamline_key, so unticking only hides the actor and ticking
+        again with unchanged settings shows it without tracing anything.
+        Lines that are not cached are traced in the background.
+    '''
+    def on_streamline_checkbox_change(self):
+        self.cancel_streamlines()
+        if self.qt_streamline_checkbox.isChecked() == True:
+            # Step 1: Create seeding points 
+            seedPolyData = None
+            if self.seeding_strategy == 2:
+                seedPolyData = self.widget_generate_seeds()
 
             # Step 4: Visualization
-
-            stream_mapper = vtk.vtkPolyDataMapper()
-            stream_mapper.SetInputConnection(stream_filter.GetOutputPort())
-            stream_mapper.ScalarVisibilityOff()
-            stream_mapper.Update()
-
-            self.streamline_actor = vtk.vtkActor()
-            self.streamline_actor.GetProperty().SetColor(0,0,1)
-            self.streamline_actor.SetMapper(stream_mapper)
-            self.streamline_actor.GetProperty().SetOpacity(0.4)
-            self.streamline_actor.GetProperty().BackfaceCullingOn()
-
-            self.ren.AddActor(self.streamline_actor)
-                    
+            if not hasattr(self, 'streamline_actor'):
+                self.stream_mapper = vtk.vtkPolyDataMapper()
+                self.stream_mapper.ScalarVisibilityOff()
+
+                self.streamline_actor = vtk.vtkActor()
+                self.streamline_actor.GetProperty().SetColor(0,0,1)
+                self.streamline_actor.SetMapper(self.stream_mapper)
+                self.streamline_actor.GetProperty().SetOpacity(0.4)
+                self.streamline_actor.GetProperty().BackfaceCullingOn()
+                self.ren.AddActor(self.streamline_actor)
+                self.streamline_key = None
+
+            key = self.get_streamline_key(seedPolyData)
+            if key != self.streamline_key:
+                lines = self.streamline_cache.pop(key, None)
+                if lines is None:
+                    if seedPolyData is None:
+                        if self.seeding_strategy == 1: 
+                            seedPolyData = self.random_generate_seeds() # You also can try generate_seeding_line()
+                        elif self.seeding_strategy == 0:
+                            seedPolyData = self.uniform_generate_seeds()
+                        elif self.seeding_strategy == 3:
+                            # Sampled in the worker, see poisson_generate_seeds
+                            seedPolyData = self.poisson_generate_seeds()
+                    # Steps 2 and 3 run in the background
+                    self.trace_streamlines(key, seedPolyData)
+                else:
+                    self.cache_streamlines(key, lines)
+                    self.show_streamline_lines(lines)
+
+            self.streamline_actor.VisibilityOn()
         
-        # Turn on the following if you want to disable the streamline visualization
-        # But again you need to modify the "streamline_actor" name based on what you use!!!
+        # Unticking only hides the streamlines, they stay cached
         else:
-            self.ren.RemoveActor(self.streamline_actor)
+            if hasattr(self, 'streamline_actor'):
+                self.streamline_actor.VisibilityOff()
+            if hasattr(self, 'lineWidget'):
+                self.lineWidget.Off()
         
            
         # Re-render the screen
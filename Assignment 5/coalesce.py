@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Event coalescing for sliders and spin boxes.
+
+Dragging a slider emits valueChanged for every intermediate value, far more
+often than a recompute or even a render can follow, and every handler call
+used to run to completion before the next event was looked at. A
+CoalescedCall connected to the signal instead only remembers that a call
+is due: the function runs once the events queued so far are processed, at
+most once per interval, and reads the values of the widgets at that time,
+so the latest value always wins and at most one call is ever pending.
+
+@author: Raunak Sarbajna
+"""
+
+from PyQt5 import QtCore
+
+
+# Shortest time between two renders of a render window, in milliseconds
+# (about 60 frames per second)
+RENDER_INTERVAL = 16
+
+
+'''
+    Calls function (without arguments) at most once per interval
+    milliseconds, however often the CoalescedCall itself is called. Any
+    arguments, like the value a signal passes on, are ignored.
+'''
+class CoalescedCall(QtCore.QObject):
+
+    def __init__(self, function, interval = 0, parent = None):
+        QtCore.QObject.__init__(self, parent)
+        self.function = function
+        self.interval = interval
+        self.last_call = QtCore.QElapsedTimer()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.run)
+
+    ''' Schedule a call, unless one is pending already '''
+    def __call__(self, *args):
+        if not self.timer.isActive():
+            wait = 0
+            if self.last_call.isValid():
+                wait = max(0, self.interval - self.last_call.elapsed())
+            self.timer.start(wait)
+
+    ''' Drop the pending call, if any '''
+    def cancel(self):
+        self.timer.stop()
+
+    def run(self):
+        self.timer.stop()
+        self.last_call.start()
+        self.function()
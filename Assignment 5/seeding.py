@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Seed point generators for streamline placement, in 2D and 3D.
+
+All generators return NumPy arrays of shape (n, 3) and are vectorized;
+to_vtk_points / to_polydata hand them over to VTK without per-point
+InsertNextPoint calls. poisson_disk gives blue-noise (Poisson-disk) seeds:
+no two seeds are closer than a given radius, so the domain is covered
+evenly with far fewer seeds than a lattice or independent random points.
+stratified_order ranks the points of a data set so that every prefix is
+spatially even, for glyph sets of any density.
+
+@author: Raunak Sarbajna
+"""
+
+import itertools
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+
+# Number of Poisson-disk samples per unit volume, times radius**dims, that
+# Bridson's algorithm reaches with k = 30 (measured on the unit square/cube)
+_POISSON_DENSITY = {2: 0.64, 3: 0.63}
+
+
+''' Lower corner, size and number of dimensions of the domain given by bounds '''
+def _domain(bounds, dims):
+    lo = np.array(bounds[0:2 * dims:2], dtype=np.float64)
+    hi = np.array(bounds[1:2 * dims:2], dtype=np.float64)
+    return lo, hi - lo
+
+
+''' Pad (n, dims) points to (n, 3), filling the missing coordinates from bounds '''
+def _to_3d(points, bounds):
+    out = np.empty((points.shape[0], 3), dtype=np.float64)
+    out[:, :points.shape[1]] = points
+    for axis in range(points.shape[1], 3):
+        out[:, axis] = bounds[2 * axis]
+    return out
+
+
+'''
+    n points per axis on a regular lattice covering bounds, corners included.
+    dims is 2 (z = zmin) or 3.
+'''
+def lattice_points(bounds, n, dims=2):
+    lo, size = _domain(bounds, dims)
+    t = np.linspace(0.0, 1.0, n) if n > 1 else np.zeros(1)
+    axes = [lo[d] + t * size[d] for d in range(dims)]
+    grid = np.meshgrid(*axes, indexing='ij')
+    return _to_3d(np.column_stack([g.ravel() for g in grid]), bounds)
+
+
+''' count independent, uniformly distributed random points in bounds '''
+def random_points(bounds, count, dims=2, seed=None):
+    lo, size = _domain(bounds, dims)
+    rng = np.random.default_rng(seed)
+    return _to_3d(lo + rng.random((count, dims)) * size, bounds)
+
+
+''' Poisson-disk radius that gives about count samples in bounds '''
+def radius_for_count(bounds, count, dims=2):
+    _, size = _domain(bounds, dims)
+    volume = np.prod(np.maximum(size, 1e-30))
+    return float((_POISSON_DENSITY[dims] * volume / max(count, 1)) ** (1.0 / dims))
+
+
+'''
+    Offsets of the background grid cells that can hold a sample closer than
+    radius to a point of cell (0, ..., 0), for cells of size radius / sqrt(dims).
+'''
+def _neighbour_offsets(dims):
+    offsets = np.array(list(itertools.product(range(-2, 3), repeat=dims)), dtype=np.intp)
+    gap = np.maximum(np.abs(offsets) - 1, 0)
+    return offsets[(gap * gap).sum(axis=1) < dims]
+
+
+'''
+    Poisson-disk samples (Bridson 2007): points in bounds with no two closer
+    than radius, added until no more fit.
+        dims:       2 (z = zmin) or 3
+        k:          candidates tried around an active sample before it retires
+        max_points: stop early after this many samples
+        batch:      active samples processed together per iteration
+    A background grid of cells of size radius / sqrt(dims) holds at most one
+    sample per cell, so a candidate only needs to be tested against the few
+    cells around it. The candidates of a batch of active samples are tested
+    against the grid together as arrays, a chunk of candidates at a time
+    for the samples that have not found a valid one yet. The first valid
+    candidate of every active sample is accepted unless it is too close to
+    one accepted before it in the same batch; samples without any retire.
+'''
+def poisson_disk(bounds, radius, dims=2, k=30, seed=None, max_points=None, batch=64, chunk=6):
+    lo, size = _domain(bounds, dims)
+    rng = np.random.default_rng(seed)
+    cell = radius / np.sqrt(dims)
+    shape = np.maximum(np.ceil(size / cell).astype(np.intp), 1)
+    grid = np.full(int(np.prod(shape)), -1, dtype=np.intp)
+    offsets = _neighbour_offsets(dims)
+    r2 = radius * radius
+    if max_points is None:
+        max_points = np.inf
+
+    capacity = 1024
+    points = np.empty((capacity, dims))
+    points[0] = lo + rng.random(dims) * size
+    grid[np.ravel_multi_index(tuple(np.minimum((points[0] - lo) / cell, shape - 1).astype(np.intp)),
+                              shape)] = 0
+    n = 1
+    active = np.array([0], dtype=np.intp)
+
+    while active.size > 0 and n < max_points:
+        pick = rng.permutation(active.size)[:batch]
+        centers = points[active[pick]]
+        new = np.empty((pick.size, dims))
+        new_cell = np.empty(pick.size, dtype=np.intp)
+        found = np.zeros(pick.size, dtype=bool)
+
+        for _ in range(0, k, chunk):
+            rows = np.flatnonzero(~found)
+            if rows.size == 0:
+                break
+            # Candidates in the annulus between radius and 2 * radius
+            dirs = rng.standard_normal((rows.size, chunk, dims))
+            dirs /= np.linalg.norm(dirs, axis=2)[:, :, None]
+            cand = centers[rows, None, :] + dirs * (radius * (1.0 + rng.random((rows.size, chunk))))[:, :, None]
+            cidx = np.clip(((cand - lo) / cell).astype(np.intp), 0, shape - 1)
+            flat_cell = np.ravel_multi_index(tuple(np.moveaxis(cidx, 2, 0)), shape)
+
+            # Only candidates inside the domain and in an empty cell can be
+            # valid; these are tested against the samples of the cells around
+            ok = np.all((cand >= lo) & (cand <= lo + size), axis=2) & (grid[flat_cell] < 0)
+            test = np.flatnonzero(ok)
+            nb = cidx.reshape(-1, dims)[test][:, None, :] + offsets
+            valid = np.all((nb >= 0) & (nb < shape), axis=2)
+            ids = grid[np.ravel_multi_index(tuple(np.moveaxis(nb, 2, 0)), shape, mode='clip')]
+            ids = np.where(valid, ids, -1)
+            d2 = ((points[np.maximum(ids, 0)] - cand.reshape(-1, dims)[test][:, None, :]) ** 2).sum(axis=2)
+            ok.ravel()[test] = np.all((ids < 0) | (d2 >= r2), axis=1)
+
+            has = ok.any(axis=1)
+            first = np.argmax(ok[has], axis=1)
+            hit = rows[has]
+            new[hit] = cand[has, first]
+            new_cell[hit] = flat_cell[has, first]
+            found[hit] = True
+
+        # Accept the new samples that keep their distance to each other
+        rows = np.flatnonzero(found)
+        close = ((new[rows, None, :] - new[None, rows, :]) ** 2).sum(axis=2) < r2
+        accepted = []
+        for i in range(rows.size):
+            if n + len(accepted) >= max_points:
+                break
+            if not close[i, accepted].any():
+                accepted.append(i)
+        accepted = rows[accepted]
+
+        m = accepted.size
+        while n + m > capacity:
+            capacity *= 2
+            points = np.resize(points, (capacity, dims))
+        points[n:n + m] = new[accepted]
+        grid[new_cell[accepted]] = np.arange(n, n + m)
+
+        retired = np.zeros(active.size, dtype=bool)
+        retired[pick[~found]] = True
+        active = np.concatenate((active[~retired], np.arange(n, n + m)))
+        n += m
+
+    return _to_3d(points[:n], bounds)
+
+
+'''
+    The (n, 3) point coordinates of a vtk data set; image data, which has no
+    point array, gets them from its origin, spacing and dimensions.
+'''
+def dataset_points(dataset):
+    if isinstance(dataset, vtk.vtkImageData):
+        nx, ny, nz = dataset.GetDimensions()
+        origin = dataset.GetOrigin()
+        spacing = dataset.GetSpacing()
+        # Image points are ordered x fastest, then y, then z
+        z, y, x = np.meshgrid(origin[2] + spacing[2] * np.arange(nz),
+                              origin[1] + spacing[1] * np.arange(ny),
+                              origin[0] + spacing[0] * np.arange(nx), indexing='ij')
+        return np.column_stack((x.ravel(), y.ravel(), z.ravel()))
+    return numpy_support.vtk_to_numpy(dataset.GetPoints().GetData()).astype(np.float64)
+
+
+'''
+    A nested, stratified density pyramid over points, as one permutation.
+    Level l splits bounds into 2^l cells per axis and adds the point closest
+    to the center of every cell that holds no point of a coarser level yet;
+    the points of
+    a level are ordered by the bit-reversed Morton code of their cell, so
+    that any part of a level is spread over the whole domain too. Every
+    prefix of the returned order is thus a subset of the longer ones and
+    covers the domain evenly.
+    Points left once every cell holds a single point come last.
+    @return: an index array ordering all the points
+'''
+def stratified_order(points, bounds, dims=2, seed=None):
+    rng = np.random.default_rng(seed)
+    lo, size = _domain(bounds, dims)
+    unit = (points[:, :dims] - lo) / np.maximum(size, 1e-30)
+    unit = np.clip(unit, 0.0, 1.0 - 1e-12)
+    n = points.shape[0]
+
+    chosen = np.zeros(n, dtype=bool)
+    order = []
+    level = 0
+    while not chosen.all():
+        cells = 1 << level
+        idx = (unit * cells).astype(np.int64)
+        cell_id = np.ravel_multi_index(tuple(idx.T), (cells,) * dims)
+
+        # Cells already holding a point of a coarser level are skipped
+        taken = np.zeros(cells ** dims, dtype=bool)
+        taken[cell_id[chosen]] = True
+        free = np.flatnonzero(~chosen & ~taken[cell_id])
+
+        # One point per free cell, the one closest to the cell center (ties
+        # broken at random)
+        free = free[rng.permutation(free.size)]
+        offset = ((unit[free] * cells - idx[free] - 0.5) ** 2).sum(axis=1)
+        free = free[np.lexsort((offset, cell_id[free]))]
+        _, first = np.unique(cell_id[free], return_index=True)
+        picked = free[first]
+
+        # Bit-reversed Morton order: consecutive cells are far apart
+        key = np.zeros(picked.size, dtype=np.int64)
+        for bit in range(level):
+            for axis in range(dims):
+                key |= ((idx[picked, axis] >> bit) & 1) << (dims * level - 1 - (bit * dims + axis))
+        order.append(picked[np.argsort(key, kind='stable')])
+        chosen[picked] = True
+
+        # Every cell holds at most one point: the rest goes in random order
+        if np.unique(cell_id).size == n or cells ** dims >= 64 * n:
+            rest = np.flatnonzero(~chosen)
+            order.append(rest[rng.permutation(rest.size)])
+            break
+        level += 1
+    return np.concatenate(order)
+
+
+'''
+    A vtkPoints holding an (n, 3) array. With deep=False the vtkPoints is a
+    view of the array (numpy_support keeps a reference to it), so no point
+    is copied.
+'''
+def to_vtk_points(points, deep=False):
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(points, deep=deep))
+    return vtk_points
+
+
+''' The seeds as a vtkPolyData, as the source of a streamline tracer '''
+def to_polydata(points, deep=False):
+    polydata = vtk.vtkPolyData()
+    polydata.SetPoints(to_vtk_points(points, deep))
+    return polydata
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Polyline simplification for traced streamlines.
+
+vtkStreamTracer puts many points on the straight parts of a line, and each
+of them becomes a ring of the tube or ribbon. douglas_peucker drops the
+points that lie within a tolerance of the simplified line, for all the lines
+at once: every refinement step handles the open spans of all the lines as
+one set of NumPy arrays, so the number of Python iterations only grows with
+the depth of the recursion, not with the number of lines or points.
+
+@author: Raunak Sarbajna
+"""
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+
+'''
+    Douglas-Peucker simplification of polylines.
+        points:    (m, 3) points of all the lines one after the other
+        offsets:   start of every line in points, with a final entry of m
+        tolerance: maximum distance of a dropped point to the simplified line
+    Both ends of every line are kept. Each span between two kept points is
+    split at its point farthest from the segment joining them, as long as
+    that point is farther than tolerance.
+    @return: a boolean mask of the points to keep
+'''
+def douglas_peucker(points, offsets, tolerance):
+    keep = np.zeros(points.shape[0], dtype=bool)
+    sizes = np.diff(offsets)
+    keep[offsets[:-1][sizes > 0]] = True
+    keep[offsets[1:][sizes > 0] - 1] = True
+    first = offsets[:-1][sizes > 2]
+    last = offsets[1:][sizes > 2] - 1
+    tolerance2 = tolerance * tolerance
+
+    while first.size > 0:
+        # The points strictly inside every span, span by span
+        inner = last - first - 1
+        starts = np.cumsum(inner) - inner
+        span = np.repeat(np.arange(first.size), inner)
+        pos = first[span] + 1 + np.arange(span.size) - starts[span]
+
+        # Squared distance of every point to the segment of its span
+        a = points[first[span]]
+        ab = points[last[span]] - a
+        ap = points[pos] - a
+        length2 = (ab * ab).sum(axis=1)
+        t = np.clip((ap * ab).sum(axis=1) / np.where(length2 > 0, length2, 1.0), 0.0, 1.0)
+        d2 = ((ap - t[:, None] * ab) ** 2).sum(axis=1)
+
+        # Split every span at its farthest point, if it is too far
+        d2_max = np.maximum.reduceat(d2, starts)
+        at = np.flatnonzero(d2 == d2_max[span])
+        _, farthest = np.unique(span[at], return_index=True)
+        split = pos[at[farthest]]
+        far = d2_max > tolerance2
+        split = split[far]
+        keep[split] = True
+
+        first = np.concatenate((first[far], split))
+        last = np.concatenate((split, last[far]))
+        open_spans = last - first > 1
+        first, last = first[open_spans], last[open_spans]
+    return keep
+
+
+'''
+    Simplify the polylines of a vtkPolyData (lines only, like the output of
+    vtkStreamTracer) with douglas_peucker. The point data arrays follow the
+    kept points and the cell data is passed on, since no line is dropped.
+    @return: a new vtkPolyData
+'''
+def simplify_polylines(polydata, tolerance):
+    lines = polydata.GetLines()
+    offsets = numpy_support.vtk_to_numpy(lines.GetOffsetsArray()).astype(np.intp)
+    ids = numpy_support.vtk_to_numpy(lines.GetConnectivityArray()).astype(np.intp)
+    points = numpy_support.vtk_to_numpy(polydata.GetPoints().GetData())
+
+    keep = douglas_peucker(points[ids].astype(np.float64), offsets, tolerance)
+    kept = ids[keep]
+    kept_before = np.concatenate(([0], np.cumsum(keep)))
+
+    simplified = vtk.vtkPolyData()
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_support.numpy_to_vtk(points[kept], deep=True))
+    simplified.SetPoints(vtk_points)
+
+    cells = vtk.vtkCellArray()
+    cells.SetData(numpy_support.numpy_to_vtkIdTypeArray(kept_before[offsets].astype(np.int64), deep=True),
+                  numpy_support.numpy_to_vtkIdTypeArray(np.arange(kept.size, dtype=np.int64), deep=True))
+    simplified.SetLines(cells)
+
+    point_data = polydata.GetPointData()
+    for i in range(point_data.GetNumberOfArrays()):
+        if point_data.GetArray(i) is None:
+            continue
+        values = numpy_support.vtk_to_numpy(point_data.GetArray(i))
+        array = numpy_support.numpy_to_vtk(np.ascontiguousarray(values[kept]), deep=True,
+                                           array_type=point_data.GetArray(i).GetDataType())
+        array.SetName(point_data.GetArrayName(i))
+        simplified.GetPointData().AddArray(array)
+    for active, set_active in ((point_data.GetScalars(), simplified.GetPointData().SetActiveScalars),
+                               (point_data.GetVectors(), simplified.GetPointData().SetActiveVectors),
+                               (point_data.GetNormals(), simplified.GetPointData().SetActiveNormals)):
+        if active is not None:
+            set_active(active.GetName())
+    simplified.GetCellData().ShallowCopy(polydata.GetCellData())
+    return simplified